@@ -11,11 +11,15 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
-import database_postgres as db
+import storage
+import dashboard
 import io
 
 st.set_page_config(page_title="RESTO v3", page_icon="🍽️", layout="wide", initial_sidebar_state="expanded")
 
+# database_postgres or database (SQLite) by RESTO_BACKEND / backend in the [database] secrets
+db = storage.get_backend()
+
 # ============================================================================
 # AUTHENTICATION
 # ============================================================================
@@ -157,20 +161,18 @@ if not st.session_state.authenticated:
 
 # ============================================================================
 # CACHED HELPER FUNCTIONS - Must be defined before loading screen
+# (reference data is one shared snapshot per process, see reference_data.py;
+# use db.get_reference_data() for lookups by name/ID)
 # ============================================================================
-@st.cache_data(ttl=3600)  # 1 hour cache
 def get_managers():
     return db.get_operational_managers()
 
-@st.cache_data(ttl=3600)  # 1 hour cache
 def get_locs():
     return db.get_locations()
 
-@st.cache_data(ttl=3600)  # 1 hour cache
 def get_kpis():
     return db.get_kpi_definitions()
 
-@st.cache_data(ttl=3600)  # 1 hour cache
 def get_depts():
     return db.get_departments()
 
@@ -179,10 +181,14 @@ def init_db_once():
     """Initialize database tables - runs only once per session"""
     db.init_database()
     db.insert_default_data()
+    db.start_change_listener()
+    db.start_recalc_worker()
     return True
 
 # Initialize database
 init_db_once()
+# Statements of this rerun are counted per page (Admin → 🔍 Debug)
+db.begin_rerun("Načítání" if not st.session_state.get('data_loaded', False) else None)
 
 # ============================================================================
 # LOADING SCREEN - Pre-load data after login
@@ -1185,6 +1191,34 @@ if 'save_message_type' not in st.session_state:
     st.session_state.save_message_type = None
 if 'dark_mode' not in st.session_state:
     st.session_state.dark_mode = True  # Default: dark mode
+if 'recalc_months' not in st.session_state:
+    st.session_state.recalc_months = []  # months queued for recalculation by this session
+
+def queue_recalculation(months, scope='FULL'):
+    """Queue a background recalculation and watch its months in the sidebar"""
+    db.enqueue_recalculation(months, scope=scope)
+    st.session_state.recalc_months = sorted(set(st.session_state.recalc_months) | set(months))
+
+def show_recalc_status():
+    """Sidebar status of the recalculations this session is waiting for"""
+    watched = st.session_state.recalc_months
+    if not watched:
+        return
+    jobs = db.get_recalc_status(watched)
+    open_jobs = jobs[jobs['status'].isin(['PENDING', 'RUNNING'])]
+    if open_jobs.empty:
+        failed = jobs[jobs['status'] == 'FAILED']
+        for _, job in failed.iterrows():
+            st.error(f"❌ Přepočet {format_month(job['mesic'])} selhal: {job['message']}")
+        if failed.empty:
+            st.toast(f"✅ Bonusy přepočítány ({jobs['processed'].fillna(0).astype(int).sum()} záznamů)")
+        st.session_state.recalc_months = []
+        return
+    done = len(jobs) - len(open_jobs)
+    running = open_jobs.loc[open_jobs['status'] == 'RUNNING', 'mesic']
+    st.progress(done / len(jobs), text=f"⏳ Přepočet bonusů: {done}/{len(jobs)} měsíců" +
+                (f" (běží {format_month(running.iloc[0])})" if not running.empty else ""))
+    st.button("🔄 Stav přepočtu", key="recalc_status_btn", use_container_width=True)
 
 # SIDEBAR
 with st.sidebar:
@@ -1216,6 +1250,7 @@ with st.sidebar:
             "📊 Přehled",
             "📈 Detail",
             "👥 Porovnání",
+            "📉 Trend",
             "📝 Zadání"
         ], label_visibility="collapsed")
     elif category == "Marketing KPI":
@@ -1223,6 +1258,7 @@ with st.sidebar:
         st.info("🚧 Sekce v přípravě\n\nMarketing KPI budou přidány v budoucí verzi.")
     else:  # Admin
         page = "⚙️ Admin"
+    db.set_rerun_page(page)
 
     st.markdown("---")
 
@@ -1277,9 +1313,10 @@ with st.sidebar:
     # Refresh cache button
     st.markdown("---")
     if st.button("🔄 Obnovit data", use_container_width=True, help="Vyčistí cache a načte nejnovější data z databáze"):
-        st.cache_data.clear()
+        db.clear_cache()
         st.session_state.data_loaded = False
         st.rerun()
+    show_recalc_status()
 
     # Logout and theme buttons
     if st.button("🚪 Odhlásit", use_container_width=True):
@@ -1309,56 +1346,43 @@ if page == "📊 Přehled":
     col1, col2 = st.columns([3, 1])
     with col2:
         if st.button("🔄 Přepočítat bonusy", use_container_width=True):
-            with st.spinner("Počítám bonusy..."):
-                processed = db.calculate_monthly_kpi_evaluation(selected_month, verbose=True)
-                db.calculate_department_summary(selected_month)
-            # Clear cache to show updated results
-            st.cache_data.clear()
-            if processed > 0:
-                st.success(f"✅ Přepočítáno {processed} záznamů")
-            else:
-                st.warning("⚠️ Žádná data k přepočítání pro tento měsíc")
+            # Runs in the background worker, progress is shown in the sidebar
+            queue_recalculation([selected_month])
             st.rerun()
 
     st.markdown("---")
 
-    # Get all managers
+    # Get all managers and locations plus the month's cube rows once per rerun
     managers = get_managers()
 
     if managers.empty:
         st.warning("Žádní provozní manažeři v databázi")
     else:
+        all_locations = get_locs()
+        overview = dashboard.manager_overview(managers, db.get_manager_kpi_summary(selected_month))
+        eval_by_location = dashboard.location_details(db.get_manager_kpi_details(selected_month))
+
         # Display each manager's results (like Excel Výsledky sheets)
         for _, manager in managers.iterrows():
             st.markdown(f"### 👤 {manager['jmeno']} ({manager['department']})")
 
-            # Get locations for this manager's department
-            # Convert DataFrame value to Python int before passing to DB
+            # Locations of this manager's department
+            manager_id = safe_int_id(manager['id'])
             dept_id = safe_int_id(manager['department_id'])
-            locs_in_dept = db.get_locations_by_department(dept_id)
+            locs_in_dept = all_locations[all_locations['department_id'] == dept_id]
 
             if locs_in_dept.empty:
                 st.info(f"ℹ️ Oddělení **{manager['department']}** nemá přiřazené žádné lokality. Přidejte lokality v sekci Admin → Lokality.")
                 continue
 
-            # Calculate total bonus for this manager across all locations in department
-            total_bonus = 0
-            total_kpis = 0
-            met_kpis = 0
-            locations_with_data = 0
-
-            for _, loc in locs_in_dept.iterrows():
-                eval_data = db.get_monthly_kpi_evaluation(selected_month, safe_int_id(loc['id']))
-                if not eval_data.empty:
-                    total_bonus += eval_data['bonus_procento'].sum()
-                    total_kpis += len(eval_data)
-                    met_kpis += eval_data['splneno'].sum()
-                    locations_with_data += 1
-
-            avg_bonus = total_bonus / len(locs_in_dept) if len(locs_in_dept) > 0 else 0
+            # Totals for this manager across all locations in department
+            manager_overview = overview.loc[manager_id]
+            avg_bonus = manager_overview['avg_bonus']
+            total_kpis = int(manager_overview['total_kpis'])
+            met_kpis = int(manager_overview['met_kpis'])
 
             # Show warning if no data
-            if locations_with_data == 0:
+            if manager_overview['locations_with_data'] == 0:
                 st.warning(f"⚠️ Žádná lokalita v oddělení **{manager['department']}** nemá vyhodnocená data pro {format_month(selected_month)}. Zadejte data v sekci 📝 Zadání a klikněte na 🔄 Přepočítat bonusy.")
 
             # Display bonus card
@@ -1387,9 +1411,9 @@ if page == "📊 Přehled":
                 for _, loc in locs_in_dept.iterrows():
                     st.markdown(f"**📍 {loc['nazev']}**")
 
-                    eval_data = db.get_monthly_kpi_evaluation(selected_month, safe_int_id(loc['id']))
+                    eval_data = eval_by_location.get((manager_id, safe_int_id(loc['id'])))
 
-                    if eval_data.empty:
+                    if eval_data is None or eval_data.empty:
                         st.info(f"ℹ️ Žádná data pro {loc['nazev']} v {format_month(selected_month)}")
                     else:
                         # Display KPI table like Excel
@@ -1435,30 +1459,13 @@ elif page == "📈 Detail":
 
     st.markdown("---")
 
-    # Get evaluation data
-    eval_data = db.get_monthly_kpi_evaluation(selected_month)
+    # Evaluated KPIs with manager and location names (precomputed cube, one query)
+    eval_with_manager = db.get_manager_kpi_details(selected_month)
 
-    if eval_data.empty:
+    if eval_with_manager.empty:
         st.warning(f"⚠️ Žádná data pro {format_month(selected_month)}")
         st.info("💡 **Co udělat:**\n1. Přejděte do 'Zadání dat' a zadejte data\n2. Zajistěte že máte definované KPI hranice v 'Nastavení > KPI Hranice'\n3. Přejděte do 'Nastavení > Debug' a klikněte na 'Přepočítat bonusy'")
     else:
-        # Join with managers data
-        locs = get_locs()
-        managers = get_managers()
-
-        # Merge to get manager names
-        eval_with_manager = eval_data.merge(
-            locs[['id', 'nazev', 'department_id']],
-            left_on='location_id',
-            right_on='id',
-            suffixes=('', '_loc')
-        )
-        eval_with_manager = eval_with_manager.merge(
-            managers[['department_id', 'jmeno']],
-            on='department_id',
-            suffixes=('', '_mgr')
-        )
-
         # Apply filters
         if selected_manager != "Všichni":
             eval_with_manager = eval_with_manager[eval_with_manager['jmeno'] == selected_manager]
@@ -1473,7 +1480,7 @@ elif page == "📈 Detail":
             st.markdown("### 📊 Tabulka výsledků")
 
             display_df = eval_with_manager[[
-                'jmeno', 'nazev', 'kpi_nazev', 'hodnota', 'jednotka', 'splneno', 'bonus_procento'
+                'jmeno', 'location', 'kpi_nazev', 'hodnota', 'jednotka', 'splneno', 'bonus_procento'
             ]].copy()
             display_df.columns = ['Provozní', 'Lokalita', 'KPI', 'Hodnota', 'Jednotka', 'Splněno', 'Bonus (%)']
             display_df['Splněno'] = display_df['Splněno'].map({1: '✅ ANO', 0: '❌ NE'})
@@ -1526,45 +1533,14 @@ elif page == "👥 Porovnání":
     st.markdown(f"### Měsíc: **{format_month(selected_month)}**")
 
     managers = get_managers()
-    eval_data = db.get_monthly_kpi_evaluation(selected_month)
+    details = db.get_manager_kpi_details(selected_month)
 
-    if eval_data.empty:
+    if details.empty:
         st.warning(f"⚠️ Žádná data pro {format_month(selected_month)}")
         st.info("💡 **Co udělat:**\n1. Přejděte do 'Zadání dat' a zadejte data\n2. Zajistěte že máte definované KPI hranice v 'Nastavení > KPI Hranice'\n3. Přejděte do 'Nastavení > Debug' a klikněte na 'Přepočítat bonusy'")
     else:
-        # Calculate summary for each manager
-        locs = get_locs()
-
-        summary_data = []
-        for _, manager in managers.iterrows():
-            # Get locations for this manager's department
-            locs_in_dept = locs[locs['department_id'] == manager['department_id']]
-
-            total_bonus = 0
-            total_kpis = 0
-            met_kpis = 0
-
-            for _, loc in locs_in_dept.iterrows():
-                loc_eval = eval_data[eval_data['location_id'] == loc['id']]
-                if not loc_eval.empty:
-                    total_bonus += loc_eval['bonus_procento'].sum()
-                    total_kpis += len(loc_eval)
-                    met_kpis += loc_eval['splneno'].sum()
-
-            avg_bonus = total_bonus / len(locs_in_dept) if len(locs_in_dept) > 0 else 0
-            success_rate = (met_kpis / total_kpis * 100) if total_kpis > 0 else 0
-
-            summary_data.append({
-                'Provozní': manager['jmeno'],
-                'Oddělení': manager['department'],
-                'Počet lokalit': len(locs_in_dept),
-                'Celkový bonus (%)': round(avg_bonus, 1),
-                'Splněno KPI': met_kpis,
-                'Celkem KPI': total_kpis,
-                'Úspěšnost (%)': round(success_rate, 1)
-            })
-
-        summary_df = pd.DataFrame(summary_data)
+        # Summary for each manager (precomputed in the KPI cube)
+        summary_df = dashboard.manager_comparison(managers, db.get_manager_kpi_summary(selected_month))
 
         # Display summary table
         st.markdown("### 📊 Přehledová tabulka")
@@ -1605,36 +1581,84 @@ elif page == "👥 Porovnání":
         # Create pivot table for each KPI showing performance across managers
         kpis = get_kpis()
 
+        tables_by_kpi = dashboard.kpi_breakdown(details)
+
         for _, kpi in kpis.iterrows():
             with st.expander(f"📌 {kpi['nazev']} ({kpi['jednotka']})"):
-                kpi_data = []
-
-                for _, manager in managers.iterrows():
-                    locs_in_dept = locs[locs['department_id'] == manager['department_id']]
-
-                    for _, loc in locs_in_dept.iterrows():
-                        kpi_eval = eval_data[
-                            (eval_data['location_id'] == loc['id']) &
-                            (eval_data['kpi_id'] == kpi['id'])
-                        ]
-
-                        if not kpi_eval.empty:
-                            row = kpi_eval.iloc[0]
-                            kpi_data.append({
-                                'Provozní': manager['jmeno'],
-                                'Lokalita': loc['nazev'],
-                                'Hodnota': row['hodnota'],
-                                'Splněno': '✅ ANO' if row['splneno'] else '❌ NE',
-                                'Bonus (%)': row['bonus_procento']
-                            })
-
-                if kpi_data:
-                    kpi_df = pd.DataFrame(kpi_data)
+                kpi_df = tables_by_kpi.get(safe_int_id(kpi['id']))
+
+                if kpi_df is not None:
                     st.dataframe(kpi_df, use_container_width=True, hide_index=True)
                 else:
                     st.info("Žádná data pro toto KPI")
 
 
+# ============================================================================
+# PAGE: TREND - KPI history over 12-36 months (one range query)
+# ============================================================================
+elif page == "📉 Trend":
+    st.title("📉 Vývoj KPI v čase")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        months_back = st.select_slider("Počet měsíců:", options=[12, 18, 24, 36], value=12)
+    with col2:
+        trend_view = st.radio("Zobrazit:", ["Provozní", "Lokality"], horizontal=True)
+    with col3:
+        kpis = get_kpis()
+        kpi_options = ["Celkový bonus"] + kpis['nazev'].tolist()
+        selected_kpi = st.selectbox("Ukazatel:", kpi_options)
+
+    start_month = month_to_string(datetime.strptime(selected_month, "%Y-%m") - relativedelta(months=months_back - 1))
+    st.markdown(f"### Období: **{format_month(start_month)} – {format_month(selected_month)}**")
+
+    # Whole period in one fetch, series are derived in pandas
+    evaluation = db.get_kpi_evaluation_range(start_month, selected_month)
+
+    if evaluation.empty:
+        st.warning(f"⚠️ Žádná data pro období {format_month(start_month)} – {format_month(selected_month)}")
+    else:
+        if selected_kpi == "Celkový bonus":
+            kpi_id = None
+            value_label = "Bonus (%)"
+        else:
+            kpi = db.get_reference_data().kpis.by_label(selected_kpi)
+            kpi_id = kpi.id
+            value_label = f"{selected_kpi} ({kpi.jednotka})" if kpi.jednotka else selected_kpi
+
+        if trend_view == "Provozní":
+            trend = dashboard.manager_trend(evaluation, get_managers(), get_locs(), kpi_id)
+            name_label = "Provozní"
+        else:
+            trend = dashboard.location_trend(evaluation, get_locs(), kpi_id)
+            name_label = "Lokalita"
+
+        names = sorted(trend['nazev'].unique())
+        selected_names = st.multiselect(f"{name_label}:", names, default=names)
+        trend = trend[trend['nazev'].isin(selected_names)]
+
+        if trend.empty:
+            st.warning("Žádná data odpovídající filtrům")
+        else:
+            fig = px.line(
+                trend,
+                x='mesic',
+                y='hodnota',
+                color='nazev',
+                markers=True,
+                labels={'mesic': 'Měsíc', 'hodnota': value_label, 'nazev': name_label}
+            )
+            fig.update_xaxes(type='category')
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("### 📋 Tabulka")
+            # nazev is unique per series (manager labels include the department)
+            table = trend.pivot(index='nazev', columns='mesic', values='hodnota').round(2)
+            table.columns = [format_month(m) for m in table.columns]
+            table.index.name = name_label
+            st.dataframe(table, use_container_width=True)
+
+
 # ============================================================================
 # PAGE 4: ZADÁNÍ DAT - IMPROVED DATA ENTRY
 # ============================================================================
@@ -1690,21 +1714,19 @@ elif page == "📝 Zadání":
             selected_location = st.selectbox("Lokalita:", locations['nazev'].tolist(), key="input_location")
 
         st.markdown("---")
-        location_id = safe_int_id(locations[locations['nazev'] == selected_location]['id'].iloc[0])
+        location_id = db.get_reference_data().locations.id_of(selected_location)
 
         # Debug: Show location ID
         with st.expander("🔍 Debug Info"):
             st.code(f"Lokalita: {selected_location}\nLocation ID: {location_id} (typ: {type(location_id).__name__})")
             # Show if location exists in DB
-            conn = db.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, nazev, aktivni FROM locations WHERE id = %s", (int(location_id),))
-            loc_check = cursor.fetchone()
+            with db.connection() as conn, conn.cursor() as cursor:
+                db.DIALECT.execute(cursor, "SELECT id, nazev, aktivni FROM locations WHERE id = %s", (int(location_id),))
+                loc_check = cursor.fetchone()
             if loc_check:
                 st.success(f"✅ Lokalita nalezena v DB: {loc_check['nazev']} (aktivni={loc_check['aktivni']})")
             else:
                 st.error(f"❌ Lokalita ID {location_id} NEEXISTUJE v databázi!")
-            conn.close()
 
         # Get existing data for this month/location OR show zeros
         existing_data = db.get_monthly_kpi_by_location_month(selected_input_month, location_id)
@@ -1743,21 +1765,17 @@ elif page == "📝 Zadání":
 
         with col1:
             if st.button("💾 Uložit / Přepsat data", use_container_width=True, type="primary"):
-                errors = []
-                for kpi_id, value in input_data.items():
-                    success, msg = db.add_monthly_kpi_data(selected_input_month, location_id, kpi_id, value)
-                    if not success:
-                        errors.append(msg)
+                # Save all values and evaluate their bonuses in one transaction
+                success, msg, processed = db.add_monthly_kpi_data_bulk(selected_input_month, location_id, input_data)
 
-                if errors:
-                    st.session_state.save_message = f"❌ Chyby při ukládání: {', '.join(errors)}"
+                if not success:
+                    st.session_state.save_message = f"❌ Chyby při ukládání: {msg}"
                     st.session_state.save_message_type = "error"
                 else:
-                    processed = db.calculate_monthly_kpi_evaluation(selected_input_month, location_id)
-                    # Clear cache to show updated results
-                    st.cache_data.clear()
                     st.session_state.save_message = f"✅ DATA ULOŽENA ({processed} záznamů vyhodnoceno) - {selected_location} - {format_month(selected_input_month)}"
                     st.session_state.save_message_type = "success"
+                    # The save already queued the month's summaries - watch them in the sidebar
+                    st.session_state.recalc_months = sorted(set(st.session_state.recalc_months) | {selected_input_month})
 
                 st.rerun()
 
@@ -1766,8 +1784,6 @@ elif page == "📝 Zadání":
                 if not existing_data.empty:
                     success, msg = db.delete_monthly_kpi_data(selected_input_month, location_id)
                     if success:
-                        # Clear cache to show updated results
-                        st.cache_data.clear()
                         st.session_state.save_message = f"✅ DATA SMAZÁNA pro {selected_location} - {format_month(selected_input_month)}"
                         st.session_state.save_message_type = "success"
                     else:
@@ -1821,7 +1837,7 @@ elif page == "📝 Zadání":
                 selected_department = st.selectbox("Oddělení:", depts_with_kpi['nazev'].tolist(), key="input_department")
 
             st.markdown("---")
-            department_id = safe_int_id(depts_with_kpi[depts_with_kpi['nazev'] == selected_department]['id'].iloc[0])
+            department_id = db.get_reference_data().departments.id_of(selected_department)
 
             # Get existing data for this month/department OR show zeros
             existing_dept_data = db.get_monthly_department_kpi_data(selected_dept_month, department_id)
@@ -1860,20 +1876,13 @@ elif page == "📝 Zadání":
 
             with col1:
                 if st.button("💾 Uložit / Přepsat data", use_container_width=True, type="primary", key="save_dept_data"):
-                    errors = []
-                    for kpi_id, value in dept_input_data.items():
-                        success, msg = db.add_monthly_department_kpi_data(selected_dept_month, department_id, kpi_id, value)
-                        if not success:
-                            errors.append(msg)
-
-                    if errors:
-                        st.session_state.save_message = f"❌ Chyby při ukládání: {', '.join(errors)}"
+                    # Save all values and recalculate the department summary in one transaction
+                    success, msg, saved = db.add_monthly_department_kpi_data_bulk(selected_dept_month, department_id, dept_input_data)
+
+                    if not success:
+                        st.session_state.save_message = f"❌ Chyby při ukládání: {msg}"
                         st.session_state.save_message_type = "error"
                     else:
-                        # Calculate bonuses and summaries
-                        db.calculate_department_summary(selected_dept_month)
-                        # Clear cache to show updated results
-                        st.cache_data.clear()
                         st.session_state.save_message = f"✅ DATA ÚSPĚŠNĚ ULOŽENA pro {selected_department} - {format_month(selected_dept_month)}"
                         st.session_state.save_message_type = "success"
 
@@ -1883,22 +1892,17 @@ elif page == "📝 Zadání":
                 if st.button("🗑️ Smazat data tohoto měsíce", use_container_width=True, type="secondary", key="delete_dept_data"):
                     if not existing_dept_data.empty:
                         # Delete all KPI data for this department/month
-                        conn = db.get_connection()
-                        cursor = conn.cursor()
                         try:
-                            cursor.execute("""
-                                UPDATE monthly_department_kpi_data
-                                SET status = 'DELETED'
-                                WHERE mesic = %s AND department_id = %s
-                            """, (selected_dept_month, department_id))
-                            conn.commit()
-                            conn.close()
-                            # Clear cache to show updated results
-                            st.cache_data.clear()
+                            with db.connection() as conn, conn.cursor() as cursor:
+                                db.DIALECT.execute(cursor, """
+                                    UPDATE monthly_department_kpi_data
+                                    SET status = 'DELETED'
+                                    WHERE mesic = %s AND department_id = %s
+                                """, (selected_dept_month, department_id))
+                                conn.commit()
                             st.session_state.save_message = f"✅ DATA SMAZÁNA pro {selected_department} - {format_month(selected_dept_month)}"
                             st.session_state.save_message_type = "success"
                         except Exception as e:
-                            conn.close()
                             st.session_state.save_message = f"❌ Chyba při mazání: {str(e)}"
                             st.session_state.save_message_type = "error"
 
@@ -1925,13 +1929,16 @@ elif page == "📝 Zadání":
 
         uploaded_csv = st.file_uploader("Nahrát CSV:", type=['csv'])
         if uploaded_csv:
-            csv_content = uploaded_csv.read().decode('utf-8')
-            imported, errors = db.import_monthly_data_csv(csv_content)
+            # Stream the upload in chunks - each chunk is committed separately and can be resumed
+            import_progress = st.progress(0.0, text="📥 Importuji CSV...")
+            imported, errors = db.import_monthly_data_csv(
+                uploaded_csv, chunksize=db.IMPORT_CHUNK_SIZE,
+                progress=lambda rows_done, fraction: import_progress.progress(
+                    fraction or 0.0, text=f"📥 Zpracováno {rows_done} řad"))
+            import_progress.empty()
 
             if imported > 0:
-                # Clear cache to show updated results
-                st.cache_data.clear()
-                st.session_state.save_message = f"✅ IMPORTOVÁNO {imported} záznamů"
+                st.session_state.save_message = f"✅ IMPORTOVÁNO {imported} záznamů - bonusy se přepočítají na pozadí"
                 st.session_state.save_message_type = "success"
                 st.rerun()
 
@@ -1960,12 +1967,16 @@ elif page == "📝 Zadání":
 
         uploaded_excel = st.file_uploader("Nahrát Excel:", type=['xlsx', 'xls'])
         if uploaded_excel:
-            imported, errors = db.import_monthly_data_excel(uploaded_excel)
+            # .xlsx is streamed row by row (openpyxl read-only), old .xls is read at once
+            import_progress = st.progress(0.0, text="📥 Importuji Excel...")
+            imported, errors = db.import_monthly_data_excel(
+                uploaded_excel, chunksize=db.IMPORT_CHUNK_SIZE if uploaded_excel.name.lower().endswith('.xlsx') else None,
+                progress=lambda rows_done, fraction: import_progress.progress(
+                    fraction or 0.0, text=f"📥 Zpracováno {rows_done} řad"))
+            import_progress.empty()
 
             if imported > 0:
-                # Clear cache to show updated results
-                st.cache_data.clear()
-                st.session_state.save_message = f"✅ IMPORTOVÁNO {imported} záznamů z Excelu"
+                st.session_state.save_message = f"✅ IMPORTOVÁNO {imported} záznamů z Excelu - bonusy se přepočítají na pozadí"
                 st.session_state.save_message_type = "success"
                 st.rerun()
 
@@ -2106,7 +2117,7 @@ elif page == "⚙️ Admin":
         st.markdown("---")
         st.markdown("#### 🧹 Vyčistit duplikáty")
         st.warning("⚠️ Použijte pokud vidíte duplicitní záznamy (stejné oddělení/lokality/provozní více krát)")
-        if st.button("🧹 Vyčistit databázi", type="secondary", key="cleanup_db_btn"):
+        if hasattr(db, 'cleanup_duplicates') and st.button("🧹 Vyčistit databázi", type="secondary", key="cleanup_db_btn"):
             success, msg = db.cleanup_duplicates()
             if success:
                 st.success(msg)
@@ -2120,7 +2131,7 @@ elif page == "⚙️ Admin":
         with col1:
             if len(depts) > 0:
                 del_dept = st.selectbox("Vyberte oddělení ke smazání:", depts['nazev'].tolist(), key="del_dept_select")
-                del_dept_id = safe_int_id(depts[depts['nazev'] == del_dept]['id'].iloc[0])
+                del_dept_id = db.get_reference_data().departments.id_of(del_dept)
         with col2:
             if st.button("🗑️ Smazat", key="del_dept_btn"):
                 success, msg = db.delete_department(del_dept_id)
@@ -2144,7 +2155,7 @@ elif page == "⚙️ Admin":
         with col2:
             depts = get_depts()  # Use cached version
             new_loc_dept = st.selectbox("Oddělení:", depts['nazev'].tolist(), key="add_loc_dept")
-            dept_id = safe_int_id(depts[depts['nazev'] == new_loc_dept]['id'].iloc[0])
+            dept_id = db.get_reference_data().departments.id_of(new_loc_dept)
         with col3:
             if st.button("➕ Přidat lokalitu", key="add_loc_btn"):
                 success, msg = db.add_location(new_loc_name, dept_id)
@@ -2160,10 +2171,10 @@ elif page == "⚙️ Admin":
         with col1:
             if len(locs) > 0:
                 loc_to_move = st.selectbox("Lokalita:", locs['nazev'].tolist(), key="move_loc")
-                loc_id = safe_int_id(locs[locs['nazev'] == loc_to_move]['id'].iloc[0])
+                loc_id = db.get_reference_data().locations.id_of(loc_to_move)
         with col2:
             new_dept = st.selectbox("Nové oddělení:", depts['nazev'].tolist(), key="move_dept")
-            new_dept_id = safe_int_id(depts[depts['nazev'] == new_dept]['id'].iloc[0])
+            new_dept_id = db.get_reference_data().departments.id_of(new_dept)
         with col3:
             if st.button("🔄 Přeřadit", key="move_loc_btn"):
                 success, msg = db.update_location_department(loc_id, new_dept_id)
@@ -2179,7 +2190,7 @@ elif page == "⚙️ Admin":
         with col1:
             if len(locs) > 0:
                 del_loc = st.selectbox("Vyberte lokalitu ke smazání:", locs['nazev'].tolist(), key="del_loc_select")
-                del_loc_id = safe_int_id(locs[locs['nazev'] == del_loc]['id'].iloc[0])
+                del_loc_id = db.get_reference_data().locations.id_of(del_loc)
         with col2:
             if st.button("🗑️ Smazat", key="del_loc_btn"):
                 success, msg = db.delete_location(del_loc_id)
@@ -2203,7 +2214,7 @@ elif page == "⚙️ Admin":
         with col2:
             depts = get_depts()  # Use cached version
             new_mgr_dept = st.selectbox("Oddělení:", depts['nazev'].tolist(), key="add_mgr_dept")
-            dept_id = safe_int_id(depts[depts['nazev'] == new_mgr_dept]['id'].iloc[0])
+            dept_id = db.get_reference_data().departments.id_of(new_mgr_dept)
         with col3:
             if st.button("➕ Přidat provozního", key="add_mgr_btn"):
                 success, msg, new_mgr_id = db.add_operational_manager(new_mgr_name, dept_id)
@@ -2222,7 +2233,7 @@ elif page == "⚙️ Admin":
                 mgrs['jmeno'].tolist(),
                 key="mgr_kpi_select"
             )
-            selected_mgr_id = safe_int_id(mgrs[mgrs['jmeno'] == selected_mgr]['id'].iloc[0])
+            selected_mgr_id = db.get_reference_data().managers.id_of(selected_mgr)
 
             # Get all KPIs
             all_kpis = db.get_all_kpi_definitions()
@@ -2271,7 +2282,7 @@ elif page == "⚙️ Admin":
         with col1:
             if len(mgrs) > 0:
                 del_mgr = st.selectbox("Vyberte provozního ke smazání:", mgrs['jmeno'].tolist(), key="del_mgr_select")
-                del_mgr_id = safe_int_id(mgrs[mgrs['jmeno'] == del_mgr]['id'].iloc[0])
+                del_mgr_id = db.get_reference_data().managers.id_of(del_mgr)
         with col2:
             if st.button("🗑️ Smazat", key="del_mgr_btn"):
                 success, msg = db.delete_operational_manager(del_mgr_id)
@@ -2386,25 +2397,24 @@ elif page == "⚙️ Admin":
             with st.expander("🔍 Debug Info"):
                 st.code(f"KPI: {selected_kpi_name}\nKPI ID: {selected_kpi_id} (typ: {type(selected_kpi_id).__name__})")
                 # Verify KPI exists
-                conn = db.get_connection()
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, nazev, aktivni FROM kpi_definitions WHERE id = %s", (selected_kpi_id,))
-                kpi_check = cursor.fetchone()
+                with db.connection() as conn, conn.cursor() as cursor:
+                    db.DIALECT.execute(cursor, "SELECT id, nazev, aktivni FROM kpi_definitions WHERE id = %s", (selected_kpi_id,))
+                    kpi_check = cursor.fetchone()
+                    # Check existing thresholds
+                    db.DIALECT.execute(cursor, "SELECT id, kpi_id, operator, min_hodnota, bonus_procento FROM kpi_thresholds WHERE kpi_id = %s", (selected_kpi_id,))
+                    raw_thresholds = cursor.fetchall()
+
                 if kpi_check:
                     st.success(f"✅ KPI nalezeno v DB: {kpi_check['nazev']} (aktivni={kpi_check['aktivni']})")
                 else:
                     st.error(f"❌ KPI ID {selected_kpi_id} NEEXISTUJE!")
 
-                # Check existing thresholds
-                cursor.execute("SELECT id, kpi_id, operator, min_hodnota, bonus_procento FROM kpi_thresholds WHERE kpi_id = %s", (selected_kpi_id,))
-                raw_thresholds = cursor.fetchall()
                 if raw_thresholds:
                     st.write(f"Hranice v DB: {len(raw_thresholds)}")
                     for t in raw_thresholds[:3]:
                         st.text(f"  ID {t['id']}: kpi_id={t['kpi_id']} (typ={type(t['kpi_id']).__name__}), {t['operator']} {t['min_hodnota']} → {t['bonus_procento']}%")
                 else:
                     st.warning("Žádné hranice v DB")
-                conn.close()
 
             # Display existing thresholds
             thresholds = db.get_kpi_thresholds(selected_kpi_id)
@@ -2525,208 +2535,346 @@ elif page == "⚙️ Admin":
     with tab6:
         st.markdown("### 🔍 Diagnostika")
 
-        # Get database statistics
-        conn = db.get_connection()
-        cursor = conn.cursor()
-
-        col1, col2, col3 = st.columns(3)
+        # Row counts; the connection goes back to the pool before the sections below call db
+        with db.connection() as conn, conn.cursor() as cursor:
+            col1, col2, col3 = st.columns(3)
 
-        with col1:
-            st.markdown("#### 📁 Základní tabulky")
-            cursor.execute("SELECT COUNT(*) FROM departments WHERE aktivni = TRUE")
-            dept_count = cursor.fetchone()['count']
-            st.metric("Oddělení", dept_count)
+            with col1:
+                st.markdown("#### 📁 Základní tabulky")
+                db.DIALECT.execute(cursor, "SELECT COUNT(*) FROM departments WHERE aktivni = TRUE")
+                dept_count = storage.fetch_value(cursor)
+                st.metric("Oddělení", dept_count)
 
-            cursor.execute("SELECT COUNT(*) FROM locations WHERE aktivni = TRUE")
-            loc_count = cursor.fetchone()['count']
-            st.metric("Lokality", loc_count)
+                db.DIALECT.execute(cursor, "SELECT COUNT(*) FROM locations WHERE aktivni = TRUE")
+                loc_count = storage.fetch_value(cursor)
+                st.metric("Lokality", loc_count)
 
-            cursor.execute("SELECT COUNT(*) FROM operational_managers WHERE aktivni = TRUE")
-            mgr_count = cursor.fetchone()['count']
-            st.metric("Provozní", mgr_count)
+                db.DIALECT.execute(cursor, "SELECT COUNT(*) FROM operational_managers WHERE aktivni = TRUE")
+                mgr_count = storage.fetch_value(cursor)
+                st.metric("Provozní", mgr_count)
 
-        with col2:
-            st.markdown("#### 📊 KPI")
-            cursor.execute("SELECT COUNT(*) FROM kpi_definitions WHERE aktivni = TRUE")
-            kpi_count = cursor.fetchone()['count']
-            st.metric("KPI Definice", kpi_count)
+            with col2:
+                st.markdown("#### 📊 KPI")
+                db.DIALECT.execute(cursor, "SELECT COUNT(*) FROM kpi_definitions WHERE aktivni = TRUE")
+                kpi_count = storage.fetch_value(cursor)
+                st.metric("KPI Definice", kpi_count)
 
-            cursor.execute("SELECT COUNT(*) FROM kpi_thresholds")
-            threshold_count = cursor.fetchone()['count']
-            st.metric("KPI Hranice", threshold_count)
+                db.DIALECT.execute(cursor, "SELECT COUNT(*) FROM kpi_thresholds")
+                threshold_count = storage.fetch_value(cursor)
+                st.metric("KPI Hranice", threshold_count)
 
-        with col3:
-            st.markdown("#### 💾 Data")
-            cursor.execute("SELECT COUNT(*) FROM monthly_kpi_data WHERE status = 'ACTIVE'")
-            data_count = cursor.fetchone()['count']
-            st.metric("Měsíční data (lokality)", data_count)
-
-            cursor.execute("SELECT COUNT(*) FROM monthly_department_kpi_data WHERE status = 'ACTIVE'")
-            dept_data_count = cursor.fetchone()['count']
-            st.metric("Měsíční data (oddělení)", dept_data_count)
-
-            cursor.execute("SELECT COUNT(*) FROM monthly_kpi_evaluation")
-            eval_count = cursor.fetchone()['count']
-            if eval_count == 0 and data_count > 0:
-                st.metric("⚠️ Vyhodnocení bonusů", eval_count, delta="Chybí výpočet!", delta_color="off")
-            else:
-                st.metric("Vyhodnocení bonusů", eval_count)
+            with col3:
+                st.markdown("#### 💾 Data")
+                db.DIALECT.execute(cursor, "SELECT COUNT(*) FROM monthly_kpi_data WHERE status = 'ACTIVE'")
+                data_count = storage.fetch_value(cursor)
+                st.metric("Měsíční data (lokality)", data_count)
+
+                db.DIALECT.execute(cursor, "SELECT COUNT(*) FROM monthly_department_kpi_data WHERE status = 'ACTIVE'")
+                dept_data_count = storage.fetch_value(cursor)
+                st.metric("Měsíční data (oddělení)", dept_data_count)
+
+                db.DIALECT.execute(cursor, "SELECT COUNT(*) FROM monthly_kpi_evaluation")
+                eval_count = storage.fetch_value(cursor)
+                if eval_count == 0 and data_count > 0:
+                    st.metric("⚠️ Vyhodnocení bonusů", eval_count, delta="Chybí výpočet!", delta_color="off")
+                else:
+                    st.metric("Vyhodnocení bonusů", eval_count)
 
         st.markdown("---")
-        st.markdown("#### 📋 Ukázková Data")
-
-        # Show sample data
-        st.markdown("**Oddělení:**")
-        cursor.execute("SELECT nazev, vedouci, ma_vlastni_kpi FROM departments WHERE aktivni = TRUE LIMIT 5")
-        depts_data = cursor.fetchall()
-        if depts_data:
-            st.write(pd.DataFrame(depts_data, columns=['Název', 'Vedoucí', 'Vlastní KPI']))
-        else:
-            st.warning("⚠️ Žádná oddělení!")
-
-        st.markdown("**Lokality:**")
-        cursor.execute("""
-            SELECT l.nazev, d.nazev as oddeleni
-            FROM locations l
-            JOIN departments d ON l.department_id = d.id
-            WHERE l.aktivni = TRUE
-            LIMIT 5
-        """)
-        locs_data = cursor.fetchall()
-        if locs_data:
-            st.write(pd.DataFrame(locs_data, columns=['Lokalita', 'Oddělení']))
-        else:
-            st.warning("⚠️ Žádné lokality!")
-
-        st.markdown("**KPI Definice:**")
-        cursor.execute("SELECT nazev, jednotka, typ_vypoctu FROM kpi_definitions WHERE aktivni = TRUE LIMIT 5")
-        kpis_data = cursor.fetchall()
-        if kpis_data:
-            st.write(pd.DataFrame(kpis_data, columns=['Název', 'Jednotka', 'Typ']))
-        else:
-            st.warning("⚠️ Žádná KPI!")
-
-        st.markdown("**Měsíční Data (RAW - bez JOIN):**")
-        cursor.execute("""
-            SELECT id, mesic, location_id, kpi_id, hodnota, status
-            FROM monthly_kpi_data
-            WHERE status = 'ACTIVE'
-            ORDER BY created_at DESC
-            LIMIT 10
-        """)
-        raw_data = cursor.fetchall()
-        if raw_data:
-            st.write(pd.DataFrame(raw_data, columns=['ID', 'Měsíc', 'Location ID', 'KPI ID', 'Hodnota', 'Status']))
-
-            # Check if those IDs exist in related tables
-            st.markdown("**🔍 Kontrola foreign keys:**")
-            for row in raw_data[:3]:  # Check first 3 records
-                record_id = row['id']
-                mesic = row['mesic']
-                loc_id = row['location_id']
-                kpi_id = row['kpi_id']
-                hodnota = row['hodnota']
-                status = row['status']
-
-                # Check if location exists and is active
-                cursor.execute("SELECT id, nazev, aktivni FROM locations WHERE id = %s", (loc_id,))
-                loc_result = cursor.fetchone()
-
-                # Check if KPI exists and is active
-                cursor.execute("SELECT id, nazev, aktivni FROM kpi_definitions WHERE id = %s", (kpi_id,))
-                kpi_result = cursor.fetchone()
-
-                st.text(f"Záznam #{record_id} ({mesic}):")
-                if loc_result:
-                    st.text(f"  ✓ Lokalita ID {loc_id}: {loc_result['nazev']} (aktivni={loc_result['aktivni']})")
-                else:
-                    st.error(f"  ✗ Lokalita ID {loc_id} NEEXISTUJE!")
+        st.markdown("#### 🔌 Připojení k databázi (pool)")
+        pool_stats = db.get_pool_stats()
+        if pool_stats:
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Připojení (použitá/celkem)", f"{pool_stats['in_use']}/{pool_stats['size']}")
+                st.caption(f"Min {pool_stats['min_size']}, max {pool_stats['max_size']}")
+            with col2:
+                st.metric("Výpůjčky z poolu", pool_stats['checkouts'])
+                st.caption(f"Selhané health checky: {pool_stats['health_check_failures']}")
+            with col3:
+                st.metric("Čekání na volné připojení", pool_stats['waits'])
+                st.caption(f"Průměr {pool_stats['avg_wait_ms']:.1f} ms, timeouty: {pool_stats['timeouts']}")
+            with col4:
+                st.metric("Handshaky (nová připojení)", pool_stats['connects'])
+                st.caption(f"Průměr {pool_stats['avg_handshake_ms']:.0f} ms")
 
-                if kpi_result:
-                    st.text(f"  ✓ KPI ID {kpi_id}: {kpi_result['nazev']} (aktivni={kpi_result['aktivni']})")
-                else:
-                    st.error(f"  ✗ KPI ID {kpi_id} NEEXISTUJE!")
-        else:
-            st.warning("⚠️ Žádná měsíční data!")
+        cache_stats = db.get_cache_stats()
+        reference_stats = db.get_reference_stats()
+        col1, col2, col3, col4 = st.columns(4)
+        if cache_stats:
+            with col1:
+                st.metric("Záznamy v cache", cache_stats['entries'])
+            with col2:
+                st.metric("Cache zásahy / výpadky", f"{cache_stats['hits']}/{cache_stats['misses']}")
+            with col3:
+                st.metric("Zneplatněné záznamy", cache_stats['invalidated'])
+        with col4:
+            st.metric("Referenční data (verze)", reference_stats['version'])
+            st.caption(f"Načteno {reference_stats['loads']}×" +
+                       (f", stáří {reference_stats['age_s']:.0f} s" if reference_stats['age_s'] is not None else ""))
+
+        listener_stats = db.get_listener_stats()
+        if listener_stats and listener_stats['running']:
+            st.caption(
+                f"🔔 Změny z jiných instancí (LISTEN {db.CHANGE_CHANNEL}): "
+                f"{'připojeno' if listener_stats['connected'] else 'odpojeno'}, "
+                f"přijato {listener_stats['received']}, použito {listener_stats['applied']}, "
+                f"vlastních {listener_stats['own']}, chyb {listener_stats['errors']}, "
+                f"obnovení spojení {listener_stats['reconnects']}"
+            )
+            if listener_stats['last_error']:
+                st.caption(f"Poslední chyba: {listener_stats['last_error']}")
+        elif listener_stats:  # None in SQLite (a single instance)
+            st.caption("🔔 Sledování změn z jiných instancí je vypnuté (listen_changes = false)")
+
+        queue_stats = db.get_recalc_queue_stats()
+        worker_stats = queue_stats['worker']
+        st.caption(
+            f"⏳ Fronta přepočtu: čeká {queue_stats['PENDING']}, běží {queue_stats['RUNNING']}, "
+            f"hotovo {queue_stats['DONE']}, selhalo {queue_stats['FAILED']} · "
+            f"worker této instance: {'běží' if worker_stats['running'] else 'vypnutý'}, "
+            f"zpracováno {worker_stats['done']}, chyb {worker_stats['errors']}"
+        )
+        if worker_stats['last_error']:
+            st.caption(f"Poslední chyba přepočtu: {worker_stats['last_error']}")
 
         st.markdown("---")
-        st.markdown("**Měsíční Data (s JOIN - pro porovnání):**")
-        cursor.execute("""
-            SELECT m.id, m.mesic, l.nazev as lokalita, k.nazev as kpi, m.hodnota
-            FROM monthly_kpi_data m
-            JOIN locations l ON m.location_id = l.id AND l.aktivni = TRUE
-            JOIN kpi_definitions k ON m.kpi_id = k.id AND k.aktivni = TRUE
-            WHERE m.status = 'ACTIVE'
-            ORDER BY m.created_at DESC
-            LIMIT 10
-        """)
-        monthly_data = cursor.fetchall()
-        if monthly_data:
-            st.write(pd.DataFrame(monthly_data, columns=['ID', 'Měsíc', 'Lokalita', 'KPI', 'Hodnota']))
+        st.markdown("#### ⏱️ Dotazy do databáze")
+        query_report = db.get_query_stats()
+        if not query_report['enabled']:
+            st.caption("Měření dotazů je vypnuté (query_log = false)")
         else:
-            st.warning("⚠️ JOIN nevrátil žádná data! Problém s foreign keys nebo aktivni=0")
+            st.caption(
+                f"Změřeno {query_report['statements']} příkazů ({query_report['fingerprints']} různých) "
+                f"v {query_report['rerun_count']} vykresleních stránek · pomalé nad {query_report['slow_ms']:.0f} ms"
+                + (f", log: {query_report['slow_log']}" if query_report['slow_log'] else "")
+            )
+            if query_report['pages']:
+                st.markdown("**Stránky**")
+                st.dataframe(pd.DataFrame({
+                    'Stránka': [p['page'] for p in query_report['pages']],
+                    'Vykreslení': [p['reruns'] for p in query_report['pages']],
+                    'Dotazů (průměr)': [round(p['avg_queries'], 1) for p in query_report['pages']],
+                    'Dotazů (max)': [p['max_queries'] for p in query_report['pages']],
+                    'Čas dotazů ms (průměr)': [round(p['avg_query_ms'], 1) for p in query_report['pages']],
+                    'Čas dotazů ms (max)': [round(p['max_query_ms'], 1) for p in query_report['pages']],
+                    'Cache zásahy': [f"{p['cache_hit_ratio']:.0%}" if p['cache_hit_ratio'] is not None else "-"
+                                     for p in query_report['pages']],
+                    'Pomalých': [p['slow'] for p in query_report['pages']],
+                }), use_container_width=True, hide_index=True)
+            if query_report['reruns']:
+                st.markdown("**Poslední vykreslení**")
+                st.dataframe(pd.DataFrame({
+                    'Čas': [datetime.fromtimestamp(r['started']).strftime('%H:%M:%S') for r in query_report['reruns']],
+                    'Stránka': [r['page'] + ("" if r['complete'] else " (přerušeno)") for r in query_report['reruns']],
+                    'Dotazů': [r['queries'] for r in query_report['reruns']],
+                    'Čas dotazů ms': [round(r['query_ms'], 1) for r in query_report['reruns']],
+                    'Celkem ms': [round(r['total_ms'], 1) for r in query_report['reruns']],
+                    'Cache zásahy/výpadky': [f"{r['cache_hits']}/{r['cache_misses']}" for r in query_report['reruns']],
+                    'Nejdražší dotaz': [f"{r['top_calls']}× {r['top_ms']:.1f} ms: {r['top_query'][:80]}" if r['top_query'] else ""
+                                        for r in query_report['reruns']],
+                }), use_container_width=True, hide_index=True)
+            if query_report['top']:
+                st.markdown("**Nejdražší dotazy (celkový čas)**")
+                st.dataframe(pd.DataFrame({
+                    'Dotaz': [q['query'][:200] for q in query_report['top']],
+                    'Volání': [q['calls'] for q in query_report['top']],
+                    'Celkem ms': [round(q['total_ms'], 1) for q in query_report['top']],
+                    'Průměr ms': [round(q['avg_ms'], 2) for q in query_report['top']],
+                    'Max ms': [round(q['max_ms'], 1) for q in query_report['top']],
+                    'Řádků': [q['rows'] for q in query_report['top']],
+                    'Volá': [q['caller'] for q in query_report['top']],
+                }), use_container_width=True, hide_index=True)
+            if query_report['slow_queries']:
+                st.markdown(f"**Pomalé dotazy (nad {query_report['slow_ms']:.0f} ms)**")
+                st.dataframe(pd.DataFrame({
+                    'Čas': [datetime.fromtimestamp(q['time']).strftime('%d.%m. %H:%M:%S') for q in query_report['slow_queries']],
+                    'ms': [q['ms'] for q in query_report['slow_queries']],
+                    'Stránka': [q['page'] for q in query_report['slow_queries']],
+                    'Volá': [q['caller'] for q in query_report['slow_queries']],
+                    'Dotaz': [q['query'][:200] for q in query_report['slow_queries']],
+                }), use_container_width=True, hide_index=True)
+            if query_report['last_error']:
+                st.caption(f"Chyba zápisu logu: {query_report['last_error']}")
+            if st.button("🧹 Vynulovat statistiky dotazů", key="reset_query_stats_btn"):
+                db.reset_query_stats()
+                st.rerun()
 
         st.markdown("---")
-        st.markdown("#### 🔍 Analýza problémů")
+        st.markdown("#### 🔎 Kontrola indexů (EXPLAIN)")
+        st.caption("Plán dotazu tak, jak by ho databáze spustila teď, a s vypnutým sekvenčním čtením (ověří, že existuje použitelný index).")
+        if st.button("🔎 Spustit EXPLAIN", key="explain_btn"):
+            explain_report = db.explain_hot_queries()
+            st.dataframe(explain_report, use_container_width=True, hide_index=True)
+            if explain_report['index_scan'].all():
+                st.success("✅ Všechny sledované dotazy mohou použít index")
+            else:
+                missing = ", ".join(explain_report.loc[~explain_report['index_scan'], 'dotaz'])
+                st.warning(f"⚠️ Bez indexu: {missing} - spusťte init_database() pro vytvoření indexů")
 
-        problems = []
-        warnings = []
+        with db.connection() as conn, conn.cursor() as cursor:
+            st.markdown("---")
+            st.markdown("#### 📋 Ukázková Data")
+
+            # Show sample data
+            st.markdown("**Oddělení:**")
+            db.DIALECT.execute(cursor, "SELECT nazev, vedouci, ma_vlastni_kpi FROM departments WHERE aktivni = TRUE LIMIT 5")
+            depts_data = storage.fetch_frame(cursor, ['Název', 'Vedoucí', 'Vlastní KPI'])
+            if not depts_data.empty:
+                st.write(depts_data)
+            else:
+                st.warning("⚠️ Žádná oddělení!")
+
+            st.markdown("**Lokality:**")
+            db.DIALECT.execute(cursor, """
+                SELECT l.nazev, d.nazev as oddeleni
+                FROM locations l
+                JOIN departments d ON l.department_id = d.id
+                WHERE l.aktivni = TRUE
+                LIMIT 5
+            """)
+            locs_data = storage.fetch_frame(cursor, ['Lokalita', 'Oddělení'])
+            if not locs_data.empty:
+                st.write(locs_data)
+            else:
+                st.warning("⚠️ Žádné lokality!")
 
-        # Check if thresholds exist
-        cursor.execute("SELECT COUNT(*) FROM kpi_thresholds")
-        threshold_count = cursor.fetchone()['count']
-        if threshold_count == 0:
-            problems.append("❌ **Žádné KPI hranice!** Bez hranic se nemohou počítat bonusy.")
-            st.error("⚠️ KRITICKÝ PROBLÉM: Nejsou definované hranice pro KPI! Přejděte na tab 'KPI Hranice' a nastavte pravidla pro bonusy.")
-        else:
-            st.success(f"✅ Nalezeno {threshold_count} hranic pro výpočet bonusů")
+            st.markdown("**KPI Definice:**")
+            db.DIALECT.execute(cursor, "SELECT nazev, jednotka, typ_vypoctu FROM kpi_definitions WHERE aktivni = TRUE LIMIT 5")
+            kpis_data = storage.fetch_frame(cursor, ['Název', 'Jednotka', 'Typ'])
+            if not kpis_data.empty:
+                st.write(kpis_data)
+            else:
+                st.warning("⚠️ Žádná KPI!")
+
+            st.markdown("**Měsíční Data (RAW - bez JOIN):**")
+            db.DIALECT.execute(cursor, """
+                SELECT id, mesic, location_id, kpi_id, hodnota, status
+                FROM monthly_kpi_data
+                WHERE status = 'ACTIVE'
+                ORDER BY created_at DESC
+                LIMIT 10
+            """)
+            raw_data = storage.fetch_frame(cursor, ['ID', 'Měsíc', 'Location ID', 'KPI ID', 'Hodnota', 'Status'])
+            if not raw_data.empty:
+                st.write(raw_data)
+
+                # Check if those IDs exist in related tables
+                st.markdown("**🔍 Kontrola foreign keys:**")
+                for _, row in raw_data.head(3).iterrows():  # Check first 3 records
+                    record_id = row['ID']
+                    mesic = row['Měsíc']
+                    loc_id = int(row['Location ID'])
+                    kpi_id = int(row['KPI ID'])
+
+                    # Check if location exists and is active
+                    db.DIALECT.execute(cursor, "SELECT id, nazev, aktivni FROM locations WHERE id = %s", (loc_id,))
+                    loc_result = cursor.fetchone()
+
+                    # Check if KPI exists and is active
+                    db.DIALECT.execute(cursor, "SELECT id, nazev, aktivni FROM kpi_definitions WHERE id = %s", (kpi_id,))
+                    kpi_result = cursor.fetchone()
+
+                    st.text(f"Záznam #{record_id} ({mesic}):")
+                    if loc_result:
+                        st.text(f"  ✓ Lokalita ID {loc_id}: {loc_result['nazev']} (aktivni={loc_result['aktivni']})")
+                    else:
+                        st.error(f"  ✗ Lokalita ID {loc_id} NEEXISTUJE!")
 
-        # Check if data needs recalculation
-        cursor.execute("SELECT COUNT(*) FROM monthly_kpi_data WHERE status = 'ACTIVE'")
-        data_count = cursor.fetchone()['count']
-        cursor.execute("SELECT COUNT(*) FROM monthly_kpi_evaluation")
-        eval_count = cursor.fetchone()['count']
+                    if kpi_result:
+                        st.text(f"  ✓ KPI ID {kpi_id}: {kpi_result['nazev']} (aktivni={kpi_result['aktivni']})")
+                    else:
+                        st.error(f"  ✗ KPI ID {kpi_id} NEEXISTUJE!")
+            else:
+                st.warning("⚠️ Žádná měsíční data!")
+
+            st.markdown("---")
+            st.markdown("**Měsíční Data (s JOIN - pro porovnání):**")
+            db.DIALECT.execute(cursor, """
+                SELECT m.id, m.mesic, l.nazev as lokalita, k.nazev as kpi, m.hodnota
+                FROM monthly_kpi_data m
+                JOIN locations l ON m.location_id = l.id AND l.aktivni = TRUE
+                JOIN kpi_definitions k ON m.kpi_id = k.id AND k.aktivni = TRUE
+                WHERE m.status = 'ACTIVE'
+                ORDER BY m.created_at DESC
+                LIMIT 10
+            """)
+            monthly_data = storage.fetch_frame(cursor, ['ID', 'Měsíc', 'Lokalita', 'KPI', 'Hodnota'])
+            if not monthly_data.empty:
+                st.write(monthly_data)
+            else:
+                st.warning("⚠️ JOIN nevrátil žádná data! Problém s foreign keys nebo aktivni=0")
+
+            st.markdown("---")
+            st.markdown("#### 🔍 Analýza problémů")
 
+            problems = []
+            warnings = []
+
+            # Check if thresholds exist
+            db.DIALECT.execute(cursor, "SELECT COUNT(*) FROM kpi_thresholds")
+            threshold_count = storage.fetch_value(cursor)
+            if threshold_count == 0:
+                problems.append("❌ **Žádné KPI hranice!** Bez hranic se nemohou počítat bonusy.")
+                st.error("⚠️ KRITICKÝ PROBLÉM: Nejsou definované hranice pro KPI! Přejděte na tab 'KPI Hranice' a nastavte pravidla pro bonusy.")
+            else:
+                st.success(f"✅ Nalezeno {threshold_count} hranic pro výpočet bonusů")
+
+            # Check if data needs recalculation
+            db.DIALECT.execute(cursor, "SELECT COUNT(*) FROM monthly_kpi_data WHERE status = 'ACTIVE'")
+            data_count = storage.fetch_value(cursor)
+            db.DIALECT.execute(cursor, "SELECT COUNT(*) FROM monthly_kpi_evaluation")
+            eval_count = storage.fetch_value(cursor)
+
+        # Months/locations changed since their last evaluation (recalc_dirty)
+        dirty_months = db.get_dirty_months()
         if data_count > 0 and eval_count == 0:
             problems.append("❌ **Chybí vyhodnocení!** Máte data ale nebyla spočítána.")
             st.error("⚠️ DATA NEBYLA VYHODNOCENA! Klikněte na tlačítko níže pro přepočítání.")
-        elif data_count > eval_count:
-            warnings.append(f"⚠️ Máte více dat ({data_count}) než vyhodnocení ({eval_count}). Doporučujeme přepočítat.")
-            st.warning(f"⚠️ Počet dat ({data_count}) neodpovídá počtu vyhodnocení ({eval_count}). Přepočítejte bonusy.")
+        elif not dirty_months.empty:
+            dirty_list = ", ".join(f"{format_month(row['mesic'])} ({row['locations']} lok.)" for _, row in dirty_months.iterrows())
+            warnings.append(f"⚠️ Změněná data čekají na přepočet: {dirty_list}")
+            st.warning(f"⚠️ Změněná data čekají na přepočet: {dirty_list}")
+            if st.button("🔄 Přepočítat jen změněné", key="recalc_dirty_btn"):
+                queue_recalculation(dirty_months['mesic'].tolist(), scope='DIRTY')
+                st.rerun()
+        else:
+            st.success("✅ Všechna data jsou vyhodnocena")
 
         st.markdown("---")
         st.markdown("#### 🔧 Opravy databáze")
 
-        # Check for orphaned records
-        cursor.execute("""
-            SELECT DISTINCT m.location_id
-            FROM monthly_kpi_data m
-            WHERE m.location_id NOT IN (SELECT id FROM locations)
-            LIMIT 10
-        """)
-        orphaned_locations = cursor.fetchall()
-
-        cursor.execute("""
-            SELECT DISTINCT m.kpi_id
-            FROM monthly_kpi_data m
-            WHERE m.kpi_id NOT IN (SELECT id FROM kpi_definitions)
-            LIMIT 10
-        """)
-        orphaned_kpis = cursor.fetchall()
-
-        if orphaned_locations or orphaned_kpis:
-            st.error("🚨 PROBLÉM: Nalezeny osiřelé záznamy!")
-            if orphaned_locations:
-                loc_ids = [str(row[0]) for row in orphaned_locations]
-                st.warning(f"⚠️ Měsíční data odkazují na neexistující lokality: {', '.join(loc_ids)}")
-            if orphaned_kpis:
-                kpi_ids = [str(row[0]) for row in orphaned_kpis]
-                st.warning(f"⚠️ Měsíční data odkazují na neexistující KPI: {', '.join(kpi_ids)}")
-            st.info("💡 Použijte tlačítko 'Vyčistit osiřelé záznamy' níže")
+        with db.connection() as conn, conn.cursor() as cursor:
+            # Check for orphaned records
+            db.DIALECT.execute(cursor, """
+                SELECT DISTINCT m.location_id
+                FROM monthly_kpi_data m
+                WHERE m.location_id NOT IN (SELECT id FROM locations)
+                LIMIT 10
+            """)
+            orphaned_locations = cursor.fetchall()
+
+            db.DIALECT.execute(cursor, """
+                SELECT DISTINCT m.kpi_id
+                FROM monthly_kpi_data m
+                WHERE m.kpi_id NOT IN (SELECT id FROM kpi_definitions)
+                LIMIT 10
+            """)
+            orphaned_kpis = cursor.fetchall()
+
+            if orphaned_locations or orphaned_kpis:
+                st.error("🚨 PROBLÉM: Nalezeny osiřelé záznamy!")
+                if orphaned_locations:
+                    loc_ids = [str(row['location_id']) for row in orphaned_locations]
+                    st.warning(f"⚠️ Měsíční data odkazují na neexistující lokality: {', '.join(loc_ids)}")
+                if orphaned_kpis:
+                    kpi_ids = [str(row['kpi_id']) for row in orphaned_kpis]
+                    st.warning(f"⚠️ Měsíční data odkazují na neexistující KPI: {', '.join(kpi_ids)}")
+                st.info("💡 Použijte tlačítko 'Vyčistit osiřelé záznamy' níže")
 
         col1, col2, col3 = st.columns(3)
         with col1:
-            if st.button("🔧 OPRAVIT BINÁRNÍ ID", key="fix_binary_btn", type="secondary"):
+            if hasattr(db, 'fix_binary_ids') and st.button("🔧 OPRAVIT BINÁRNÍ ID", key="fix_binary_btn", type="secondary"):
                 with st.spinner("Opravuji datové typy..."):
                     success, msg = db.fix_binary_ids()
                 if success:
@@ -2737,15 +2885,19 @@ elif page == "⚙️ Admin":
 
         with col2:
             if st.button("🧹 VYČISTIT OSIŘELÉ", key="clean_orphaned_btn", type="secondary"):
-                with st.spinner("Čistím osiřelé záznamy..."):
+                with st.spinner("Čistím osiřelé záznamy..."), db.connection() as conn, conn.cursor() as cursor:
                     # Delete records with non-existent foreign keys
-                    cursor.execute("""
+                    db.DIALECT.execute(cursor, """
                         DELETE FROM monthly_kpi_data
                         WHERE location_id NOT IN (SELECT id FROM locations)
                         OR kpi_id NOT IN (SELECT id FROM kpi_definitions)
                     """)
-                    conn.commit()
                     deleted = cursor.rowcount
+                    catalog_changed = db.refresh_month_catalog(cursor)
+                    conn.commit()
+                db.invalidate_cache('monthly_kpi_data')
+                if catalog_changed:
+                    db.invalidate_cache('month_catalog')
                 st.success(f"✅ Smazáno {deleted} osiřelých záznamů")
                 st.rerun()
 
@@ -2762,19 +2914,9 @@ elif page == "⚙️ Admin":
             if st.button("♻️ PŘEPOČÍTAT VŠECHNY BONUSY", key="recalc_all_btn", type="primary"):
                 months = db.get_all_months_with_data()
                 if months:
-                    total_processed = 0
-                    with st.spinner(f"Počítám bonusy pro {len(months)} měsíců..."):
-                        for idx, month in enumerate(months):
-                            st.info(f"Měsíc {idx+1}/{len(months)}: {month}")
-                            processed = db.calculate_monthly_kpi_evaluation(month, verbose=False)
-                            total_processed += processed
-                            db.calculate_department_summary(month)
-                    # Clear cache to show updated results
-                    st.cache_data.clear()
-                    if total_processed > 0:
-                        st.success(f"✅ Úspěšně přepočítáno {total_processed} záznamů z {len(months)} měsíců!")
-                    else:
-                        st.warning(f"⚠️ Zkontrolováno {len(months)} měsíců, ale žádná data k přepočítání")
+                    # Months run in parallel in the background worker, progress is shown in the sidebar
+                    queue_recalculation(months)
+                    st.session_state.recalc_all_months = months
                     st.rerun()
                 else:
                     st.warning("Žádná data k přepočítání")
@@ -2785,4 +2927,24 @@ elif page == "⚙️ Admin":
             st.caption("• Změnili jste hranice KPI")
             st.caption("• Přidali jste nová data")
 
-        conn.close()
+        # Per-month summary of the last "recalculate all" of this session
+        if st.session_state.get('recalc_all_months'):
+            recalc_jobs = db.get_recalc_status(st.session_state.recalc_all_months)
+            finished = recalc_jobs[recalc_jobs['status'].isin(['DONE', 'FAILED'])]
+            st.progress(len(finished) / len(recalc_jobs) if len(recalc_jobs) else 1.0,
+                        text=f"Přepočet: {len(finished)}/{len(recalc_jobs)} měsíců, "
+                             f"{int(finished['processed'].fillna(0).sum())} záznamů "
+                             f"(souběžných přepočtů na instanci: {db.get_recalc_concurrency()})")
+            if not finished.empty:
+                wall_time = (finished['finished_at'].max() - recalc_jobs['started_at'].min()).total_seconds()
+                st.caption(f"⏱️ Celkem {wall_time:.1f} s, součet měsíců {finished['duration_s'].sum():.1f} s, "
+                           f"nejdelší {finished['duration_s'].max():.1f} s")
+            st.dataframe(pd.DataFrame({
+                'Měsíc': recalc_jobs['mesic'].map(format_month),
+                'Stav': recalc_jobs['status'],
+                'Záznamů': recalc_jobs['processed'],
+                'Trvání (s)': recalc_jobs['duration_s'].round(2),
+                'Chyba': recalc_jobs['message'],
+            }), use_container_width=True, hide_index=True)
+
+db.end_rerun()
@@ -0,0 +1,6 @@
+"""
+RESTO - Benchmarks
+Standalone timing scripts, run from the repository root:
+    python -m benchmarks.porovnani
+    python -m benchmarks.suite --scale small --out bench.json
+"""
@@ -0,0 +1,186 @@
+"""
+Benchmark of the 👥 Porovnání page computation
+
+Compares the former nested-loop implementation with dashboard.manager_comparison
+and dashboard.kpi_breakdown on synthetic data (no database needed):
+- both produce identical tables on the smaller sizes
+- the vectorized time per evaluation row stays flat as the data grows (linear cost)
+
+Usage:
+    python -m benchmarks.porovnani
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import dashboard
+
+KPI_COUNT = 10
+LOCATIONS_PER_DEPARTMENT = 5
+SIZES = [1000, 2000, 4000, 8000, 16000, 32000, 64000]   # evaluation rows
+LEGACY_MAX_ROWS = 4000  # the nested loops get too slow beyond this
+REPEAT = 3
+
+def synthetic_data(rows, seed=0):
+    """Managers, locations, KPIs and one month of evaluation with about `rows` rows"""
+    rng = np.random.default_rng(seed)
+    location_count = max(rows // KPI_COUNT, 1)
+    department_count = max(location_count // LOCATIONS_PER_DEPARTMENT, 1)
+
+    departments = pd.DataFrame({'id': np.arange(1, department_count + 1)})
+    departments['nazev'] = [f"Oddělení {i:05d}" for i in departments['id']]
+    managers = pd.DataFrame({
+        'id': departments['id'].values,
+        'jmeno': [f"Provozní {i:05d}" for i in departments['id']],
+        'department_id': departments['id'].values,
+        'department': departments['nazev'].values,
+    })
+    locations = pd.DataFrame({
+        'id': np.arange(1, location_count + 1),
+        'nazev': [f"Lokalita {i:06d}" for i in range(1, location_count + 1)],
+        'department_id': (np.arange(location_count) % department_count) + 1,
+    })
+    locations['department'] = locations['department_id'].map(departments.set_index('id')['nazev'])
+    locations = locations.sort_values(['department', 'nazev']).reset_index(drop=True)
+    kpis = pd.DataFrame({
+        'id': np.arange(1, KPI_COUNT + 1),
+        'nazev': [f"KPI {i}" for i in range(1, KPI_COUNT + 1)],
+        'poradi': np.arange(1, KPI_COUNT + 1),
+    })
+
+    evaluation = pd.DataFrame({
+        'location_id': np.repeat(locations['id'].values, KPI_COUNT),
+        'kpi_id': np.tile(kpis['id'].values, len(locations)),
+    })
+    evaluation['hodnota'] = rng.uniform(0, 100, len(evaluation)).round(2)
+    evaluation['splneno'] = (evaluation['hodnota'] > 50).astype(int)
+    evaluation['bonus_procento'] = np.where(evaluation['splneno'] == 1, 10.0, 0.0)
+    return managers, locations, kpis, evaluation
+
+def cube_frames(managers, locations, kpis, evaluation):
+    """Frames shaped like get_manager_kpi_summary / get_manager_kpi_details (what the cube query returns)"""
+    scope = managers.rename(columns={'id': 'manager_id'}).merge(
+        locations[['id', 'nazev', 'department_id']].rename(columns={'id': 'location_id', 'nazev': 'location'}),
+        on='department_id')
+    details = scope.merge(evaluation, on='location_id')
+    details = details.merge(kpis[['id', 'nazev', 'poradi']].rename(columns={'id': 'kpi_id', 'nazev': 'kpi_nazev'}), on='kpi_id')
+    details = details.sort_values(['department', 'jmeno', 'location', 'poradi']).reset_index(drop=True)
+
+    per_location = scope.merge(evaluation, on='location_id', how='left')
+    per_location['evaluated_location'] = per_location['location_id'].where(per_location['kpi_id'].notna())
+    summary = per_location.groupby('manager_id').agg(
+        total_bonus=('bonus_procento', 'sum'),
+        total_kpis=('kpi_id', 'count'),
+        met_kpis=('splneno', 'sum'),
+        locations_with_data=('evaluated_location', 'nunique'),
+        location_count=('location_id', 'nunique'),
+    ).reset_index()
+    summary['avg_bonus'] = summary['total_bonus'] / summary['location_count']
+    return summary, details
+
+def legacy_porovnani(managers, locations, kpis, eval_data):
+    """The former page code: managers x locations x boolean masks, then again per KPI"""
+    summary_data = []
+    for _, manager in managers.iterrows():
+        locs_in_dept = locations[locations['department_id'] == manager['department_id']]
+        total_bonus = 0
+        total_kpis = 0
+        met_kpis = 0
+        for _, loc in locs_in_dept.iterrows():
+            loc_eval = eval_data[eval_data['location_id'] == loc['id']]
+            if not loc_eval.empty:
+                total_bonus += loc_eval['bonus_procento'].sum()
+                total_kpis += len(loc_eval)
+                met_kpis += loc_eval['splneno'].sum()
+        avg_bonus = total_bonus / len(locs_in_dept) if len(locs_in_dept) > 0 else 0
+        success_rate = (met_kpis / total_kpis * 100) if total_kpis > 0 else 0
+        summary_data.append({
+            'Provozní': manager['jmeno'],
+            'Oddělení': manager['department'],
+            'Počet lokalit': len(locs_in_dept),
+            'Celkový bonus (%)': round(avg_bonus, 1),
+            'Splněno KPI': met_kpis,
+            'Celkem KPI': total_kpis,
+            'Úspěšnost (%)': round(success_rate, 1)
+        })
+
+    tables = {}
+    for _, kpi in kpis.iterrows():
+        kpi_data = []
+        for _, manager in managers.iterrows():
+            locs_in_dept = locations[locations['department_id'] == manager['department_id']]
+            for _, loc in locs_in_dept.iterrows():
+                kpi_eval = eval_data[(eval_data['location_id'] == loc['id']) & (eval_data['kpi_id'] == kpi['id'])]
+                if not kpi_eval.empty:
+                    row = kpi_eval.iloc[0]
+                    kpi_data.append({
+                        'Provozní': manager['jmeno'],
+                        'Lokalita': loc['nazev'],
+                        'Hodnota': row['hodnota'],
+                        'Splněno': '✅ ANO' if row['splneno'] else '❌ NE',
+                        'Bonus (%)': row['bonus_procento']
+                    })
+        if kpi_data:
+            tables[int(kpi['id'])] = pd.DataFrame(kpi_data)
+    return pd.DataFrame(summary_data), tables
+
+def vectorized_porovnani(managers, summary, details):
+    return dashboard.manager_comparison(managers, summary), dashboard.kpi_breakdown(details)
+
+def _best_time(fn, *args):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _same_tables(legacy, vectorized):
+    (old_summary, old_tables), (new_summary, new_tables) = legacy, vectorized
+    if not old_summary.astype(str).equals(new_summary.astype(str)):
+        return False
+    return old_tables.keys() == new_tables.keys() and all(
+        old_tables[k].astype(str).equals(new_tables[k].astype(str)) for k in old_tables)
+
+def run(sizes=SIZES):
+    """Time both implementations; returns a list of result dicts"""
+    results = []
+    for rows in sizes:
+        managers, locations, kpis, evaluation = synthetic_data(rows)
+        summary, details = cube_frames(managers, locations, kpis, evaluation)
+
+        vectorized = _best_time(vectorized_porovnani, managers, summary, details)
+        result = {'rows': len(evaluation), 'vectorized_s': vectorized,
+                  'us_per_row': vectorized / len(evaluation) * 1e6, 'legacy_s': None, 'identical': None}
+        if rows <= LEGACY_MAX_ROWS:
+            result['legacy_s'] = _best_time(legacy_porovnani, managers, locations, kpis, evaluation)
+            result['identical'] = _same_tables(legacy_porovnani(managers, locations, kpis, evaluation),
+                                               vectorized_porovnani(managers, summary, details))
+        results.append(result)
+    return results
+
+def scaling_exponent(results):
+    """Slope of log(time) vs log(rows) - about 1.0 for linear cost"""
+    rows = np.log([r['rows'] for r in results])
+    times = np.log([r['vectorized_s'] for r in results])
+    return float(np.polyfit(rows, times, 1)[0])
+
+def main():
+    results = run()
+    print(f"{'rows':>8} {'vectorized':>12} {'µs/row':>8} {'legacy':>10} {'identical':>10}")
+    for r in results:
+        legacy = f"{r['legacy_s']:.3f} s" if r['legacy_s'] is not None else "-"
+        identical = {None: "-", True: "ano", False: "NE"}[r['identical']]
+        print(f"{r['rows']:>8} {r['vectorized_s']:>10.4f} s {r['us_per_row']:>8.2f} {legacy:>10} {identical:>10}")
+
+    exponent = scaling_exponent(results)
+    print(f"\nScaling exponent (log time / log rows): {exponent:.2f} (1.0 = linear)")
+    ok = all(r['identical'] is not False for r in results) and exponent < 1.2
+    print("✅ OK" if ok else "❌ FAILED")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+Benchmark suite on a synthetic restaurant chain (SQLite and PostgreSQL)
+
+Loads benchmarks.synthetic data into each backend, evaluates every month once
+(setup) and then times the hot paths with cold caches:
+- calculate_monthly_kpi_evaluation and calculate_department_summary of the last month
+- get_monthly_kpi_evaluation of the last month
+- 📊 Přehled and 👥 Porovnání aggregations (manager totals + dashboard helpers;
+  the PostgreSQL cube, computed from the evaluation in SQLite)
+- import_monthly_data_csv of one month in the import template format
+Results (best/median/all runs and the number of SQL statements) are written
+as JSON; --compare reports the change against an earlier result file and
+exits with 1 when a median got slower than the threshold.
+
+PostgreSQL runs only against the database given by --dsn or RESTO_BENCH_DSN,
+never the one in the Streamlit secrets - ITS DATA IS REPLACED.
+
+Usage:
+    python -m benchmarks.suite --scale small --out bench.json
+    RESTO_BENCH_DSN=postgresql://localhost/resto_bench python -m benchmarks.suite --backend postgres
+    python -m benchmarks.suite --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import dashboard
+import storage
+from benchmarks import synthetic
+
+REPEAT = 5
+THRESHOLD = 1.25  # median ratio counted as a regression
+MIN_DELTA_S = 0.005  # ignore changes below timer noise
+
+def git_commit():
+    """(commit hash, uncommitted changes) of the working tree, (None, None) outside git"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                capture_output=True, text=True, check=True).stdout
+        return commit.strip(), bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+# ============ BACKEND SETUP ============
+
+def open_backend(name, sqlite_path=None, dsn=None):
+    """Import the backend module pointed at the benchmark database"""
+    if name == 'postgres':
+        # Read by database_postgres.get_connection() instead of the secrets url
+        os.environ["RESTO_DATABASE_URL"] = dsn
+    backend = storage.get_backend(name)
+    if name == 'sqlite':
+        backend.DATABASE_FILE = sqlite_path
+    # Timings go to the JSON report, not to the slow query log
+    backend._query_stats.slow_log = None
+    backend.init_database()
+    return backend
+
+def prepare(backend, chain):
+    """Load the chain and evaluate all months; returns setup timings"""
+    started = time.perf_counter()
+    synthetic.load_chain(backend, chain)
+    loaded = time.perf_counter()
+    evaluated = sum(backend.calculate_monthly_kpi_evaluation(mesic) or 0 for mesic in chain['months'])
+    for mesic in chain['months']:
+        backend.calculate_department_summary(mesic)
+    if evaluated == 0:
+        raise RuntimeError("Výpočet bonusů nevyhodnotil žádné záznamy")
+    return {'load_s': loaded - started, 'evaluate_s': time.perf_counter() - loaded, 'evaluated': evaluated}
+
+# ============ CASES ============
+
+def cube_frames(backend, mesic):
+    """Manager totals and KPI rows of a month as the Přehled/Porovnání pages read them"""
+    return backend.get_manager_kpi_summary(mesic), backend.get_manager_kpi_details(mesic)
+
+def prehled(backend, mesic):
+    managers = backend.get_operational_managers()
+    summary, details = cube_frames(backend, mesic)
+    return dashboard.manager_overview(managers, summary), dashboard.location_details(details)
+
+def porovnani_page(backend, mesic):
+    managers = backend.get_operational_managers()
+    summary, details = cube_frames(backend, mesic)
+    return dashboard.manager_comparison(managers, summary), dashboard.kpi_breakdown(details)
+
+def cases(backend, chain):
+    """(name, fn) pairs in run order - the import goes last as it rewrites the month"""
+    mesic = chain['months'][-1]
+    csv_content = synthetic.import_csv(chain, mesic, seed=chain['seed'] + 1)
+    return [
+        ('calculate_monthly_kpi_evaluation', lambda: backend.calculate_monthly_kpi_evaluation(mesic)),
+        ('calculate_department_summary', lambda: backend.calculate_department_summary(mesic)),
+        ('get_monthly_kpi_evaluation', lambda: backend.get_monthly_kpi_evaluation(mesic)),
+        ('prehled', lambda: prehled(backend, mesic)),
+        ('porovnani', lambda: porovnani_page(backend, mesic)),
+        ('import_monthly_data_csv', lambda: backend.import_monthly_data_csv(csv_content)),
+    ]
+
+def _size(result):
+    """Comparable size of a case result (rows, records, tables)"""
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, (pd.DataFrame, dict, list)):
+        return len(result)
+    return result if isinstance(result, int) else None
+
+def time_case(backend, fn, repeat):
+    runs, statements, size = [], None, None
+    for _ in range(repeat):
+        backend.clear_cache()
+        backend.reset_query_stats()
+        start = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - start)
+        statements = backend.get_query_stats()['statements']
+        size = _size(result)
+    return {'best_s': min(runs), 'median_s': statistics.median(runs), 'runs': runs,
+            'statements': statements, 'result': size}
+
+def run_backend(name, chain, repeat, sqlite_path=None, dsn=None):
+    backend = open_backend(name, sqlite_path, dsn)
+    setup = prepare(backend, chain)
+    results = {case: time_case(backend, fn, repeat) for case, fn in cases(backend, chain)}
+    return {'setup': setup, 'benchmarks': results}
+
+# ============ REPORT ============
+
+def compare(old, new, threshold=THRESHOLD):
+    """Median ratios new/old per backend and case; returns (rows, regressions)"""
+    rows = []
+    for backend, current in new['backends'].items():
+        previous = old.get('backends', {}).get(backend, {}).get('benchmarks', {})
+        for case, result in current['benchmarks'].items():
+            if case not in previous:
+                continue
+            before, after = previous[case]['median_s'], result['median_s']
+            ratio = after / before if before > 0 else float('inf')
+            regression = ratio > threshold and after - before > MIN_DELTA_S
+            rows.append({'backend': backend, 'case': case, 'old_s': before, 'new_s': after,
+                         'ratio': ratio, 'regression': regression})
+    return rows, [row for row in rows if row['regression']]
+
+def print_results(report):
+    print(f"{'backend':<9} {'case':<34} {'median':>10} {'best':>10} {'SQL':>5} {'result':>7}")
+    for backend, data in report['backends'].items():
+        for case, r in data['benchmarks'].items():
+            result = r['result'] if r['result'] is not None else "-"
+            print(f"{backend:<9} {case:<34} {r['median_s']:>8.4f} s {r['best_s']:>8.4f} s "
+                  f"{r['statements']:>5} {result:>7}")
+        setup = data['setup']
+        print(f"{backend:<9} {'(setup: load / evaluate all months)':<34} "
+              f"{setup['load_s']:>8.2f} s {setup['evaluate_s']:>8.2f} s")
+
+def print_comparison(rows, old):
+    print(f"\nCompared with {old['meta'].get('commit') or '?'} ({old['meta'].get('created')}):")
+    print(f"{'backend':<9} {'case':<34} {'old':>10} {'new':>10} {'ratio':>7}")
+    for row in rows:
+        mark = "❌" if row['regression'] else ""
+        print(f"{row['backend']:<9} {row['case']:<34} {row['old_s']:>8.4f} s {row['new_s']:>8.4f} s "
+              f"{row['ratio']:>6.2f}x {mark}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", action="append", choices=sorted(storage.BACKENDS),
+                        help="backend to benchmark (repeatable; default sqlite, plus postgres with RESTO_BENCH_DSN)")
+    parser.add_argument("--scale", choices=sorted(synthetic.SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--dsn", default=os.environ.get("RESTO_BENCH_DSN"),
+                        help="PostgreSQL database for the benchmark, its data is replaced (RESTO_BENCH_DSN)")
+    parser.add_argument("--sqlite-path", help="SQLite file to use (default a temporary file)")
+    parser.add_argument("--out", help="write the JSON results to this file")
+    parser.add_argument("--compare", help="earlier JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help=f"median ratio reported as a regression (default {THRESHOLD})")
+    args = parser.parse_args(argv)
+    args.backend = args.backend or (['sqlite', 'postgres'] if args.dsn else ['sqlite'])
+    if 'postgres' in args.backend and not args.dsn:
+        parser.error("postgres needs --dsn or RESTO_BENCH_DSN (a database whose data may be replaced)")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    chain = synthetic.generate_chain(args.scale, args.seed)
+    commit, dirty = git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'scale': args.scale,
+            'params': chain['params'],
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'rows': synthetic.chain_size(chain),
+        },
+        'backends': {},
+    }
+
+    temp_dir = None if args.sqlite_path else tempfile.mkdtemp(prefix="resto-bench-")
+    try:
+        for name in args.backend:
+            sqlite_path = args.sqlite_path or os.path.join(temp_dir, "bench.db")
+            report['backends'][name] = run_backend(name, chain, args.repeat, sqlite_path, args.dsn)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    print_results(report)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nResults written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            old = json.load(f)
+        if (old['meta'].get('params'), old['meta'].get('seed')) != (report['meta']['params'], args.seed):
+            print(f"\n⚠️ {args.compare} was measured on other data (scale/seed), not compared")
+            return 2
+        rows, regressions = compare(old, report, args.threshold)
+        print_comparison(rows, old)
+        print("❌ REGRESSION" if regressions else "✅ OK")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Synthetic restaurant-chain data for the benchmarks
+
+generate_chain() builds a deterministic chain (same seed and scale -> same data):
+- departments with locations and operational managers, every 5th department
+  has its own KPIs (monthly_department_kpi_data)
+- KPI definitions with threshold rules in the shapes the app uses (≥, ≤, <, mezi)
+- months of KPI values per location, with a few values missing like real input
+load_chain() replaces the contents of a backend database (database or
+database_postgres module) with the chain, import_csv() produces a CSV in the
+import template format.
+"""
+
+import numpy as np
+import pandas as pd
+
+import import_engine
+
+SCALES = {
+    'small': {'departments': 4, 'locations_per_department': 5, 'managers_per_department': 1, 'kpis': 10, 'years': 1},
+    'medium': {'departments': 10, 'locations_per_department': 10, 'managers_per_department': 2, 'kpis': 10, 'years': 2},
+    'large': {'departments': 25, 'locations_per_department': 20, 'managers_per_department': 2, 'kpis': 15, 'years': 3},
+}
+
+END_MONTH = "2025-12"
+COVERAGE = 0.97  # share of (month, location, KPI) values present
+
+# (name, unit, mean, sd, min, max, thresholds as (min_hodnota, max_hodnota, operator, bonus, popis))
+KPI_PATTERNS = [
+    ("Audit", "%", 84.0, 8.0, 0.0, 100.0,
+     [(90, None, "≥", 20, "≥90%"), (75, 89.99, "mezi", 10, "75-89.99%"), (None, 75, "<", 0, "<75%")]),
+    ("Hodnocení", "★", 4.5, 0.25, 1.0, 5.0, [(4.6, None, "≥", 10, "≥4.6★")]),
+    ("Čas přípravy", "min", 10.0, 2.0, 3.0, 30.0, [(None, 10, "≤", 10, "≤10min")]),
+    ("Ztráta", "%", 0.5, 0.3, 0.0, 3.0, [(None, 0.5, "≤", 5, "≤0.5%")]),
+    ("Obratohodina", "Kč/h", 1250.0, 200.0, 300.0, 3000.0,
+     [(1400, None, "≥", 10, "≥1400 Kč/h"), (1250, None, "≥", 5, "≥1250 Kč/h")]),
+]
+
+# Children first (delete order), the reverse is the insert order
+TABLES = ['department_monthly_summary', 'monthly_department_kpi_data', 'monthly_kpi_evaluation', 'monthly_kpi_data',
+          'manager_kpi_assignments', 'kpi_thresholds', 'kpi_definitions', 'operational_managers', 'locations',
+          'departments']
+# Derived PostgreSQL tables, rebuilt from the loaded data
+POSTGRES_TABLES = ['monthly_kpi_cube', 'recalc_jobs', 'recalc_dirty', 'month_catalog']
+
+def months_back(count, end=END_MONTH):
+    """count consecutive 'YYYY-MM' months ending with end"""
+    return [period.strftime("%Y-%m") for period in pd.period_range(end=end, periods=count, freq='M')]
+
+def _values(rng, pattern_ids, size):
+    """Random KPI values following each KPI's pattern (rounded to 2 decimals)"""
+    patterns = [KPI_PATTERNS[i] for i in pattern_ids]
+    mean = np.array([p[2] for p in patterns])
+    sd = np.array([p[3] for p in patterns])
+    low = np.array([p[4] for p in patterns])
+    high = np.array([p[5] for p in patterns])
+    return np.clip(rng.normal(mean, sd, size), low, high).round(2)
+
+def _kpi_values(rng, months, owners, owner_column, kpis):
+    """One row per month x owner x KPI (minus the missing share)"""
+    grid = pd.MultiIndex.from_product([months, owners, kpis['id']], names=['mesic', owner_column, 'kpi_id'])
+    frame = grid.to_frame(index=False)
+    pattern_ids = ((frame['kpi_id'].to_numpy() - 1) % len(KPI_PATTERNS))
+    frame['hodnota'] = _values(rng, pattern_ids, (len(frame),))
+    frame = frame[rng.random(len(frame)) < COVERAGE].reset_index(drop=True)
+    frame.insert(0, 'id', np.arange(1, len(frame) + 1))
+    frame['status'] = 'ACTIVE'
+    frame['zdroj'] = 'IMPORT'
+    return frame
+
+def generate_chain(scale='small', seed=0, end_month=END_MONTH, **overrides):
+    """Chain tables as DataFrames (keys are table names) plus 'months'
+
+    scale is a SCALES name, overrides change single parameters
+    (departments, locations_per_department, managers_per_department, kpis, years).
+    """
+    params = {**SCALES[scale], **overrides}
+    rng = np.random.default_rng(seed)
+
+    department_ids = np.arange(1, params['departments'] + 1)
+    departments = pd.DataFrame({
+        'id': department_ids,
+        'nazev': [f"Oddělení {i:03d}" for i in department_ids],
+        'vedouci': [f"Vedoucí {i:03d}" for i in department_ids],
+        'ma_vlastni_kpi': department_ids % 5 == 0,
+        'aktivni': True,
+    })
+
+    location_count = params['departments'] * params['locations_per_department']
+    location_ids = np.arange(1, location_count + 1)
+    locations = pd.DataFrame({
+        'id': location_ids,
+        'nazev': [f"Restaurace {i:04d}" for i in location_ids],
+        'department_id': (location_ids - 1) // params['locations_per_department'] + 1,
+        'aktivni': True,
+    })
+
+    manager_count = params['departments'] * params['managers_per_department']
+    manager_ids = np.arange(1, manager_count + 1)
+    managers = pd.DataFrame({
+        'id': manager_ids,
+        'jmeno': [f"Provozní {i:03d}" for i in manager_ids],
+        'department_id': (manager_ids - 1) // params['managers_per_department'] + 1,
+        'email': [f"provozni{i:03d}@example.com" for i in manager_ids],
+        'aktivni': True,
+    })
+
+    kpi_ids = np.arange(1, params['kpis'] + 1)
+    pattern_ids = (kpi_ids - 1) % len(KPI_PATTERNS)
+    kpis = pd.DataFrame({
+        'id': kpi_ids,
+        'nazev': [f"{KPI_PATTERNS[p][0]} {(i - 1) // len(KPI_PATTERNS) + 1}" for i, p in zip(kpi_ids, pattern_ids)],
+        'jednotka': [KPI_PATTERNS[p][1] for p in pattern_ids],
+        'aktivni': True,
+        'poradi': kpi_ids,
+    })
+
+    thresholds = pd.DataFrame([
+        (kpi_id, lo, hi, operator, bonus, popis, poradi)
+        for kpi_id, p in zip(kpi_ids, pattern_ids)
+        for poradi, (lo, hi, operator, bonus, popis) in enumerate(KPI_PATTERNS[p][6], start=1)
+    ], columns=['kpi_id', 'min_hodnota', 'max_hodnota', 'operator', 'bonus_procento', 'popis', 'poradi'])
+    thresholds.insert(0, 'id', np.arange(1, len(thresholds) + 1))
+
+    assignments = pd.MultiIndex.from_product([manager_ids, kpi_ids], names=['manager_id', 'kpi_id']).to_frame(index=False)
+    assignments.insert(0, 'id', np.arange(1, len(assignments) + 1))
+
+    months = months_back(params['years'] * 12, end_month)
+    monthly = _kpi_values(rng, months, location_ids, 'location_id', kpis)
+    department_monthly = _kpi_values(rng, months, departments.loc[departments['ma_vlastni_kpi'], 'id'],
+                                     'department_id', kpis)
+
+    return {
+        'params': params,
+        'seed': seed,
+        'months': months,
+        'departments': departments,
+        'locations': locations,
+        'operational_managers': managers,
+        'kpi_definitions': kpis,
+        'kpi_thresholds': thresholds,
+        'manager_kpi_assignments': assignments,
+        'monthly_kpi_data': monthly,
+        'monthly_department_kpi_data': department_monthly,
+    }
+
+def chain_size(chain):
+    """Row counts of the generated tables"""
+    return {table: len(chain[table]) for table in reversed(TABLES) if table in chain}
+
+def import_csv(chain, mesic=None, seed=1):
+    """CSV text in the import template format: every location x KPI of one month (default the last)"""
+    rng = np.random.default_rng(seed)
+    mesic = mesic or chain['months'][-1]
+    locations, kpis = chain['locations'], chain['kpi_definitions']
+    grid = pd.MultiIndex.from_product([locations['nazev'], kpis['nazev']], names=['location', 'kpi']).to_frame(index=False)
+    pattern_ids = np.tile((kpis['id'].to_numpy() - 1) % len(KPI_PATTERNS), len(locations))
+    frame = pd.DataFrame({
+        import_engine.COL_MESIC: mesic,
+        import_engine.COL_LOCATION: grid['location'].values,
+        import_engine.COL_KPI: grid['kpi'].values,
+        import_engine.COL_VALUE: _values(rng, pattern_ids, (len(grid),)),
+        import_engine.COL_NOTE: "",
+    })
+    return frame.to_csv(index=False)
+
+def _rows(frame):
+    """Frame rows as tuples of plain Python values (NaN -> None)"""
+    columns = [[None if pd.isna(value) else value for value in frame[column].tolist()] for column in frame.columns]
+    return list(zip(*columns))
+
+def load_chain(backend, chain):
+    """Replace the backend's data with the chain (all chain tables are emptied first)
+
+    backend is the database or database_postgres module; init_database() must
+    have run. Evaluations and summaries are left empty for the caller to compute.
+    """
+    dialect = backend.DIALECT
+    postgres = dialect.name == 'postgres'
+    with backend.connection() as conn:
+        cursor = conn.cursor()
+        if postgres:
+            cursor.execute(f"TRUNCATE {', '.join(TABLES + POSTGRES_TABLES)} RESTART IDENTITY CASCADE")
+        else:
+            for table in TABLES:
+                cursor.execute(f"DELETE FROM {table}")
+
+        for table in reversed(TABLES):
+            if table not in chain:
+                continue
+            frame = chain[table]
+            dialect.insert_values(cursor, f"INSERT INTO {table} ({', '.join(frame.columns)}) VALUES %s",
+                                  _rows(frame), "(" + ", ".join(["%s"] * len(frame.columns)) + ")")
+
+        if postgres:
+            for table in TABLES:
+                cursor.execute(f"""
+                    SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false)
+                    FROM {table}
+                """)
+        backend.refresh_month_catalog(cursor)
+        conn.commit()
+
+    if postgres:
+        backend.invalidate_threshold_cache()
+    backend.clear_cache()
@@ -0,0 +1,155 @@
+"""
+RESTO - Bonus Engine
+Vectorized evaluation of KPI values against kpi_thresholds rules:
+- Thresholds are applied per KPI in poradi order, first matching rule wins
+- Operators: ≥, ≤, <, > and mezi (inclusive range)
+- Values without a matching rule (or without thresholds) get 0 % bonus
+- Rules are compiled per KPI into a breakpoint table for O(log n) lookups
+"""
+
+from bisect import bisect_left
+import pandas as pd
+import numpy as np
+
+OPERATORS = ["≥", "≤", ">", "<", "mezi"]
+
+THRESHOLD_COLUMNS = ['id', 'kpi_id', 'min_hodnota', 'max_hodnota', 'operator', 'bonus_procento', 'poradi']
+
+def prepare_thresholds(thresholds):
+    """Normalize a kpi_thresholds frame: numeric bounds and stable poradi order"""
+    df = pd.DataFrame(thresholds)
+    if df.empty:
+        return pd.DataFrame(columns=THRESHOLD_COLUMNS)
+    if 'id' not in df.columns:
+        df['id'] = np.arange(len(df))
+    df = df[THRESHOLD_COLUMNS].copy()
+    df['kpi_id'] = df['kpi_id'].astype('int64')
+    for col in ['min_hodnota', 'max_hodnota', 'bonus_procento']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    df['poradi'] = pd.to_numeric(df['poradi'], errors='coerce')
+    df = df.sort_values(['kpi_id', 'poradi', 'id'], na_position='last', kind='mergesort')
+    df['rule_no'] = df.groupby('kpi_id').cumcount()
+    return df.reset_index(drop=True)
+
+def match_rules(hodnota, operator, min_hodnota, max_hodnota):
+    """Boolean mask of values satisfying their threshold rule (element-wise)"""
+    v = np.asarray(hodnota, dtype='float64')
+    op = np.asarray(operator, dtype=object)
+    lo = np.asarray(min_hodnota, dtype='float64')
+    hi = np.asarray(max_hodnota, dtype='float64')
+    has_lo = ~np.isnan(lo)
+    has_hi = ~np.isnan(hi)
+    with np.errstate(invalid='ignore'):
+        return (
+            ((op == "≥") & has_lo & (v >= lo)) |
+            ((op == "≤") & has_hi & (v <= hi)) |
+            ((op == "<") & has_hi & (v < hi)) |
+            ((op == ">") & has_lo & (v > lo)) |
+            ((op == "mezi") & has_lo & has_hi & (v >= lo) & (v <= hi))
+        )
+
+class CompiledRules:
+    """Threshold rules of one KPI compiled into a piecewise-constant bonus table
+
+    The sorted breakpoints b0 < b1 < ... < bk-1 (all min/max bounds) split the
+    number line into 2k+1 pieces: (-inf, b0), {b0}, (b0, b1), {b1}, ..., (bk-1, inf).
+    Every rule is constant on each piece, so the first-match bonus is resolved
+    once per piece at compile time and a lookup is a single binary search.
+    """
+
+    def __init__(self, breakpoints, bonuses, has_rules):
+        self.breakpoints = np.asarray(breakpoints, dtype='float64')
+        self.bonuses = np.asarray(bonuses, dtype='float64')
+        self.has_rules = has_rules
+        self._breakpoint_list = self.breakpoints.tolist()
+        self._bonus_list = self.bonuses.tolist()
+
+    @classmethod
+    def from_rules(cls, rules):
+        """Compile prepared threshold rows of a single KPI (sorted by rule_no)"""
+        if rules is None or len(rules) == 0:
+            return cls([], [0.0], has_rules=False)
+
+        bounds = pd.concat([rules['min_hodnota'], rules['max_hodnota']]).dropna()
+        breakpoints = np.unique(bounds.to_numpy(dtype='float64'))
+
+        # One representative value per piece: each breakpoint plus a point inside each gap
+        if len(breakpoints):
+            points = [np.nextafter(breakpoints[0], -np.inf)]
+            for i, b in enumerate(breakpoints):
+                points.append(b)
+                upper = breakpoints[i + 1] if i + 1 < len(breakpoints) else np.inf
+                points.append(np.nextafter(b, upper))
+        else:
+            points = [0.0]
+        points = np.asarray(points, dtype='float64')
+
+        bonuses = np.zeros(len(points), dtype='float64')
+        resolved = np.zeros(len(points), dtype=bool)
+        for rule in rules.itertuples(index=False):
+            hit = match_rules(points, np.full(len(points), rule.operator, dtype=object),
+                              np.full(len(points), rule.min_hodnota),
+                              np.full(len(points), rule.max_hodnota)) & ~resolved
+            bonuses[hit] = 0.0 if pd.isna(rule.bonus_procento) else rule.bonus_procento
+            resolved |= hit
+
+        return cls(breakpoints, bonuses, has_rules=True)
+
+    def lookup(self, hodnota):
+        """Bonus for a single value (pure Python, O(log n))"""
+        if hodnota is None or hodnota != hodnota:  # None or NaN
+            return 0
+        i = bisect_left(self._breakpoint_list, hodnota)
+        exact = i < len(self._breakpoint_list) and self._breakpoint_list[i] == hodnota
+        return self._bonus_list[2 * i + (1 if exact else 0)]
+
+    def lookup_many(self, values):
+        """Bonus for an array of values (NumPy searchsorted)"""
+        v = np.asarray(values, dtype='float64')
+        if len(self.breakpoints) == 0:
+            result = np.full(len(v), self.bonuses[0])
+        else:
+            i = np.searchsorted(self.breakpoints, v, side='left')
+            exact = self.breakpoints[np.minimum(i, len(self.breakpoints) - 1)] == v
+            result = self.bonuses[2 * i + exact.astype(int)]
+        result[np.isnan(v)] = 0.0
+        return result
+
+def compile_thresholds(thresholds):
+    """Compile kpi_thresholds rows into {kpi_id: CompiledRules}"""
+    rules = prepare_thresholds(thresholds)
+    return {int(kpi_id): CompiledRules.from_rules(group) for kpi_id, group in rules.groupby('kpi_id')}
+
+def evaluate_bonuses(values, rules):
+    """Evaluate bonus for every KPI value at once
+
+    Args:
+        values: DataFrame with kpi_id and hodnota columns (any index)
+        rules: {kpi_id: CompiledRules} or raw kpi_thresholds rows (DataFrame / list of dicts)
+
+    Returns:
+        DataFrame aligned to values.index with bonus_procento and splneno columns
+    """
+    if not isinstance(rules, dict):
+        rules = compile_thresholds(rules)
+
+    bonus = np.zeros(len(values), dtype='float64')
+    if len(values):
+        kpi_ids = values['kpi_id'].astype('int64').to_numpy()
+        hodnoty = pd.to_numeric(values['hodnota'], errors='coerce').astype('float64').to_numpy()
+        for kpi_id, positions in pd.Series(np.arange(len(values))).groupby(kpi_ids).indices.items():
+            compiled = rules.get(int(kpi_id))
+            if compiled is not None:
+                bonus[positions] = compiled.lookup_many(hodnoty[positions])
+
+    result = pd.DataFrame(index=values.index)
+    result['bonus_procento'] = bonus
+    result['splneno'] = (bonus > 0).astype(int)
+    return result
+
+def kpis_without_thresholds(kpi_ids, rules):
+    """KPI IDs from kpi_ids that have no threshold rule at all"""
+    if not isinstance(rules, dict):
+        rules = compile_thresholds(rules)
+    return sorted(int(k) for k in set(int(k) for k in kpi_ids)
+                  if rules.get(int(k)) is None or not rules[int(k)].has_rules)
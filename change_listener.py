@@ -0,0 +1,133 @@
+"""
+RESTO - Change Listener
+Background thread that keeps one PostgreSQL session on LISTEN:
+- Triggers NOTIFY a channel with the changed table (and month) as JSON
+- Every notification is passed to a handler that invalidates matching cache entries
+- Notifications sent by this process itself are skipped (it already invalidated locally)
+- After a lost connection the listener reconnects and reports a resync, because
+  notifications sent in the meantime are gone
+"""
+
+import json
+import select
+import threading
+import time
+
+class ChangeListener:
+    """LISTEN loop on a dedicated connection
+
+    connect_fn() returns a new psycopg2 connection, handler(payload) gets each
+    decoded notification and on_resync() runs after every (re)connect.
+    """
+
+    def __init__(self, connect_fn, channel, handler, on_resync=None, origin=None,
+                 poll_interval=5.0, retry_interval=5.0):
+        self._connect_fn = connect_fn
+        self.channel = channel
+        self._handler = handler
+        self._on_resync = on_resync
+        self.origin = origin
+        self.poll_interval = float(poll_interval)
+        self.retry_interval = float(retry_interval)
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            'connected': False,
+            'received': 0,
+            'applied': 0,
+            'own': 0,
+            'errors': 0,
+            'reconnects': 0,
+            'last_event': None,
+            'last_error': None,
+        }
+
+    def start(self):
+        """Start the listener thread (no-op when it is already running)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"listen-{self.channel}", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        return stats
+
+    def _update(self, **values):
+        with self._lock:
+            self._stats.update(values)
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _run(self):
+        first = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect_fn()
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                self._update(connected=True)
+                if not first:
+                    self._count('reconnects')
+                # Anything cached before LISTEN took effect may already be stale
+                if self._on_resync is not None:
+                    self._on_resync()
+                first = False
+                self._listen(conn)
+            except Exception as e:
+                self._update(connected=False, last_error=str(e))
+                self._count('errors')
+                self._stop.wait(self.retry_interval)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+        self._update(connected=False)
+
+    def _listen(self, conn):
+        while not self._stop.is_set():
+            if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                self.dispatch(conn.notifies.pop(0).payload)
+
+    def dispatch(self, payload):
+        """Decode one notification payload and hand it to the handler"""
+        self._count('received')
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            self._update(last_error=f"Neplatná notifikace: {payload[:200]}")
+            self._count('errors')
+            return
+        if self.origin is not None and event.get('origin') == self.origin:
+            self._count('own')
+            return
+        try:
+            self._handler(event)
+        except Exception as e:
+            self._update(last_error=str(e))
+            self._count('errors')
+            return
+        self._update(last_event=time.time())
+        self._count('applied')
@@ -0,0 +1,101 @@
+"""
+RESTO - Dashboard Aggregations
+Pure pandas helpers for the 📊 Přehled, 📈 Detail, 👥 Porovnání and 📉 Trend pages:
+- Totals come precomputed from the monthly KPI cube (database_postgres.get_manager_kpi_summary)
+- KPI rows per manager/location come from get_manager_kpi_details
+- Trend series are derived from one get_kpi_evaluation_range frame
+- No database access here
+"""
+
+import numpy as np
+import pandas as pd
+
+SUMMARY_COLUMNS = ['total_bonus', 'total_kpis', 'met_kpis', 'locations_with_data', 'location_count', 'avg_bonus']
+
+def manager_overview(managers, summary):
+    """Cube totals for every active manager, indexed by manager id
+
+    Managers without cube rows (no locations, or a month without data) get zeros.
+    """
+    overview = managers[['id']].merge(summary, how='left', left_on='id', right_on='manager_id')
+    overview[SUMMARY_COLUMNS] = overview[SUMMARY_COLUMNS].fillna(0)
+    for column in ['total_kpis', 'met_kpis', 'locations_with_data', 'location_count']:
+        overview[column] = overview[column].astype(int)
+    return overview.set_index('id')[SUMMARY_COLUMNS]
+
+def manager_comparison(managers, summary):
+    """👥 Porovnání summary table (one row per manager, Czech column names)"""
+    overview = manager_overview(managers, summary)
+    success_rate = (overview['met_kpis'] / overview['total_kpis'].where(overview['total_kpis'] > 0) * 100).fillna(0)
+    return pd.DataFrame({
+        'Provozní': managers['jmeno'].values,
+        'Oddělení': managers['department'].values,
+        'Počet lokalit': overview['location_count'].values,
+        'Celkový bonus (%)': overview['avg_bonus'].round(1).values,
+        'Splněno KPI': overview['met_kpis'].values,
+        'Celkem KPI': overview['total_kpis'].values,
+        'Úspěšnost (%)': success_rate.round(1).values,
+    })
+
+def kpi_breakdown(details):
+    """👥 Porovnání per-KPI tables from get_manager_kpi_details: {kpi_id: DataFrame}
+
+    Rows keep the cube order (manager, then location) and use Czech column names.
+    """
+    table = pd.DataFrame({
+        'kpi_id': details['kpi_id'].values,
+        'Provozní': details['jmeno'].values,
+        'Lokalita': details['location'].values,
+        'Hodnota': details['hodnota'].values,
+        'Splněno': np.where(details['splneno'].values != 0, '✅ ANO', '❌ NE'),
+        'Bonus (%)': details['bonus_procento'].values,
+    })
+    return {int(kpi_id): rows.drop(columns='kpi_id').reset_index(drop=True)
+            for kpi_id, rows in table.groupby('kpi_id', sort=False)}
+
+def location_details(details):
+    """KPI rows split per manager and location: {(manager_id, location_id): DataFrame}"""
+    return {(int(manager_id), int(location_id)): rows
+            for (manager_id, location_id), rows in details.groupby(['manager_id', 'location_id'], sort=False)}
+
+TREND_COLUMNS = ['mesic', 'id', 'nazev', 'hodnota']
+
+def manager_trend(evaluation, managers, locations, kpi_id=None):
+    """Monthly series per manager from a get_kpi_evaluation_range frame
+
+    Without kpi_id the value is the manager's bonus as on the Přehled cards
+    (bonus sum / active locations of the department), with kpi_id the mean
+    KPI value over the department's locations. Returns TREND_COLUMNS with
+    id = manager_id and nazev = "jmeno (oddělení)", unique per manager.
+    """
+    rows = evaluation[evaluation['location_id'].isin(locations['id'])]
+    if kpi_id is not None:
+        rows = rows[rows['kpi_id'] == kpi_id]
+    if rows.empty:
+        return pd.DataFrame(columns=TREND_COLUMNS)
+
+    per_department = rows.groupby(['mesic', 'department_id']).agg(
+        bonus=('bonus_procento', 'sum'),
+        hodnota=('hodnota', 'mean'),
+    ).reset_index()
+    if kpi_id is None:
+        location_count = locations.groupby('department_id').size()
+        per_department['hodnota'] = per_department['bonus'] / per_department['department_id'].map(location_count)
+
+    # Names repeat across departments (and could within one) - the label must not merge managers
+    labels = managers['jmeno'] + ' (' + managers['department'].fillna('') + ')'
+    labels = labels.where(~labels.duplicated(keep=False), labels + ' #' + managers['id'].astype(str))
+    series = managers[['id', 'department_id']].assign(nazev=labels)
+    trend = series.merge(per_department, on='department_id')[TREND_COLUMNS]
+    return trend.sort_values(['mesic', 'nazev']).reset_index(drop=True)
+
+def location_trend(evaluation, locations, kpi_id=None):
+    """Monthly series per active location: bonus sum, or the KPI value with kpi_id. Returns TREND_COLUMNS."""
+    rows = evaluation[evaluation['location_id'].isin(locations['id'])]
+    if kpi_id is not None:
+        rows = rows[rows['kpi_id'] == kpi_id]
+        trend = rows[['mesic', 'location_id', 'location', 'hodnota']]
+    else:
+        trend = rows.groupby(['mesic', 'location_id', 'location'], as_index=False)['bonus_procento'].sum()
+    trend = trend.set_axis(TREND_COLUMNS, axis=1)
+    return trend.sort_values(['mesic', 'nazev']).reset_index(drop=True)
@@ -0,0 +1,120 @@
+"""
+RESTO - Tagged Data Cache
+Process-wide cache for the database read functions:
+- Entries expire after a TTL and carry tags such as "locations" or
+  "monthly_kpi_evaluation:2025-11"
+- Writers invalidate only the tags they touched instead of clearing everything
+- Cached values are copied on the way out, so callers cannot mutate shared entries
+"""
+
+import threading
+import time
+from functools import wraps
+
+ALL_MONTHS = "*"
+
+def month_tag(table, mesic=None):
+    """Tag of one month of a table ("table:*" for reads spanning all months)"""
+    return f"{table}:{mesic if mesic else ALL_MONTHS}"
+
+def _copy(value):
+    return value.copy() if hasattr(value, 'copy') else value
+
+class TaggedCache:
+    """Thread-safe TTL cache with tag-based invalidation"""
+
+    def __init__(self, on_lookup=None):
+        self._on_lookup = on_lookup  # on_lookup(key, hit) after every get()
+        self._entries = {}  # key -> (expires_at, value, tags)
+        self._keys_by_tag = {}
+        self._epoch = 0  # bumped on every invalidation, guards against storing stale reads
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidated = 0
+
+    def begin(self):
+        """Token to pass to set() - reads that raced with an invalidation are not stored"""
+        with self._lock:
+            return self._epoch
+
+    def get(self, key):
+        """Return (found, value)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self._misses += 1
+                found, value = False, None
+            else:
+                self._hits += 1
+                found, value = True, entry[1]
+        if self._on_lookup is not None:
+            self._on_lookup(key, found)
+        return found, value
+
+    def set(self, key, value, tags, ttl, token=None):
+        with self._lock:
+            if token is not None and token != self._epoch:
+                return
+            self._drop(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tuple(tags))
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying any of the tags, returns number of dropped entries"""
+        with self._lock:
+            self._epoch += 1
+            keys = set()
+            for tag in tags:
+                keys |= self._keys_by_tag.get(tag, set())
+            for key in keys:
+                self._drop(key)
+            self._invalidated += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._invalidated += len(self._entries)
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'invalidated': self._invalidated,
+            }
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+def cached(cache, ttl, tags):
+    """Cache a read function; tags(*args, **kwargs) returns the tags of one call"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+            found, value = cache.get(key)
+            if found:
+                return _copy(value)
+            token = cache.begin()
+            value = fn(*args, **kwargs)
+            cache.set(key, value, tags(*args, **kwargs), ttl, token)
+            return _copy(value)
+        wrapper.uncached = fn
+        return wrapper
+    return decorator
@@ -9,21 +9,198 @@ Monthly KPI tracking with corrected structure:
 """
 
 import sqlite3
+import re
+import threading
+import itertools
 import pandas as pd
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 import io
+import bonus_engine
+import import_engine
+import query_stats
+import reference_data
+import storage
 
 DATABASE_FILE = "resto_data.db"
 
+class SqliteDialect(storage.SqliteDialect):
+    """SQLite dialect with this module's connection and reference data"""
+
+    def connection(self):
+        return connection()
+
+    def reference_data(self):
+        return get_reference_data()
+
+    def committed(self, table, keys=()):
+        invalidate_cache(table)
+
+# Shared queries and admin writes (storage.py) in the SQLite dialect
+DIALECT = SqliteDialect()
+
+# Applied once per connection. WAL lets readers run while a write is in
+# progress; synchronous = NORMAL is durable in WAL mode except for the last
+# transactions on power loss.
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",     # Force integer detection for foreign keys
+    "PRAGMA busy_timeout = 5000",   # wait for a concurrent writer instead of failing
+    "PRAGMA cache_size = -65536",   # 64 MB page cache
+    "PRAGMA mmap_size = 268435456", # 256 MB memory-mapped reads
+    "PRAGMA temp_store = MEMORY",
+]
+
+# Every statement is timed (same report as database_postgres.get_query_stats)
+SLOW_QUERY_MS = 200
+SLOW_QUERY_LOG = None  # path of a JSON lines slow log, None = memory only
+_query_stats = query_stats.QueryRecorder(slow_ms=SLOW_QUERY_MS, slow_log=SLOW_QUERY_LOG, skip_modules=('storage',))
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports every statement to the query recorder"""
+
+    def execute(self, sql, parameters=()):
+        return _query_stats.measure(self, sql, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _query_stats.measure(self, sql, super().executemany, sql, seq_of_parameters)
+
+    # with conn.cursor() as cursor: like psycopg2 cursors
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ThreadConnection(sqlite3.Connection):
+    """Connection kept open for its thread: close() only ends the open transaction"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        cursor = self.cursor()
+        return _query_stats.measure(cursor, sql, sqlite3.Cursor.execute, cursor, sql, parameters)
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def close_for_good(self):
+        super().close()
+
+_local = threading.local()
+
 def get_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+    """Get this thread's database connection (opened and tuned on first use)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.path == DATABASE_FILE:
+        if conn.in_transaction:  # left open by a caller that returned early
+            conn.rollback()
+        return conn
+    if conn is not None:
+        conn.close_for_good()
+
+    conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False, factory=ThreadConnection)
     conn.row_factory = sqlite3.Row
-    # Force integer detection for foreign keys
-    conn.execute("PRAGMA foreign_keys = ON")
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    _local.conn = conn
+    _local.path = DATABASE_FILE
     return conn
 
+@contextmanager
+def connection():
+    """This thread's connection for a with-block; uncommitted work is rolled back at the end"""
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def begin_rerun(page=None):
+    """Start collecting the statements of this Streamlit rerun"""
+    _query_stats.begin_rerun(page)
+
+def set_rerun_page(page):
+    _query_stats.set_page(page)
+
+def end_rerun():
+    """Finish this rerun's statistics, returns its summary"""
+    return _query_stats.end_rerun()
+
+def get_query_stats(limit=15):
+    """Top statements, per-page totals, recent reruns and slow log (Admin Debug tab)"""
+    return {
+        **_query_stats.stats(),
+        'top': _query_stats.top_queries(limit),
+        'pages': _query_stats.pages(),
+        'reruns': _query_stats.reruns(limit),
+        'slow_queries': _query_stats.slow_queries(limit),
+    }
+
+def reset_query_stats():
+    _query_stats.reset()
+
+def close_connection():
+    """Close this thread's connection (it is reopened on the next get_connection())"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close_for_good()
+        _local.conn = None
+
+# ============ REFERENCE DATA STORE ============
+
+# Departments, locations, managers, KPI definitions and thresholds as one
+# snapshot per process (reference_data.ReferenceStore, as in
+# database_postgres.py). Writers of this module invalidate it; SQLite has no
+# change notifications, so writes of other processes show up after the ttl.
+REFERENCE_TABLES = {'departments', 'locations', 'operational_managers', 'kpi_definitions', 'kpi_thresholds'}
+
+def _load_reference_data(version):
+    """Load all reference tables in one connection (loader of _reference_store)"""
+    with connection() as conn:
+        return storage.load_reference_data(conn.cursor(), DIALECT, version)
+
+_reference_store = reference_data.ReferenceStore(_load_reference_data, ttl=60)
+_reference_file = None
+
+def get_reference_data():
+    """Current reference data snapshot (read-only, O(1) lookups)"""
+    global _reference_file
+    if _reference_file != DATABASE_FILE:  # pointed at another database file
+        _reference_file = DATABASE_FILE
+        _reference_store.invalidate()
+    return _reference_store.get()
+
+def get_reference_stats():
+    """Reference store statistics (for the Admin Debug tab)"""
+    return _reference_store.stats()
+
+def invalidate_cache(table, mesic=None):
+    """Invalidate cached reads of a table (only the reference data is cached here)"""
+    if table in REFERENCE_TABLES:
+        _reference_store.invalidate()
+
+def clear_cache():
+    """Drop every cached read (🔄 Obnovit data)"""
+    _reference_store.invalidate()
+
+# No pool, read cache or change listener in SQLite (the Admin Debug tab skips them)
+def get_pool_stats():
+    return None
+
+def get_cache_stats():
+    return None
+
+def get_listener_stats():
+    return None
+
+def start_change_listener():
+    return False
+
 def init_database():
     """Initialize database with CORRECTED schema"""
     conn = get_connection()
@@ -200,6 +377,10 @@ def init_database():
         )
     """)
 
+    # === INDEXES (same as PostgreSQL, safe to re-run) ===
+    for statement in storage.INDEX_STATEMENTS:
+        cursor.execute(statement)
+
     conn.commit()
     conn.close()
 
@@ -318,257 +499,94 @@ def insert_default_data():
 
     conn.commit()
     conn.close()
+    clear_cache()
 
 # ============ DEPARTMENTS FUNCTIONS ============
 
 def get_departments():
     """Get all active departments"""
-    conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT id, nazev, vedouci, popis, aktivni
-        FROM departments
-        WHERE aktivni = 1
-        ORDER BY nazev
-    """, conn)
-    conn.close()
-    return df
+    return storage.get_departments(DIALECT)
 
 def add_department(nazev, vedouci=None, popis=None):
     """Add new department"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO departments (nazev, vedouci, popis)
-            VALUES (?, ?, ?)
-        """, (nazev, vedouci, popis))
-        conn.commit()
-        conn.close()
-        return True, f"Oddělení '{nazev}' přidáno"
-    except Exception as e:
-        conn.close()
-        return False, str(e)
+    return storage.add_department(DIALECT, nazev, vedouci, popis)
 
 # ============ LOCATIONS FUNCTIONS ============
 
 def get_locations():
     """Get all active locations with department info"""
-    conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT
-            l.id, l.nazev, l.department_id, d.nazev as department,
-            l.popis, l.aktivni
-        FROM locations l
-        JOIN departments d ON l.department_id = d.id
-        WHERE l.aktivni = 1
-        ORDER BY d.nazev, l.nazev
-    """, conn)
-    conn.close()
-    return df
+    return storage.get_locations(DIALECT)
 
 def get_locations_by_department(department_id):
     """Get all locations in a department"""
-    conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT id, nazev, popis
-        FROM locations
-        WHERE department_id = ? AND aktivni = 1
-        ORDER BY nazev
-    """, conn, params=(department_id,))
-    conn.close()
-    return df
+    return storage.get_locations_by_department(DIALECT, department_id)
 
 def add_location(nazev, department_id, popis=None):
     """Add new location"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO locations (nazev, department_id, popis)
-            VALUES (?, ?, ?)
-        """, (nazev, department_id, popis))
-        conn.commit()
-        conn.close()
-        return True, f"Lokalita '{nazev}' přidána"
-    except Exception as e:
-        conn.close()
-        return False, str(e)
+    return storage.add_location(DIALECT, nazev, department_id, popis)
 
 def update_location_department(location_id, department_id):
     """Update location's department"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            UPDATE locations
-            SET department_id = ?
-            WHERE id = ?
-        """, (department_id, location_id))
-        conn.commit()
-        conn.close()
-        return True, "Lokalita přeřazena"
-    except Exception as e:
-        conn.close()
-        return False, str(e)
+    return storage.update_location_department(DIALECT, location_id, department_id)
 
 # ============ OPERATIONAL MANAGERS FUNCTIONS ============
 
 def get_operational_managers():
     """Get all active operational managers"""
-    conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT
-            om.id, om.jmeno, om.department_id, d.nazev as department,
-            om.email, om.aktivni
-        FROM operational_managers om
-        JOIN departments d ON om.department_id = d.id
-        WHERE om.aktivni = 1
-        ORDER BY d.nazev, om.jmeno
-    """, conn)
-    conn.close()
-    return df
+    return storage.get_operational_managers(DIALECT)
 
 def get_operational_managers_by_department(department_id):
     """Get operational managers for a department"""
-    conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT id, jmeno, email
-        FROM operational_managers
-        WHERE department_id = ? AND aktivni = 1
-        ORDER BY jmeno
-    """, conn, params=(department_id,))
-    conn.close()
-    return df
+    return storage.get_operational_managers_by_department(DIALECT, department_id)
 
 def add_operational_manager(jmeno, department_id, email=None):
     """Add new operational manager"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO operational_managers (jmeno, department_id, email)
-            VALUES (?, ?, ?)
-        """, (jmeno, department_id, email))
-        conn.commit()
-        new_id = cursor.lastrowid
-        conn.close()
-        return True, f"Provozní '{jmeno}' přidán", new_id
-    except Exception as e:
-        conn.close()
-        return False, str(e), None
+    return storage.add_operational_manager(DIALECT, jmeno, department_id, email)
 
 def get_manager_kpis(manager_id):
     """Get all KPIs assigned to a manager"""
-    conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT k.id, k.nazev, k.jednotka, k.popis
-        FROM manager_kpi_assignments a
-        JOIN kpi_definitions k ON a.kpi_id = k.id
-        WHERE a.manager_id = ? AND k.aktivni = 1
-        ORDER BY k.poradi
-    """, conn, params=(manager_id,))
-    conn.close()
-    return df
+    return storage.get_manager_kpis(DIALECT, manager_id)
 
 def set_manager_kpis(manager_id, kpi_ids):
     """Set all KPIs for a manager (replaces existing)"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        # Ensure IDs are integers
-        manager_id = int(manager_id)
-        kpi_ids = [int(k) for k in kpi_ids] if kpi_ids else []
-
-        # Remove all existing assignments
-        cursor.execute("DELETE FROM manager_kpi_assignments WHERE manager_id = ?", (manager_id,))
-
-        # Add new assignments
-        for kpi_id in kpi_ids:
-            cursor.execute("""
-                INSERT INTO manager_kpi_assignments (manager_id, kpi_id)
-                VALUES (?, ?)
-            """, (manager_id, kpi_id))
-
-        conn.commit()
-        conn.close()
-        return True, f"KPI nastavena ({len(kpi_ids)} vybraných)"
-    except Exception as e:
-        conn.close()
-        return False, f"Chyba: {str(e)}"
+    return storage.set_manager_kpis(DIALECT, manager_id, kpi_ids)
 
 # ============ KPI DEFINITIONS & THRESHOLDS ============
 
 def get_kpi_definitions():
     """Get all active KPI definitions"""
-    conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT id, nazev, popis, jednotka, typ_vypoctu, poradi
-        FROM kpi_definitions
-        WHERE aktivni = 1
-        ORDER BY poradi
-    """, conn)
-    conn.close()
-    return df
+    return storage.get_kpi_definitions(DIALECT)
 
 def get_kpi_thresholds(kpi_id=None):
     """Get KPI thresholds"""
-    conn = get_connection()
-    if kpi_id:
-        df = pd.read_sql_query("""
-            SELECT t.*, k.nazev as kpi_nazev, k.jednotka
-            FROM kpi_thresholds t
-            JOIN kpi_definitions k ON t.kpi_id = k.id
-            WHERE t.kpi_id = ?
-            ORDER BY t.poradi
-        """, conn, params=(kpi_id,))
-    else:
-        df = pd.read_sql_query("""
-            SELECT t.*, k.nazev as kpi_nazev, k.jednotka
-            FROM kpi_thresholds t
-            JOIN kpi_definitions k ON t.kpi_id = k.id
-            ORDER BY k.poradi, t.poradi
-        """, conn)
-    conn.close()
-    return df
+    return storage.get_kpi_thresholds(DIALECT, kpi_id)
 
-def calculate_bonus_for_value(kpi_id, hodnota):
-    """Calculate bonus percentage for a KPI value based on thresholds"""
-    if pd.isna(hodnota):
-        return 0
+def load_kpi_thresholds(cursor, kpi_ids=None):
+    """Load KPI threshold rules in one query (input for bonus_engine)"""
+    return storage.load_kpi_thresholds(cursor, DIALECT, kpi_ids)
 
-    conn = get_connection()
-    cursor = conn.cursor()
+def calculate_bonus_for_value(kpi_id, hodnota, cursor=None):
+    """Calculate bonus percentage for a KPI value based on thresholds
 
-    cursor.execute("""
-        SELECT min_hodnota, max_hodnota, operator, bonus_procento
-        FROM kpi_thresholds
-        WHERE kpi_id = ?
-        ORDER BY poradi
-    """, (kpi_id,))
+    Args:
+        kpi_id: KPI identifier
+        hodnota: KPI value to evaluate
+        cursor: Optional database cursor (a new connection is opened without it)
+    """
+    if pd.isna(hodnota):
+        return 0
 
-    thresholds = cursor.fetchall()
-    conn.close()
+    if cursor is None:
+        conn = get_connection()
+        try:
+            return calculate_bonus_for_value(kpi_id, hodnota, conn.cursor())
+        finally:
+            conn.close()
 
-    for threshold in thresholds:
-        min_val, max_val, operator, bonus = threshold
-
-        if operator == "≥" and min_val is not None:
-            if hodnota >= min_val:
-                return bonus
-        elif operator == "≤" and max_val is not None:
-            if hodnota <= max_val:
-                return bonus
-        elif operator == "<" and max_val is not None:
-            if hodnota < max_val:
-                return bonus
-        elif operator == ">" and min_val is not None:
-            if hodnota > min_val:
-                return bonus
-        elif operator == "mezi" and min_val is not None and max_val is not None:
-            if min_val <= hodnota <= max_val:
-                return bonus
-
-    return 0
+    rules = bonus_engine.compile_thresholds(load_kpi_thresholds(cursor, [kpi_id])).get(int(kpi_id))
+    if rules is None:
+        return 0
+    return rules.lookup(hodnota)
 
 # ============ MONTHLY KPI DATA FUNCTIONS ============
 
@@ -598,18 +616,7 @@ def add_monthly_kpi_data(mesic, location_id, kpi_id, hodnota, poznamka=None, zdr
             conn.close()
             return False, f"KPI ID {kpi_id} neexistuje nebo není aktivní"
 
-        cursor.execute("""
-            INSERT INTO monthly_kpi_data
-            (mesic, location_id, kpi_id, hodnota, poznamka, zdroj, status, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, 'ACTIVE', CURRENT_TIMESTAMP)
-            ON CONFLICT(mesic, location_id, kpi_id)
-            DO UPDATE SET
-                hodnota = ?,
-                poznamka = ?,
-                updated_at = CURRENT_TIMESTAMP,
-                zdroj = ?
-        """, (mesic, location_id, kpi_id, float(hodnota), poznamka, zdroj,
-              float(hodnota), poznamka, zdroj))
+        storage.upsert_kpi_values(cursor, DIALECT, [(mesic, location_id, kpi_id, float(hodnota), poznamka, zdroj)])
         conn.commit()
         conn.close()
         return True, "Data uložena"
@@ -617,70 +624,75 @@ def add_monthly_kpi_data(mesic, location_id, kpi_id, hodnota, poznamka=None, zdr
         conn.close()
         return False, f"Chyba: {str(e)}"
 
-def get_monthly_kpi_data(mesic=None, location_id=None, kpi_id=None):
-    """Get monthly KPI data with filters"""
-    conn = get_connection()
+def add_monthly_kpi_data_bulk(mesic, location_id, values, poznamka=None, zdroj="MANUAL"):
+    """Add or update several KPI values of one location/month in one transaction
 
-    query = """
-        SELECT
-            d.id, d.mesic, d.location_id, l.nazev as location,
-            d.kpi_id, k.nazev as kpi_nazev, k.jednotka,
-            d.hodnota, d.status, d.poznamka, d.zdroj,
-            d.created_at, d.updated_at
-        FROM monthly_kpi_data d
-        JOIN locations l ON d.location_id = l.id
-        JOIN kpi_definitions k ON d.kpi_id = k.id
-        WHERE d.status = 'ACTIVE'
+    Validates the location and all KPIs once, upserts every value in one batch
+    and evaluates bonuses for exactly those rows before committing.
+
+    Args:
+        mesic: Month (YYYY-MM)
+        location_id: Location ID
+        values: {kpi_id: hodnota}
+
+    Returns:
+        (success, message, number of evaluated records)
     """
+    values = {int(kpi_id): float(hodnota) for kpi_id, hodnota in values.items()}
+    if not values:
+        return True, "Data uložena", 0
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        location_id = int(location_id)
 
-    params = []
-    if mesic:
-        query += " AND d.mesic = ?"
-        params.append(mesic)
-    if location_id:
-        query += " AND d.location_id = ?"
-        params.append(location_id)
-    if kpi_id:
-        query += " AND d.kpi_id = ?"
-        params.append(kpi_id)
+        # Verify location and KPIs exist
+        if storage.inactive_ids(cursor, DIALECT, 'locations', [location_id]):
+            return False, f"Lokalita ID {location_id} neexistuje nebo není aktivní", 0
 
-    query += " ORDER BY d.mesic DESC, l.nazev, k.poradi"
+        inactive = storage.inactive_ids(cursor, DIALECT, 'kpi_definitions', values.keys())
+        if inactive:
+            return False, ", ".join(f"KPI ID {kpi_id} neexistuje nebo není aktivní" for kpi_id in inactive), 0
 
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    return df
+        storage.upsert_kpi_values(cursor, DIALECT, [(mesic, location_id, kpi_id, hodnota, poznamka, zdroj)
+                                                    for kpi_id, hodnota in values.items()])
+        data = pd.DataFrame(
+            [(location_id, kpi_id, hodnota) for kpi_id, hodnota in values.items()],
+            columns=['location_id', 'kpi_id', 'hodnota'],
+        )
+        rules = bonus_engine.compile_thresholds(load_kpi_thresholds(cursor, values.keys()))
+        evaluated = storage.upsert_evaluation(cursor, DIALECT, mesic, data, rules)
+        conn.commit()
+        return True, "Data uložena", len(evaluated)
+    except Exception as e:
+        return False, f"Chyba: {str(e)}", 0
+    finally:
+        conn.close()
+
+def get_monthly_kpi_data(mesic=None, location_id=None, kpi_id=None):
+    """Get monthly KPI data with filters"""
+    conn = get_connection()
+    try:
+        return storage.fetch_monthly_kpi_data(conn.cursor(), DIALECT, mesic, location_id, kpi_id)
+    finally:
+        conn.close()
 
 def get_monthly_kpi_by_location_month(mesic, location_id):
     """Get all KPI data for a location in a month"""
     conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT
-            d.kpi_id, k.nazev, k.jednotka, k.poradi,
-            d.hodnota, d.poznamka
-        FROM monthly_kpi_data d
-        JOIN kpi_definitions k ON d.kpi_id = k.id
-        WHERE d.mesic = ? AND d.location_id = ? AND d.status = 'ACTIVE'
-        ORDER BY k.poradi
-    """, conn, params=(mesic, location_id))
-    conn.close()
-    return df
+    try:
+        return storage.fetch_kpi_by_location_month(conn.cursor(), DIALECT, mesic, location_id)
+    finally:
+        conn.close()
 
 def delete_monthly_kpi_data(mesic, location_id):
     """Delete all KPI data for a location in a month"""
     conn = get_connection()
     cursor = conn.cursor()
     try:
-        # Delete from monthly_kpi_data
-        cursor.execute("""
-            DELETE FROM monthly_kpi_data
-            WHERE mesic = ? AND location_id = ?
-        """, (mesic, location_id))
-
-        # Also delete evaluation data
-        cursor.execute("""
-            DELETE FROM monthly_kpi_evaluation
-            WHERE mesic = ? AND location_id = ?
-        """, (mesic, location_id))
+        # KPI data and their evaluation
+        storage.delete_kpi_values(cursor, DIALECT, mesic, location_id)
 
         conn.commit()
         conn.close()
@@ -692,98 +704,64 @@ def delete_monthly_kpi_data(mesic, location_id):
 # ============ MONTHLY EVALUATION & BONUS CALCULATION ============
 
 def calculate_monthly_kpi_evaluation(mesic, location_id=None):
-    """Calculate KPI evaluation and bonuses for a month"""
+    """Calculate KPI evaluation and bonuses for a month
+
+    The whole month is evaluated vectorized with the compiled threshold rules
+    and written back in one batch. Returns the number of evaluated records.
+    """
     conn = get_connection()
     cursor = conn.cursor()
-
-    if location_id:
-        cursor.execute("""
-            SELECT d.location_id, d.kpi_id, d.hodnota
-            FROM monthly_kpi_data d
-            WHERE d.mesic = ? AND d.location_id = ? AND d.status = 'ACTIVE'
-        """, (mesic, location_id))
-    else:
-        cursor.execute("""
-            SELECT d.location_id, d.kpi_id, d.hodnota
-            FROM monthly_kpi_data d
-            WHERE d.mesic = ? AND d.status = 'ACTIVE'
-        """, (mesic,))
-
-    evaluations = cursor.fetchall()
-
-    for row in evaluations:
-        loc_id, kpi_id, value = row
-        bonus = calculate_bonus_for_value(kpi_id, value)
-        splneno = 1 if bonus > 0 else 0
-
-        cursor.execute("""
-            INSERT INTO monthly_kpi_evaluation
-            (mesic, location_id, kpi_id, hodnota, splneno, bonus_procento, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(mesic, location_id, kpi_id)
-            DO UPDATE SET
-                hodnota = ?,
-                splneno = ?,
-                bonus_procento = ?,
-                updated_at = CURRENT_TIMESTAMP
-        """, (mesic, loc_id, kpi_id, value, splneno, bonus,
-              value, splneno, bonus))
-
-    conn.commit()
-    conn.close()
+    try:
+        rules = bonus_engine.compile_thresholds(load_kpi_thresholds(cursor))
+        evaluated = storage.evaluate_month(cursor, DIALECT, mesic, rules,
+                                           [location_id] if location_id else None)
+        conn.commit()
+        return len(evaluated)
+    finally:
+        conn.close()
 
 def get_monthly_kpi_evaluation(mesic, location_id=None):
     """Get KPI evaluation for a month"""
     conn = get_connection()
+    try:
+        return storage.fetch_kpi_evaluation(conn.cursor(), DIALECT, mesic, location_id)
+    finally:
+        conn.close()
 
-    query = """
-        SELECT
-            e.mesic, e.location_id, l.nazev as location,
-            e.kpi_id, k.nazev as kpi_nazev, k.jednotka,
-            e.hodnota, e.splneno, e.bonus_procento
-        FROM monthly_kpi_evaluation e
-        LEFT JOIN locations l ON e.location_id = l.id
-        LEFT JOIN kpi_definitions k ON e.kpi_id = k.id
-        WHERE e.mesic = ?
-    """
+def get_kpi_evaluation_range(start_mesic, end_mesic, location_ids=None, kpi_ids=None, pivot=False):
+    """Get KPI evaluation for all months from start_mesic to end_mesic (inclusive) in one query
 
-    params = [mesic]
-    if location_id:
-        query += " AND e.location_id = ?"
-        params.append(location_id)
+    pivot=True returns one row per month with (value, location_id, kpi_id)
+    MultiIndex columns, as in database_postgres.get_kpi_evaluation_range.
+    """
+    location_ids = [int(storage.safe_convert_id(i)) for i in location_ids] if location_ids is not None else None
+    kpi_ids = [int(storage.safe_convert_id(i)) for i in kpi_ids] if kpi_ids is not None else None
+    conn = get_connection()
+    try:
+        df = storage.fetch_kpi_evaluation_range(conn.cursor(), DIALECT, start_mesic, end_mesic, location_ids, kpi_ids)
+    finally:
+        conn.close()
+    return storage.pivot_kpi_evaluation_range(df) if pivot else df
 
-    query += " ORDER BY l.nazev, k.poradi"
+def get_manager_kpi_summary(mesic):
+    """Bonus/KPI totals per active manager for a month (📊 Přehled cards, 👥 Porovnání)"""
+    conn = get_connection()
+    try:
+        return storage.fetch_manager_kpi_summary(conn.cursor(), DIALECT, mesic)
+    finally:
+        conn.close()
 
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    return df
+def get_manager_kpi_details(mesic):
+    """Evaluated KPIs per manager and location for a month (📈 Detail, KPI tables)"""
+    conn = get_connection()
+    try:
+        return storage.fetch_manager_kpi_details(conn.cursor(), DIALECT, mesic)
+    finally:
+        conn.close()
 
 def get_department_monthly_summary(mesic=None, department_id=None):
     """Get department monthly KPI summary"""
-    conn = get_connection()
-
-    query = """
-        SELECT
-            s.mesic, s.department_id, d.nazev as department,
-            s.celkovy_bonus, s.aktivnich_kpi, s.splnenych_kpi
-        FROM department_monthly_summary s
-        JOIN departments d ON s.department_id = d.id
-        WHERE 1=1
-    """
-
-    params = []
-    if mesic:
-        query += " AND s.mesic = ?"
-        params.append(mesic)
-    if department_id:
-        query += " AND s.department_id = ?"
-        params.append(department_id)
-
-    query += " ORDER BY s.mesic DESC, d.nazev"
-
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    return df
+    return storage.get_department_monthly_summary(DIALECT, mesic, department_id)
 
 def calculate_monthly_department_kpi_evaluation(mesic, department_id=None):
     """Calculate KPI evaluation and bonuses for departments with own KPI"""
@@ -807,7 +785,7 @@ def calculate_monthly_department_kpi_evaluation(mesic, department_id=None):
 
     for row in evaluations:
         dept_id, kpi_id, value = row
-        bonus = calculate_bonus_for_value(kpi_id, value)
+        bonus = calculate_bonus_for_value(kpi_id, value, cursor)
         splneno = 1 if bonus > 0 else 0
 
         # Store evaluation in department_monthly_summary or create separate table if needed
@@ -817,86 +795,88 @@ def calculate_monthly_department_kpi_evaluation(mesic, department_id=None):
     conn.close()
 
 def calculate_department_summary(mesic):
-    """Calculate department monthly summary - handles both own KPI and location averages"""
+    """Calculate department monthly summary - handles both own KPI and location averages
+
+    Shared with PostgreSQL (storage.summarize_departments); returns the number
+    of upserted summary rows.
+    """
     conn = get_connection()
     cursor = conn.cursor()
+    summary = storage.summarize_departments(cursor, DIALECT, [mesic])
+    conn.commit()
+    conn.close()
+    return len(summary)
 
-    cursor.execute("SELECT id, ma_vlastni_kpi FROM departments WHERE aktivni = 1")
-    departments = cursor.fetchall()
+# ============ RECALCULATION ============
 
-    for dept_row in departments:
-        dept_id, ma_vlastni_kpi = dept_row
+# No background worker in SQLite: enqueue_recalculation() recalculates the
+# months right away and keeps each month's last run in the columns of the
+# PostgreSQL recalc_jobs table for the status displays.
+RECALC_JOB_COLUMNS = ['id', 'mesic', 'status', 'scope', 'requests', 'attempts', 'processed', 'message',
+                      'requested_at', 'started_at', 'finished_at', 'duration_s']
 
-        if ma_vlastni_kpi:
-            # Department has own KPI - calculate from monthly_department_kpi_data
-            cursor.execute("""
-                SELECT d.kpi_id, d.hodnota
-                FROM monthly_department_kpi_data d
-                WHERE d.mesic = ? AND d.department_id = ? AND d.status = 'ACTIVE'
-            """, (mesic, dept_id))
-
-            kpi_data = cursor.fetchall()
-            total_bonus = 0
-            total_active = len(kpi_data)
-            total_met = 0
-
-            for kpi_id, hodnota in kpi_data:
-                bonus = calculate_bonus_for_value(kpi_id, hodnota)
-                total_bonus += bonus
-                if bonus > 0:
-                    total_met += 1
+_recalc_jobs = {}
+_recalc_ids = itertools.count(1)
+_recalc_stats = {'running': False, 'done': 0, 'errors': 0, 'last_error': None}
+_recalc_lock = threading.Lock()
 
-        else:
-            # Department uses average from locations
-            cursor.execute("""
-                SELECT id FROM locations
-                WHERE department_id = ? AND aktivni = 1
-            """, (dept_id,))
-            locations = cursor.fetchall()
-
-            total_bonus = 0
-            total_active = 0
-            total_met = 0
-
-            for loc_row in locations:
-                loc_id = loc_row[0]
-
-                cursor.execute("""
-                    SELECT
-                        SUM(bonus_procento) as total_bonus,
-                        COUNT(*) as kpi_count,
-                        SUM(splneno) as met_count
-                    FROM monthly_kpi_evaluation
-                    WHERE mesic = ? AND location_id = ?
-                """, (mesic, loc_id))
-
-                result = cursor.fetchone()
-                if result and result[0]:
-                    total_bonus += result[0]
-                    total_active += result[1] or 0
-                    total_met += result[2] or 0
-
-            if locations:
-                # Average across locations
-                avg_bonus = total_bonus / len(list(locations)) if locations else 0
-                total_bonus = avg_bonus
-
-        # Save summary
-        if total_active > 0 or not ma_vlastni_kpi:
-            cursor.execute("""
-                INSERT INTO department_monthly_summary
-                (mesic, department_id, celkovy_bonus, aktivnich_kpi, splnenych_kpi)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(mesic, department_id)
-                DO UPDATE SET
-                    celkovy_bonus = ?,
-                    aktivnich_kpi = ?,
-                    splnenych_kpi = ?
-            """, (mesic, dept_id, total_bonus, total_active, total_met,
-                  total_bonus, total_active, total_met))
+def _recalculate_month(mesic):
+    """Evaluate a month and summarize its departments; returns the number of evaluated records"""
+    processed = calculate_monthly_kpi_evaluation(mesic)
+    calculate_department_summary(mesic)
+    return processed
 
-    conn.commit()
-    conn.close()
+def enqueue_recalculation(months, cursor=None, scope='FULL'):
+    """Recalculate the given months now; returns their job ids
+
+    cursor and scope are accepted as in database_postgres - there is no queue
+    table to write to and no dirty marks, every month is recalculated in full.
+    """
+    job_ids = []
+    for mesic in sorted({str(m) for m in months if m}):
+        started = datetime.now()
+        try:
+            processed, status, message = _recalculate_month(mesic), 'DONE', None
+        except Exception as e:
+            processed, status, message = None, 'FAILED', str(e)
+        finished = datetime.now()
+
+        with _recalc_lock:
+            job = {'id': next(_recalc_ids), 'mesic': mesic, 'status': status, 'scope': 'FULL', 'requests': 1,
+                   'attempts': 1, 'processed': processed, 'message': message, 'requested_at': started,
+                   'started_at': started, 'finished_at': finished,
+                   'duration_s': (finished - started).total_seconds()}
+            _recalc_jobs[mesic] = job
+            _recalc_stats['done' if status == 'DONE' else 'errors'] += 1
+            if message:
+                _recalc_stats['last_error'] = message
+        job_ids.append(job['id'])
+    return job_ids
+
+def get_recalc_status(months):
+    """Latest job of each given month (months that were never recalculated are left out)"""
+    with _recalc_lock:
+        jobs = [_recalc_jobs[mesic] for mesic in sorted(set(months)) if mesic in _recalc_jobs]
+    return pd.DataFrame(jobs, columns=RECALC_JOB_COLUMNS)
+
+def get_recalc_queue_stats():
+    """Job counts by status plus "worker" statistics (for the Admin Debug tab)"""
+    with _recalc_lock:
+        statuses = [job['status'] for job in _recalc_jobs.values()]
+        worker = dict(_recalc_stats)
+    stats = {status: statuses.count(status) for status in ['PENDING', 'RUNNING', 'DONE', 'FAILED']}
+    stats['worker'] = worker
+    return stats
+
+def get_recalc_concurrency():
+    return 1
+
+def start_recalc_worker():
+    return False
+
+def get_dirty_months():
+    """Months waiting for a recalculation - always none, writes evaluate right away"""
+    return pd.DataFrame(columns=['mesic', 'locations', 'marked_at'])
 
 # ============ IMPORT/EXPORT FUNCTIONS ============
 
@@ -922,434 +902,210 @@ def generate_import_template_excel():
     output.seek(0)
     return output.getvalue()
 
-def import_monthly_data_csv(csv_content):
-    """Import monthly KPI data from CSV"""
-    try:
-        df = pd.read_csv(io.StringIO(csv_content))
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        imported = 0
-        errors = []
-
-        for idx, row in df.iterrows():
-            try:
-                mesic = str(row.get("Měsíc (YYYY-MM)", "")).strip()
-                location_name = str(row.get("Lokalita", "")).strip()
-                kpi_name = str(row.get("KPI", "")).strip()
-                value = float(row.get("Hodnota", 0))
-                poznamka = str(row.get("Poznámka", ""))
-
-                # Get IDs
-                cursor.execute("SELECT id FROM locations WHERE nazev = ?", (location_name,))
-                loc_result = cursor.fetchone()
-                if not loc_result:
-                    errors.append(f"Řada {idx+2}: Lokalita '{location_name}' nebyla nalezena")
-                    continue
-
-                location_id = loc_result[0]
-
-                cursor.execute("SELECT id FROM kpi_definitions WHERE nazev = ?", (kpi_name,))
-                kpi_result = cursor.fetchone()
-                if not kpi_result:
-                    errors.append(f"Řada {idx+2}: KPI '{kpi_name}' nebyla nalezena")
-                    continue
-
-                kpi_id = kpi_result[0]
-
-                # Insert data
-                cursor.execute("""
-                    INSERT INTO monthly_kpi_data
-                    (mesic, location_id, kpi_id, hodnota, poznamka, zdroj)
-                    VALUES (?, ?, ?, ?, ?, 'IMPORT')
-                    ON CONFLICT(mesic, location_id, kpi_id)
-                    DO UPDATE SET
-                        hodnota = ?,
-                        poznamka = ?,
-                        updated_at = CURRENT_TIMESTAMP,
-                        zdroj = 'IMPORT'
-                """, (mesic, location_id, kpi_id, value, poznamka if poznamka else None, value, poznamka if poznamka else None))
-
-                imported += 1
-
-            except Exception as e:
-                errors.append(f"Řada {idx+2}: {str(e)}")
+IMPORT_CHUNK_SIZE = 5000
 
-        conn.commit()
+def import_monthly_data_chunks(chunks, progress=None):
+    """Import an iterable of (DataFrame, fraction) chunks, each committed as its own batch
+
+    Rows are validated vectorized (import_engine) and written with one
+    executemany upsert per chunk; the imported months are recalculated at the
+    end. Returns (imported, errors).
+
+    Args:
+        chunks: iterable of (chunk DataFrame, fraction of the file read or None)
+        progress: optional callback(rows_done, fraction)
+    """
+    imported = 0
+    errors = []
+    months = set()
+    rows_done = 0
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        location_ids, kpi_ids = storage.fetch_import_lookups(cursor, DIALECT)
+        for chunk, fraction in chunks:
+            rows, chunk_errors = import_engine.prepare_import(chunk, location_ids, kpi_ids)
+            if not rows.empty:
+                storage.upsert_kpi_values(cursor, DIALECT, [
+                    (r.mesic, int(r.location_id), int(r.kpi_id), float(r.hodnota), r.poznamka, 'IMPORT')
+                    for r in import_engine.deduplicate(rows).itertuples(index=False)
+                ])
+                conn.commit()
+                months.update(rows['mesic'].unique())
+            rows_done += len(chunk)
+            imported += len(rows)
+            errors.extend(chunk_errors)
+            if progress:
+                progress(rows_done, fraction)
+    except Exception as e:
+        errors.append(f"Chyba při importu po řadě {rows_done + 1}: {str(e)}")
+    finally:
         conn.close()
 
-        return imported, errors
+    enqueue_recalculation(months)
+    return imported, errors
+
+def import_monthly_data_csv(csv_content, chunksize=None, progress=None):
+    """Import monthly KPI data from CSV
 
+    Args:
+        csv_content: CSV text or a file-like upload
+        chunksize: read the file in chunks of this many rows (one transaction each)
+        progress: optional callback(rows_done, fraction)
+    """
+    try:
+        if chunksize:
+            chunks = import_engine.csv_chunks(csv_content, chunksize)
+        else:
+            if isinstance(csv_content, str):
+                csv_content = io.StringIO(csv_content)
+            chunks = [(pd.read_csv(csv_content), None)]
     except Exception as e:
         return 0, [f"Chyba při čtení CSV: {str(e)}"]
+    return import_monthly_data_chunks(chunks, progress)
 
-def import_monthly_data_excel(excel_file):
-    """Import monthly KPI data from Excel"""
+def import_monthly_data_excel(excel_file, chunksize=None, progress=None):
+    """Import monthly KPI data from Excel
+
+    Args:
+        excel_file: file-like upload
+        chunksize: read the first sheet in chunks of this many rows (.xlsx only)
+        progress: optional callback(rows_done, fraction)
+    """
     try:
-        df = pd.read_excel(excel_file)
-        # Převedi na CSV string a použi existující funkcí
-        csv_content = df.to_csv(index=False)
-        return import_monthly_data_csv(csv_content)
+        if chunksize:
+            chunks = import_engine.excel_chunks(excel_file, chunksize)
+        else:
+            chunks = [(pd.read_excel(excel_file), None)]
     except Exception as e:
         return 0, [f"Chyba při čtení Excel: {str(e)}"]
+    return import_monthly_data_chunks(chunks, progress)
 
 def get_all_months_with_data():
-    """Get all months that have KPI data"""
+    """Get all months that have KPI data (newest first)"""
     conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT DISTINCT mesic
-        FROM monthly_kpi_data
-        WHERE status = 'ACTIVE'
-        ORDER BY mesic DESC
-    """, conn)
-    conn.close()
+    try:
+        return storage.fetch_months(conn.cursor(), DIALECT)
+    finally:
+        conn.close()
 
-    if df.empty:
-        return []
-    return sorted(df['mesic'].unique().tolist(), reverse=True)
+def refresh_month_catalog(cursor, months=None):
+    """No month catalog in SQLite (get_all_months_with_data reads the data) - never changes"""
+    return False
 
-# ============ DELETE FUNCTIONS ============
+# ============ QUERY PLAN CHECK ============
 
-def delete_department(department_id):
-    """Soft delete department (set aktivni=0)"""
+def explain_hot_queries():
+    """EXPLAIN QUERY PLAN the hot read queries and report whether they use an index
+
+    Same report as database_postgres.explain_hot_queries; SQLite has no
+    switch to disable full scans, so 's indexem' repeats the plan.
+    """
     conn = get_connection()
     cursor = conn.cursor()
     try:
-        # Check if department has locations or managers
-        cursor.execute("SELECT COUNT(*) FROM locations WHERE department_id = ? AND aktivni = 1", (department_id,))
-        loc_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM operational_managers WHERE department_id = ? AND aktivni = 1", (department_id,))
-        mgr_count = cursor.fetchone()[0]
+        cursor.execute("SELECT mesic, location_id, kpi_id FROM monthly_kpi_data WHERE status = 'ACTIVE' ORDER BY mesic DESC LIMIT 1")
+        sample = cursor.fetchone() or {'mesic': datetime.now().strftime('%Y-%m'), 'location_id': 1, 'kpi_id': 1}
+        cursor.execute("SELECT id FROM departments WHERE aktivni = TRUE ORDER BY id LIMIT 1")
+        department = cursor.fetchone()
+        department_id = department['id'] if department else 1
+
+        queries = [
+            ("get_monthly_kpi_data (měsíc)", *storage.monthly_kpi_data_query(sample['mesic'])),
+            ("get_monthly_kpi_data (lokalita)", *storage.monthly_kpi_data_query(location_id=sample['location_id'])),
+            ("get_monthly_kpi_data (KPI)", *storage.monthly_kpi_data_query(kpi_id=sample['kpi_id'])),
+            ("get_all_months_with_data", storage.ALL_MONTHS_SQL, []),
+            ("get_department_kpi_value (vlastní)", storage.DEPARTMENT_OWN_KPI_VALUE_SQL, [sample['mesic'], department_id, sample['kpi_id']]),
+            ("get_department_kpi_value (průměr)", storage.DEPARTMENT_AVG_KPI_VALUE_SQL, [sample['mesic'], department_id, sample['kpi_id']]),
+            ("get_manager_kpi_summary", storage.MANAGER_KPI_SUMMARY_SQL, [sample['mesic']]),
+            ("get_manager_kpi_details", storage.MANAGER_KPI_DETAIL_SQL, [sample['mesic']]),
+        ]
+
+        report = []
+        for name, query, params in queries:
+            DIALECT.execute(cursor, "EXPLAIN QUERY PLAN " + query, params)
+            steps = [row['detail'] for row in cursor.fetchall()]
+            scans = [step for step in steps if step.startswith(('SCAN', 'SEARCH'))]
+            indexes = sorted({index for step in scans for index in re.findall(r"USING (?:COVERING )?INDEX (\w+)", step)})
+            plan = ", ".join(scans)
+            report.append({'dotaz': name, 'plán': plan, 's indexem': plan, 'indexy': ", ".join(indexes),
+                           'index_scan': any(' USING ' in step for step in scans)})
+    finally:
+        conn.close()
 
-        if loc_count > 0 or mgr_count > 0:
-            conn.close()
-            return False, f"Nelze smazat oddělení s aktivními lokalitami ({loc_count}) nebo provozními ({mgr_count})"
+    return pd.DataFrame(report, columns=['dotaz', 'plán', 's indexem', 'indexy', 'index_scan'])
 
-        cursor.execute("UPDATE departments SET aktivni = 0 WHERE id = ?", (department_id,))
-        conn.commit()
-        conn.close()
-        return True, "Oddělení smazáno"
-    except Exception as e:
-        conn.close()
-        return False, str(e)
+# ============ DELETE FUNCTIONS ============
+
+def delete_department(department_id):
+    """Soft delete department (set aktivni=0)"""
+    return storage.delete_department(DIALECT, department_id)
 
 def delete_location(location_id):
     """Soft delete location (set aktivni=0)"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE locations SET aktivni = 0 WHERE id = ?", (location_id,))
-        conn.commit()
-        conn.close()
-        return True, "Lokalita smazána"
-    except Exception as e:
-        conn.close()
-        return False, str(e)
+    return storage.delete_location(DIALECT, location_id)
 
 def delete_operational_manager(manager_id):
     """Soft delete operational manager (set aktivni=0)"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE operational_managers SET aktivni = 0 WHERE id = ?", (manager_id,))
-        conn.commit()
-        conn.close()
-        return True, "Provozní smazán"
-    except Exception as e:
-        conn.close()
-        return False, str(e)
+    return storage.delete_operational_manager(DIALECT, manager_id)
 
 # ============ KPI DEFINITIONS CRUD ============
 
 def add_kpi_definition(nazev, popis=None, jednotka=None, typ_vypoctu=None, poradi=None):
     """Add new KPI definition"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        if poradi is None:
-            cursor.execute("SELECT MAX(poradi) FROM kpi_definitions")
-            max_poradi = cursor.fetchone()[0]
-            poradi = (max_poradi or 0) + 1
-
-        cursor.execute("""
-            INSERT INTO kpi_definitions (nazev, popis, jednotka, typ_vypoctu, poradi)
-            VALUES (?, ?, ?, ?, ?)
-        """, (nazev, popis, jednotka, typ_vypoctu, poradi))
-        conn.commit()
-        new_id = cursor.lastrowid
-        conn.close()
-        return True, f"KPI '{nazev}' přidáno", new_id
-    except Exception as e:
-        conn.close()
-        return False, str(e), None
+    return storage.add_kpi_definition(DIALECT, nazev, popis, jednotka, typ_vypoctu, poradi)
 
 def update_kpi_definition(kpi_id, nazev=None, popis=None, jednotka=None, typ_vypoctu=None, poradi=None):
     """Update KPI definition"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        updates = []
-        params = []
-
-        if nazev is not None:
-            updates.append("nazev = ?")
-            params.append(nazev)
-        if popis is not None:
-            updates.append("popis = ?")
-            params.append(popis)
-        if jednotka is not None:
-            updates.append("jednotka = ?")
-            params.append(jednotka)
-        if typ_vypoctu is not None:
-            updates.append("typ_vypoctu = ?")
-            params.append(typ_vypoctu)
-        if poradi is not None:
-            updates.append("poradi = ?")
-            params.append(poradi)
-
-        if not updates:
-            conn.close()
-            return False, "Žádné změny"
-
-        params.append(kpi_id)
-        query = f"UPDATE kpi_definitions SET {', '.join(updates)} WHERE id = ?"
-        cursor.execute(query, params)
-        conn.commit()
-        conn.close()
-        return True, "KPI upraveno"
-    except Exception as e:
-        conn.close()
-        return False, str(e)
+    return storage.update_kpi_definition(DIALECT, kpi_id, nazev, popis, jednotka, typ_vypoctu, poradi)
 
 def delete_kpi_definition(kpi_id):
     """Soft delete KPI definition (set aktivni=0)"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE kpi_definitions SET aktivni = 0 WHERE id = ?", (kpi_id,))
-        conn.commit()
-        conn.close()
-        return True, "KPI smazáno"
-    except Exception as e:
-        conn.close()
-        return False, str(e)
+    return storage.delete_kpi_definition(DIALECT, kpi_id)
 
 def get_all_kpi_definitions(include_inactive=False):
     """Get all KPI definitions (including inactive if specified)"""
-    conn = get_connection()
-    if include_inactive:
-        query = "SELECT * FROM kpi_definitions ORDER BY poradi, nazev"
-    else:
-        query = "SELECT * FROM kpi_definitions WHERE aktivni = 1 ORDER BY poradi, nazev"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+    return storage.get_all_kpi_definitions(DIALECT, include_inactive)
 
 # ============ KPI THRESHOLDS CRUD ============
 
 def add_kpi_threshold(kpi_id, operator, bonus_procento, min_hodnota=None, max_hodnota=None, popis=None, poradi=None):
     """Add new KPI threshold"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        # Ensure kpi_id is integer, not bytes
-        if isinstance(kpi_id, bytes):
-            kpi_id = int.from_bytes(kpi_id, byteorder='little')
-        kpi_id = int(kpi_id)
-
-        # Verify KPI exists
-        cursor.execute("SELECT id FROM kpi_definitions WHERE id = ? AND aktivni = 1", (kpi_id,))
-        if not cursor.fetchone():
-            conn.close()
-            return False, f"KPI ID {kpi_id} neexistuje nebo není aktivní", None
-
-        if poradi is None:
-            cursor.execute("SELECT MAX(poradi) FROM kpi_thresholds WHERE kpi_id = ?", (kpi_id,))
-            max_poradi = cursor.fetchone()[0]
-            poradi = (max_poradi or 0) + 1
-
-        cursor.execute("""
-            INSERT INTO kpi_thresholds (kpi_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (kpi_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi))
-        conn.commit()
-        new_id = cursor.lastrowid
-        conn.close()
-        return True, "Hranice přidána", new_id
-    except Exception as e:
-        conn.close()
-        return False, f"Chyba: {str(e)}", None
+    return storage.add_kpi_threshold(DIALECT, kpi_id, operator, bonus_procento, min_hodnota, max_hodnota, popis, poradi)
 
 def update_kpi_threshold(threshold_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi):
     """Update KPI threshold - updates all fields"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            UPDATE kpi_thresholds
-            SET min_hodnota = ?,
-                max_hodnota = ?,
-                operator = ?,
-                bonus_procento = ?,
-                popis = ?,
-                poradi = ?
-            WHERE id = ?
-        """, (min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi, threshold_id))
-
-        if cursor.rowcount == 0:
-            conn.close()
-            return False, "Hranice nenalezena"
-
-        conn.commit()
-        conn.close()
-        return True, "Hranice upravena"
-    except Exception as e:
-        conn.close()
-        return False, f"Chyba: {str(e)}"
+    return storage.update_kpi_threshold(DIALECT, threshold_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi)
 
 def delete_kpi_threshold(threshold_id):
     """Delete KPI threshold"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("DELETE FROM kpi_thresholds WHERE id = ?", (threshold_id,))
-
-        if cursor.rowcount == 0:
-            conn.close()
-            return False, "Hranice nenalezena"
-
-        conn.commit()
-        conn.close()
-        return True, "Hranice smazána"
-    except Exception as e:
-        conn.close()
-        return False, f"Chyba: {str(e)}"
+    return storage.delete_kpi_threshold(DIALECT, threshold_id)
 
 # ============ DEPARTMENT VLASTNI KPI FUNCTIONS ============
 
 def update_department_vlastni_kpi(department_id, ma_vlastni_kpi):
     """Update whether department has own KPI values"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            UPDATE departments
-            SET ma_vlastni_kpi = ?
-            WHERE id = ?
-        """, (ma_vlastni_kpi, department_id))
-        conn.commit()
-        conn.close()
-        return True, "Nastavení vlastních KPI upraveno"
-    except Exception as e:
-        conn.close()
-        return False, str(e)
+    return storage.update_department_vlastni_kpi(DIALECT, department_id, ma_vlastni_kpi)
 
 def add_monthly_department_kpi_data(mesic, department_id, kpi_id, hodnota, poznamka=None, zdroj="MANUAL"):
     """Add or update monthly KPI data for department with own KPI"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO monthly_department_kpi_data (mesic, department_id, kpi_id, hodnota, poznamka, zdroj, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(mesic, department_id, kpi_id) DO UPDATE SET
-                hodnota = excluded.hodnota,
-                poznamka = excluded.poznamka,
-                zdroj = excluded.zdroj,
-                updated_at = CURRENT_TIMESTAMP
-        """, (mesic, department_id, kpi_id, hodnota, poznamka, zdroj))
-        conn.commit()
-        conn.close()
-        return True, "Data uložena"
-    except Exception as e:
-        conn.close()
-        return False, str(e)
+    return storage.add_monthly_department_kpi_data(DIALECT, mesic, department_id, kpi_id, hodnota, poznamka, zdroj)
+
+def add_monthly_department_kpi_data_bulk(mesic, department_id, values, poznamka=None, zdroj="MANUAL"):
+    """Add or update several KPI values of one own-KPI department/month in one transaction (with its summary)"""
+    return storage.add_monthly_department_kpi_data_bulk(DIALECT, mesic, department_id, values, poznamka, zdroj)
 
 def get_monthly_department_kpi_data(mesic, department_id=None):
     """Get monthly KPI data for department(s) with own KPI"""
-    conn = get_connection()
-    if department_id:
-        query = """
-            SELECT d.mesic, d.department_id, dept.nazev as department_nazev,
-                   d.kpi_id, k.nazev as kpi_nazev, d.hodnota, d.poznamka, d.zdroj
-            FROM monthly_department_kpi_data d
-            JOIN departments dept ON d.department_id = dept.id
-            JOIN kpi_definitions k ON d.kpi_id = k.id
-            WHERE d.mesic = ? AND d.department_id = ? AND d.status = 'ACTIVE'
-            ORDER BY k.poradi
-        """
-        df = pd.read_sql_query(query, conn, params=(mesic, department_id))
-    else:
-        query = """
-            SELECT d.mesic, d.department_id, dept.nazev as department_nazev,
-                   d.kpi_id, k.nazev as kpi_nazev, d.hodnota, d.poznamka, d.zdroj
-            FROM monthly_department_kpi_data d
-            JOIN departments dept ON d.department_id = dept.id
-            JOIN kpi_definitions k ON d.kpi_id = k.id
-            WHERE d.mesic = ? AND d.status = 'ACTIVE'
-            ORDER BY dept.nazev, k.poradi
-        """
-        df = pd.read_sql_query(query, conn, params=(mesic,))
-    conn.close()
-    return df
+    return storage.get_monthly_department_kpi_data(DIALECT, mesic, department_id)
 
 def get_department_kpi_value(mesic, department_id, kpi_id):
-    """
-    Get KPI value for department - either own value or average from locations
-    Returns: (hodnota, zdroj) where zdroj is 'VLASTNI' or 'PRUMER_Z_LOKALIT'
-    """
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Check if department has own KPI
-    cursor.execute("SELECT ma_vlastni_kpi FROM departments WHERE id = ?", (department_id,))
-    result = cursor.fetchone()
-    if not result:
-        conn.close()
-        return None, None
-
-    ma_vlastni_kpi = result[0]
-
-    if ma_vlastni_kpi:
-        # Get own KPI value
-        cursor.execute("""
-            SELECT hodnota
-            FROM monthly_department_kpi_data
-            WHERE mesic = ? AND department_id = ? AND kpi_id = ? AND status = 'ACTIVE'
-        """, (mesic, department_id, kpi_id))
-        result = cursor.fetchone()
-        conn.close()
-        if result:
-            return result[0], 'VLASTNI'
-        else:
-            return None, None
-    else:
-        # Calculate average from locations
-        cursor.execute("""
-            SELECT AVG(mkd.hodnota) as prumer
-            FROM monthly_kpi_data mkd
-            JOIN locations l ON mkd.location_id = l.id
-            WHERE mkd.mesic = ? AND l.department_id = ? AND mkd.kpi_id = ?
-                  AND mkd.status = 'ACTIVE' AND l.aktivni = 1
-        """, (mesic, department_id, kpi_id))
-        result = cursor.fetchone()
-        conn.close()
-        if result and result[0] is not None:
-            return result[0], 'PRUMER_Z_LOKALIT'
-        else:
-            return None, None
+    """Get KPI value for department as (hodnota, zdroj) - own value ('VLASTNI') or location average ('PRUMER_Z_LOKALIT')"""
+    return storage.get_department_kpi_value(DIALECT, mesic, department_id, kpi_id)
 
 def get_departments_with_vlastni_kpi():
     """Get list of departments that have own KPI values"""
-    conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT id, nazev, vedouci, ma_vlastni_kpi
-        FROM departments
-        WHERE aktivni = 1
-        ORDER BY nazev
-    """, conn)
-    conn.close()
-    return df
+    return storage.get_departments_with_vlastni_kpi(DIALECT)
 
 # ============ CLEANUP FUNCTIONS ============
 
@@ -1440,6 +1196,7 @@ def fix_binary_ids():
 
         conn.commit()
         conn.close()
+        clear_cache()
         return True, f"Opraveno {fixed_count} záznamů s binárními ID"
     except Exception as e:
         conn.close()
@@ -1495,6 +1252,7 @@ def cleanup_duplicates():
         cursor.execute("SELECT changes()")
         deleted_count = cursor.fetchone()[0]
         conn.close()
+        clear_cache()
         return True, f"Vyčištěno {deleted_count} duplikátů"
     except Exception as e:
         conn.close()
@@ -16,703 +16,1032 @@ from pathlib import Path
 import io
 import streamlit as st
 from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+import os
+import socket
 import numpy as np
+import bonus_engine
+import change_listener
+import data_cache
+import import_engine
+import job_queue
+import query_stats
+import reference_data
+import storage
+
+safe_convert_id = storage.safe_convert_id
+
+# Admin writes to these tables refresh the KPI cube rows of the departments they touch
+CUBE_TABLES = {'locations', 'operational_managers'}
+
+class PostgresDialect(storage.PostgresDialect):
+    """PostgreSQL dialect with this module's connections, caches and derived data"""
+
+    def connection(self):
+        return connection()
+
+    def reference_data(self):
+        return get_reference_data()
+
+    def rules(self, cursor):
+        return get_compiled_rules(cursor)
+
+    def changed(self, cursor, table, keys=()):
+        if table in CUBE_TABLES:
+            refresh_kpi_cube(cursor, department_ids=list(keys))
+        elif table == 'kpi_thresholds':
+            for kpi_id in keys:
+                enqueue_recalculation(mark_kpi_dirty(cursor, kpi_id), cursor, scope='DIRTY')
+
+    def committed(self, table, keys=()):
+        if table == 'kpi_thresholds':
+            for kpi_id in keys:
+                invalidate_threshold_cache(kpi_id)
+            wake_recalc_worker()
+            return
+        invalidate_cache(table)
+        if table in CUBE_TABLES:
+            invalidate_cache('monthly_kpi_cube')
+
+# Shared queries and admin writes (storage.py) in the PostgreSQL dialect
+DIALECT = PostgresDialect()
+
+# ============ QUERY INSTRUMENTATION ============
+
+def _query_log_settings():
+    """query_log, slow_query_ms and slow_query_log from the [database] secrets"""
+    try:
+        config = st.secrets["database"]
+        return (bool(config.get("query_log", True)), float(config.get("slow_query_ms", 200)),
+                config.get("slow_query_log", "slow_queries.jsonl") or None)
+    except Exception:
+        return True, 200.0, "slow_queries.jsonl"
+
+_query_log_enabled, _slow_query_ms, _slow_query_log = _query_log_settings()
+
+# Every statement of this process is timed by InstrumentedCursor (the cursor
+# class of pooled connections); the app scopes page renders with begin_rerun()
+# / end_rerun() and the Admin Debug tab shows the report.
+_query_stats = query_stats.QueryRecorder(
+    slow_ms=_slow_query_ms, slow_log=_slow_query_log, enabled=_query_log_enabled,
+    skip_modules=('storage',),
+)
+
+class InstrumentedCursor(psycopg2.extras.RealDictCursor):
+    """RealDictCursor that reports every statement to the query recorder"""
+
+    def execute(self, query, vars=None):
+        return _query_stats.measure(self, query, super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return _query_stats.measure(self, query, super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return _query_stats.measure(self, sql, super().copy_expert, sql, file, size)
+
+def begin_rerun(page=None):
+    """Start collecting the statements of this Streamlit rerun"""
+    _query_stats.begin_rerun(page)
+
+def set_rerun_page(page):
+    _query_stats.set_page(page)
+
+def end_rerun():
+    """Finish this rerun's statistics, returns its summary"""
+    return _query_stats.end_rerun()
+
+def get_query_stats(limit=15):
+    """Top statements, per-page totals, recent reruns and slow log (Admin Debug tab)"""
+    return {
+        **_query_stats.stats(),
+        'top': _query_stats.top_queries(limit),
+        'pages': _query_stats.pages(),
+        'reruns': _query_stats.reruns(limit),
+        'slow_queries': _query_stats.slow_queries(limit),
+    }
 
-def safe_convert_id(value):
-    """Safely convert any ID value to Python int (handles numpy, pandas types)"""
-    if value is None:
-        return None
+def reset_query_stats():
+    _query_stats.reset()
 
-    # Handle string representations
-    if isinstance(value, str):
-        try:
-            return int(float(value))
-        except (ValueError, TypeError):
-            pass
+# ============ CONNECTION POOL ============
 
-    # Handle numeric types
-    if isinstance(value, (int, np.integer)):
-        return int(value)
-    if isinstance(value, (float, np.floating)):
-        return int(value)
-    if isinstance(value, bytes):
-        return int.from_bytes(value, byteorder='little')
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free within the configured timeout"""
 
-    # Handle pandas/numpy scalar types
-    if hasattr(value, 'item'):
+
+class ConnectionPool:
+    """Thread-safe PostgreSQL connection pool shared by all Streamlit sessions
+
+    Connections are created lazily up to max_size and reused afterwards, so a page
+    render pays the TLS+auth handshake only when the pool has to grow. Idle
+    connections are health-checked on checkout before they are handed out.
+    """
+
+    def __init__(self, connect_fn, min_size=1, max_size=10, timeout=30.0, health_check_interval=30.0):
+        self._connect_fn = connect_fn
+        self.min_size = max(0, int(min_size))
+        self.max_size = max(1, int(max_size), self.min_size)
+        self.timeout = float(timeout)
+        self.health_check_interval = float(health_check_interval)
+
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, last_used_monotonic)]
+        self._size = 0  # open connections (idle + checked out)
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'connects': 0,
+            'handshake_time': 0.0,
+            'health_check_failures': 0,
+        }
+
+        for _ in range(self.min_size):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+
+    def _connect(self):
+        """Open a new physical connection and record the handshake time"""
+        started = time.perf_counter()
+        conn = self._connect_fn()
+        elapsed = time.perf_counter() - started
+        with self._cond:
+            self._stats['connects'] += 1
+            self._stats['handshake_time'] += elapsed
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        """Check a pooled connection before handing it out"""
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
         try:
-            return int(value.item())
-        except (ValueError, TypeError, AttributeError):
+            conn.close()
+        except Exception:
             pass
 
-    # Last resort: try direct conversion
-    try:
-        # Handle any other numeric-like types
-        converted = float(value)
-        return int(converted)
-    except (ValueError, TypeError) as e:
-        # Better error message with type info
-        raise ValueError(f"Cannot convert {type(value).__name__} (module: {type(value).__module__}) value '{value}' to int. Error: {e}")
+    def getconn(self):
+        """Check out a connection, waiting up to timeout seconds if the pool is exhausted"""
+        deadline = time.monotonic() + self.timeout
+        wait_started = None
+        conn = None
+        last_used = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1  # reserve a slot, connect outside the lock
+                    break
+                if wait_started is None:
+                    wait_started = time.monotonic()
+                    self._stats['waits'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    self._stats['wait_time'] += time.monotonic() - wait_started
+                    raise PoolTimeoutError(
+                        f"Žádné volné připojení k databázi do {self.timeout:.0f} s (max {self.max_size})"
+                    )
+                self._cond.wait(remaining)
+
+            if wait_started is not None:
+                self._stats['wait_time'] += time.monotonic() - wait_started
+            self._stats['checkouts'] += 1
+
+        if conn is not None and not self._is_healthy(conn, last_used):
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            self._close_quietly(conn)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def putconn(self, conn):
+        """Return a connection to the pool, rolling back any unfinished transaction"""
+        healthy = not conn.closed
+        if healthy:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                healthy = False
+
+        with self._cond:
+            if healthy:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+            self._cond.notify()
+
+        if not healthy:
+            self._close_quietly(conn)
+
+    def closeall(self):
+        """Close all idle connections (checked-out connections are closed on return)"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+        stats['in_use'] = stats['size'] - stats['idle']
+        stats['min_size'] = self.min_size
+        stats['max_size'] = self.max_size
+        stats['avg_handshake_ms'] = (stats['handshake_time'] / stats['connects'] * 1000) if stats['connects'] else 0.0
+        stats['avg_wait_ms'] = (stats['wait_time'] / stats['waits'] * 1000) if stats['waits'] else 0.0
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# application_name of this process' connections; change notifications carry it
+# so the listener can skip writes this process already invalidated itself
+PROCESS_ORIGIN = f"resto-{socket.gethostname()}-{os.getpid()}"[:63]
 
 def get_connection():
-    """Get PostgreSQL database connection from Streamlit secrets"""
+    """Open a new (non-pooled) PostgreSQL connection from Streamlit secrets
+
+    RESTO_DATABASE_URL in the environment overrides the url (benchmarks, scripts).
+    """
     try:
-        # Get connection string from Streamlit secrets
-        conn_string = st.secrets["database"]["url"]
-        conn = psycopg2.connect(conn_string, cursor_factory=psycopg2.extras.RealDictCursor)
-        # Use RealDictCursor for dict-like row access (similar to sqlite3.Row)
+        # Get connection string from the environment or Streamlit secrets
+        conn_string = os.environ.get("RESTO_DATABASE_URL") or st.secrets["database"]["url"]
+        conn = psycopg2.connect(conn_string, cursor_factory=InstrumentedCursor,
+                                application_name=PROCESS_ORIGIN)
+        # RealDictCursor for dict-like row access (similar to sqlite3.Row), timed per statement
         return conn
     except Exception as e:
         st.error(f"Chyba připojení k databázi: {str(e)}")
         raise
 
+def get_pool():
+    """Get the process-wide connection pool, creating it on first use
+
+    Pool size is configured in the [database] section of secrets.toml:
+    pool_min_size (default 1), pool_max_size (default 10), pool_timeout
+    (seconds, default 30) and pool_health_check_interval (seconds, default 30).
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = st.secrets["database"]
+                _pool = ConnectionPool(
+                    get_connection,
+                    min_size=config.get("pool_min_size", 1),
+                    max_size=config.get("pool_max_size", 10),
+                    timeout=config.get("pool_timeout", 30),
+                    health_check_interval=config.get("pool_health_check_interval", 30),
+                )
+    return _pool
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection for the duration of a with-block
+
+    Uncommitted work is rolled back when the connection goes back to the pool.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+def get_pool_stats():
+    """Get connection pool statistics (for the Admin Debug tab)"""
+    if _pool is None:
+        return None
+    return _pool.stats()
+
+# ============ READ CACHE ============
+
+# Tagged cache shared by all sessions of this process; entries are tagged by
+# table and month (e.g. "monthly_kpi_evaluation:2025-11") so that writers can
+# invalidate only what they touched.
+_data_cache = data_cache.TaggedCache(on_lookup=_query_stats.record_cache)
+
+def invalidate_cache(table, mesic=None):
+    """Invalidate cached reads of a table - only one month's entries when mesic is given"""
+    if mesic:
+        _data_cache.invalidate(data_cache.month_tag(table, mesic), data_cache.month_tag(table))
+    else:
+        _data_cache.invalidate(table)
+    if table in REFERENCE_TABLES:
+        _reference_store.invalidate()
+
+def clear_cache():
+    """Drop every cached read (🔄 Obnovit data)"""
+    _data_cache.clear()
+    _reference_store.invalidate()
+
+def get_cache_stats():
+    """Get read cache statistics (for the Admin Debug tab)"""
+    return _data_cache.stats()
+
+# ============ REFERENCE DATA STORE ============
+
+# Departments, locations, managers, KPI definitions and thresholds as one
+# immutable snapshot per process (reference_data.ReferenceStore). Writers
+# invalidate it through invalidate_cache()/invalidate_threshold_cache().
+REFERENCE_TABLES = {'departments', 'locations', 'operational_managers', 'kpi_definitions', 'kpi_thresholds'}
+
+def _load_reference_data(version):
+    """Load all reference tables in one connection (loader of _reference_store)"""
+    with connection() as conn, conn.cursor() as cursor:
+        return storage.load_reference_data(cursor, DIALECT, version)
+
+_reference_store = reference_data.ReferenceStore(_load_reference_data, ttl=3600)  # 1 hour, like the other reference reads
+
+def get_reference_data():
+    """Current reference data snapshot shared by all sessions (read-only, O(1) lookups)"""
+    return _reference_store.get()
+
+def get_reference_stats():
+    """Reference store statistics (for the Admin Debug tab)"""
+    return _reference_store.stats()
+
+# ============ CHANGE NOTIFICATIONS (LISTEN/NOTIFY) ============
+
+# Triggers on the cached tables NOTIFY CHANGE_CHANNEL with
+# {"table", "key", "origin"} - key is the month of monthly tables and the KPI of
+# thresholds. PostgreSQL folds identical notifications of one transaction, so a
+# bulk save sends one message per table and month. A listener thread in every
+# app process invalidates the matching cache entries, which keeps replicas
+# fresh without shortening the TTLs.
+CHANGE_CHANNEL = 'resto_changes'
+
+# table -> key column sent with the notification (None = whole table, one message per statement)
+NOTIFY_TABLES = {
+    'monthly_kpi_data': 'mesic',
+    'monthly_kpi_evaluation': 'mesic',
+    'monthly_kpi_cube': 'mesic',
+    'month_catalog': 'mesic',
+    'kpi_thresholds': 'kpi_id',
+    'departments': None,
+    'locations': None,
+    'operational_managers': None,
+    'kpi_definitions': None,
+}
+
+NOTIFY_FUNCTION_SQL = f"""
+    CREATE OR REPLACE FUNCTION resto_notify_change() RETURNS trigger AS $$
+    DECLARE
+        origin TEXT := current_setting('application_name', true);
+    BEGIN
+        IF TG_LEVEL = 'STATEMENT' THEN
+            PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+                'table', TG_TABLE_NAME, 'key', NULL, 'origin', origin)::text);
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+                'table', TG_TABLE_NAME, 'key', to_jsonb(OLD) ->> TG_ARGV[0], 'origin', origin)::text);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+                'table', TG_TABLE_NAME, 'key', to_jsonb(NEW) ->> TG_ARGV[0], 'origin', origin)::text);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+def create_notify_triggers(cursor):
+    """Install the change notification triggers that are still missing"""
+    cursor.execute(NOTIFY_FUNCTION_SQL)
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_trigger t
+        JOIN pg_class c ON t.tgrelid = c.oid
+        WHERE t.tgname = 'resto_notify_change' AND c.relname = ANY(%s)
+    """, (list(NOTIFY_TABLES),))
+    existing = {row['relname'] for row in cursor.fetchall()}
+    for table, key_column in NOTIFY_TABLES.items():
+        if table in existing:
+            continue
+        if key_column:
+            cursor.execute(f"""
+                CREATE TRIGGER resto_notify_change
+                AFTER INSERT OR UPDATE OR DELETE ON {table}
+                FOR EACH ROW EXECUTE FUNCTION resto_notify_change('{key_column}')
+            """)
+        else:
+            cursor.execute(f"""
+                CREATE TRIGGER resto_notify_change
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION resto_notify_change()
+            """)
+
+def apply_change_notification(event):
+    """Invalidate what one change notification touched (handler of the listener)"""
+    table = event.get('table')
+    key = event.get('key')
+    if table == 'kpi_thresholds':
+        invalidate_threshold_cache(safe_convert_id(key))
+    elif NOTIFY_TABLES.get(table) == 'mesic':
+        invalidate_cache(table, key)
+    elif table in NOTIFY_TABLES:
+        invalidate_cache(table)
+
+def _listener_connection():
+    config = st.secrets["database"]
+    url = os.environ.get("RESTO_DATABASE_URL") or config.get("listen_url", config["url"])
+    return psycopg2.connect(url,
+                            cursor_factory=psycopg2.extras.RealDictCursor,
+                            application_name=PROCESS_ORIGIN)
+
+_change_listener = change_listener.ChangeListener(
+    _listener_connection, CHANGE_CHANNEL, apply_change_notification,
+    on_resync=clear_cache, origin=PROCESS_ORIGIN,
+)
+
+def start_change_listener():
+    """Start the background LISTEN thread of this process
+
+    Disabled with listen_changes = false in the [database] section. LISTEN
+    needs a session connection - behind a transaction-mode pooler (Supabase
+    port 6543) set listen_url to the direct or session-mode connection string.
+    """
+    if not st.secrets["database"].get("listen_changes", True):
+        return False
+    return _change_listener.start()
+
+def get_listener_stats():
+    """Change listener statistics (for the Admin Debug tab)"""
+    return _change_listener.stats()
+
+MONTHLY_TABLES = ['monthly_kpi_data', 'monthly_kpi_evaluation', 'monthly_department_kpi_data']
+
+# First day of the month for valid 'YYYY-MM' values, NULL otherwise (immutable, usable in GENERATED columns)
+MONTH_DATE_EXPRESSION = (
+    "CASE WHEN mesic ~ '^[0-9]{4}-(0[1-9]|1[0-2])$' "
+    "THEN make_date(split_part(mesic, '-', 1)::int, split_part(mesic, '-', 2)::int, 1) END"
+)
+
+# The UNIQUE(mesic, ...) constraints already cover lookups by month; these serve
+# the status/location/KPI filters and the ORDER BY mesic DESC reads
+INDEX_STATEMENTS = storage.INDEX_STATEMENTS + [
+    """CREATE INDEX IF NOT EXISTS idx_monthly_kpi_cube_mesic_uroven
+       ON monthly_kpi_cube (mesic, uroven)""",
+    # At most one waiting job per month - new requests coalesce into it
+    """CREATE UNIQUE INDEX IF NOT EXISTS idx_recalc_jobs_pending_mesic
+       ON recalc_jobs (mesic) WHERE status = 'PENDING'""",
+    """CREATE INDEX IF NOT EXISTS idx_recalc_jobs_mesic
+       ON recalc_jobs (mesic, id DESC)""",
+]
+
 def init_database():
     """Initialize database with CORRECTED schema - PostgreSQL version"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    with connection() as conn, conn.cursor() as cursor:
+        # === DEPARTMENTS (Oddělení) ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS departments (
+                id SERIAL PRIMARY KEY,
+                nazev TEXT NOT NULL UNIQUE,
+                popis TEXT,
+                vedouci TEXT,
+                ma_vlastni_kpi BOOLEAN DEFAULT FALSE,
+                aktivni BOOLEAN DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
 
-    # === DEPARTMENTS (Oddělení) ===
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS departments (
-            id SERIAL PRIMARY KEY,
-            nazev TEXT NOT NULL UNIQUE,
-            popis TEXT,
-            vedouci TEXT,
-            ma_vlastni_kpi BOOLEAN DEFAULT FALSE,
-            aktivni BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
+        # === LOCATIONS (Lokality) - přiřazené oddělením ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS locations (
+                id SERIAL PRIMARY KEY,
+                nazev TEXT NOT NULL UNIQUE,
+                department_id INTEGER NOT NULL,
+                popis TEXT,
+                aktivni BOOLEAN DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (department_id) REFERENCES departments(id)
+            )
+        """)
 
-    # === LOCATIONS (Lokality) - přiřazené oddělením ===
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS locations (
-            id SERIAL PRIMARY KEY,
-            nazev TEXT NOT NULL UNIQUE,
-            department_id INTEGER NOT NULL,
-            popis TEXT,
-            aktivni BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (department_id) REFERENCES departments(id)
-        )
-    """)
+        # === OPERATIONAL MANAGERS (Provozní) - přiřazení oddělení! ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS operational_managers (
+                id SERIAL PRIMARY KEY,
+                jmeno TEXT NOT NULL,
+                department_id INTEGER NOT NULL,
+                email TEXT,
+                aktivni BOOLEAN DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (department_id) REFERENCES departments(id)
+            )
+        """)
 
-    # === OPERATIONAL MANAGERS (Provozní) - přiřazení oddělení! ===
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS operational_managers (
-            id SERIAL PRIMARY KEY,
-            jmeno TEXT NOT NULL,
-            department_id INTEGER NOT NULL,
-            email TEXT,
-            aktivni BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (department_id) REFERENCES departments(id)
-        )
-    """)
+        # === KPI DEFINITIONS (Definice KPI - 10 metrů) ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS kpi_definitions (
+                id SERIAL PRIMARY KEY,
+                nazev TEXT NOT NULL UNIQUE,
+                popis TEXT,
+                jednotka TEXT,
+                typ_vypoctu TEXT,
+                aktivni BOOLEAN DEFAULT TRUE,
+                poradi INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
 
-    # === KPI DEFINITIONS (Definice KPI - 10 metrů) ===
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS kpi_definitions (
-            id SERIAL PRIMARY KEY,
-            nazev TEXT NOT NULL UNIQUE,
-            popis TEXT,
-            jednotka TEXT,
-            typ_vypoctu TEXT,
-            aktivni BOOLEAN DEFAULT TRUE,
-            poradi INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
+        # === KPI THRESHOLDS (Prahy pro bonus) ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS kpi_thresholds (
+                id SERIAL PRIMARY KEY,
+                kpi_id INTEGER NOT NULL,
+                min_hodnota REAL,
+                max_hodnota REAL,
+                operator TEXT NOT NULL,
+                bonus_procento REAL NOT NULL,
+                popis TEXT,
+                poradi INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (kpi_id) REFERENCES kpi_definitions(id)
+            )
+        """)
 
-    # === KPI THRESHOLDS (Prahy pro bonus) ===
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS kpi_thresholds (
-            id SERIAL PRIMARY KEY,
-            kpi_id INTEGER NOT NULL,
-            min_hodnota REAL,
-            max_hodnota REAL,
-            operator TEXT NOT NULL,
-            bonus_procento REAL NOT NULL,
-            popis TEXT,
-            poradi INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (kpi_id) REFERENCES kpi_definitions(id)
-        )
-    """)
+        # === MANAGER KPI ASSIGNMENTS (Přiřazení KPI k provozním) ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS manager_kpi_assignments (
+                id SERIAL PRIMARY KEY,
+                manager_id INTEGER NOT NULL,
+                kpi_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(manager_id, kpi_id),
+                FOREIGN KEY (manager_id) REFERENCES operational_managers(id) ON DELETE CASCADE,
+                FOREIGN KEY (kpi_id) REFERENCES kpi_definitions(id) ON DELETE CASCADE
+            )
+        """)
 
-    # === MANAGER KPI ASSIGNMENTS (Přiřazení KPI k provozním) ===
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS manager_kpi_assignments (
-            id SERIAL PRIMARY KEY,
-            manager_id INTEGER NOT NULL,
-            kpi_id INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(manager_id, kpi_id),
-            FOREIGN KEY (manager_id) REFERENCES operational_managers(id) ON DELETE CASCADE,
-            FOREIGN KEY (kpi_id) REFERENCES kpi_definitions(id) ON DELETE CASCADE
-        )
-    """)
+        # === MONTHLY KPI DATA (Měsíční vstupní data) - KLÍČOVÁ TABULKA ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS monthly_kpi_data (
+                id SERIAL PRIMARY KEY,
+                mesic TEXT NOT NULL,
+                location_id INTEGER NOT NULL,
+                kpi_id INTEGER NOT NULL,
+                hodnota REAL NOT NULL,
+                status TEXT DEFAULT 'ACTIVE',
+                poznamka TEXT,
+                zdroj TEXT DEFAULT 'MANUAL',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(mesic, location_id, kpi_id),
+                FOREIGN KEY (location_id) REFERENCES locations(id),
+                FOREIGN KEY (kpi_id) REFERENCES kpi_definitions(id)
+            )
+        """)
 
-    # === MONTHLY KPI DATA (Měsíční vstupní data) - KLÍČOVÁ TABULKA ===
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS monthly_kpi_data (
-            id SERIAL PRIMARY KEY,
-            mesic TEXT NOT NULL,
-            location_id INTEGER NOT NULL,
-            kpi_id INTEGER NOT NULL,
-            hodnota REAL NOT NULL,
-            status TEXT DEFAULT 'ACTIVE',
-            poznamka TEXT,
-            zdroj TEXT DEFAULT 'MANUAL',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(mesic, location_id, kpi_id),
-            FOREIGN KEY (location_id) REFERENCES locations(id),
-            FOREIGN KEY (kpi_id) REFERENCES kpi_definitions(id)
-        )
-    """)
+        # === MONTHLY KPI EVALUATION (Vyhodnocení splnění) ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS monthly_kpi_evaluation (
+                id SERIAL PRIMARY KEY,
+                mesic TEXT NOT NULL,
+                location_id INTEGER NOT NULL,
+                kpi_id INTEGER NOT NULL,
+                hodnota REAL NOT NULL,
+                splneno INTEGER DEFAULT 0,
+                bonus_procento REAL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(mesic, location_id, kpi_id),
+                FOREIGN KEY (location_id) REFERENCES locations(id),
+                FOREIGN KEY (kpi_id) REFERENCES kpi_definitions(id)
+            )
+        """)
 
-    # === MONTHLY KPI EVALUATION (Vyhodnocení splnění) ===
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS monthly_kpi_evaluation (
-            id SERIAL PRIMARY KEY,
-            mesic TEXT NOT NULL,
-            location_id INTEGER NOT NULL,
-            kpi_id INTEGER NOT NULL,
-            hodnota REAL NOT NULL,
-            splneno INTEGER DEFAULT 0,
-            bonus_procento REAL DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(mesic, location_id, kpi_id),
-            FOREIGN KEY (location_id) REFERENCES locations(id),
-            FOREIGN KEY (kpi_id) REFERENCES kpi_definitions(id)
-        )
-    """)
+        # === MONTHLY DEPARTMENT KPI DATA (Měsíční KPI data pro oddělení s vlastními KPI) ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS monthly_department_kpi_data (
+                id SERIAL PRIMARY KEY,
+                mesic TEXT NOT NULL,
+                department_id INTEGER NOT NULL,
+                kpi_id INTEGER NOT NULL,
+                hodnota REAL NOT NULL,
+                status TEXT DEFAULT 'ACTIVE',
+                poznamka TEXT,
+                zdroj TEXT DEFAULT 'MANUAL',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(mesic, department_id, kpi_id),
+                FOREIGN KEY (department_id) REFERENCES departments(id),
+                FOREIGN KEY (kpi_id) REFERENCES kpi_definitions(id)
+            )
+        """)
 
-    # === MONTHLY DEPARTMENT KPI DATA (Měsíční KPI data pro oddělení s vlastními KPI) ===
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS monthly_department_kpi_data (
-            id SERIAL PRIMARY KEY,
-            mesic TEXT NOT NULL,
-            department_id INTEGER NOT NULL,
-            kpi_id INTEGER NOT NULL,
-            hodnota REAL NOT NULL,
-            status TEXT DEFAULT 'ACTIVE',
-            poznamka TEXT,
-            zdroj TEXT DEFAULT 'MANUAL',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(mesic, department_id, kpi_id),
-            FOREIGN KEY (department_id) REFERENCES departments(id),
-            FOREIGN KEY (kpi_id) REFERENCES kpi_definitions(id)
-        )
-    """)
+        # === DEPARTMENT MONTHLY SUMMARY (Shrnutí oddělení za měsíc) ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS department_monthly_summary (
+                id SERIAL PRIMARY KEY,
+                mesic TEXT NOT NULL,
+                department_id INTEGER NOT NULL,
+                celkovy_bonus REAL DEFAULT 0,
+                aktivnich_kpi INTEGER DEFAULT 0,
+                splnenych_kpi INTEGER DEFAULT 0,
+                poznamka TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(mesic, department_id),
+                FOREIGN KEY (department_id) REFERENCES departments(id)
+            )
+        """)
 
-    # === DEPARTMENT MONTHLY SUMMARY (Shrnutí oddělení za měsíc) ===
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS department_monthly_summary (
-            id SERIAL PRIMARY KEY,
-            mesic TEXT NOT NULL,
-            department_id INTEGER NOT NULL,
-            celkovy_bonus REAL DEFAULT 0,
-            aktivnich_kpi INTEGER DEFAULT 0,
-            splnenych_kpi INTEGER DEFAULT 0,
-            poznamka TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(mesic, department_id),
-            FOREIGN KEY (department_id) REFERENCES departments(id)
-        )
-    """)
+        # === SETTINGS ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                klic TEXT PRIMARY KEY,
+                hodnota TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
 
-    # === SETTINGS ===
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS settings (
-            klic TEXT PRIMARY KEY,
-            hodnota TEXT,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
+        # === MONTHLY KPI CUBE (Předpočítané agregace pro Přehled/Detail/Porovnání) ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS monthly_kpi_cube (
+                id SERIAL PRIMARY KEY,
+                mesic TEXT NOT NULL,
+                uroven TEXT NOT NULL,
+                department_id INTEGER NOT NULL,
+                manager_id INTEGER NOT NULL,
+                location_id INTEGER,
+                kpi_id INTEGER,
+                hodnota REAL,
+                bonus_sum REAL DEFAULT 0,
+                kpi_count INTEGER DEFAULT 0,
+                met_count INTEGER DEFAULT 0,
+                locations_with_data INTEGER DEFAULT 0,
+                location_count INTEGER DEFAULT 0,
+                avg_bonus REAL DEFAULT 0
+            )
+        """)
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        # === RECALC JOBS (Fronta přepočtu bonusů na pozadí) ===
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS recalc_jobs (
+                id SERIAL PRIMARY KEY,
+                mesic TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'PENDING',
+                scope TEXT NOT NULL DEFAULT 'FULL',
+                requests INTEGER DEFAULT 1,
+                attempts INTEGER DEFAULT 0,
+                processed INTEGER,
+                worker TEXT,
+                message TEXT,
+                requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+
+        # Queues created before dirty tracking have no scope column
+        cursor.execute("ALTER TABLE recalc_jobs ADD COLUMN IF NOT EXISTS scope TEXT NOT NULL DEFAULT 'FULL'")
+
+        # === RECALC DIRTY (Měsíc × lokalita změněné od posledního vyhodnocení) ===
+        cursor.execute("SELECT to_regclass('recalc_dirty') IS NULL AS missing")
+        dirty_missing = cursor.fetchone()['missing']
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS recalc_dirty (
+                mesic TEXT NOT NULL,
+                location_id INTEGER NOT NULL,
+                marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (mesic, location_id)
+            )
+        """)
+        if dirty_missing:
+            # Seed it once with pairs whose data and evaluation disagree
+            cursor.execute(DIRTY_SEED_SQL)
+
+        # === MONTH CATALOG (Měsíce s daty pro výběr měsíce) ===
+        cursor.execute("SELECT to_regclass('month_catalog') IS NULL AS missing")
+        catalog_missing = cursor.fetchone()['missing']
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS month_catalog (
+                mesic TEXT PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        if catalog_missing:
+            refresh_month_catalog(cursor)
+
+        # === INDEXES (safe to re-run on existing databases) ===
+        for statement in INDEX_STATEMENTS:
+            cursor.execute(statement)
+
+        # === CHANGE NOTIFICATION TRIGGERS (LISTEN/NOTIFY cache refresh) ===
+        create_notify_triggers(cursor)
+
+        # Fill the cube once for databases created before it existed
+        cursor.execute("""
+            SELECT NOT EXISTS (SELECT 1 FROM monthly_kpi_cube)
+               AND EXISTS (SELECT 1 FROM monthly_kpi_evaluation) AS needs_fill
+        """)
+        if cursor.fetchone()['needs_fill']:
+            refresh_kpi_cube(cursor)
+
+        # === TYPED MONTH COLUMN (optional, [database] typed_month = true) ===
+        if st.secrets["database"].get("typed_month", False):
+            for table in MONTHLY_TABLES:
+                cursor.execute(f"""
+                    ALTER TABLE {table}
+                    ADD COLUMN IF NOT EXISTS mesic_datum DATE GENERATED ALWAYS AS ({MONTH_DATE_EXPRESSION}) STORED
+                """)
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_mesic_datum ON {table} (mesic_datum)")
+
+        conn.commit()
 
 def insert_default_data():
     """Insert default data - CORRECTED STRUCTURE"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Check if data already exists - skip if yes
-    cursor.execute("SELECT COUNT(*) as count FROM departments")
-    result = cursor.fetchone()
-    if result['count'] > 0:
-        cursor.close()
-        conn.close()
-        return  # Data already exists, skip
-
-    # === INSERT DEPARTMENTS (OPRAVA: Bouda a Bistro jsou oddělení) ===
-    departments = [
-        ("Bouda", "Oddělení Bouda - Mercury & OC4Dvory", "Matěj, Thomas"),
-        ("Bistro", "Oddělení Bistro", "Michael"),
-    ]
-    for nazev, popis, vedouci in departments:
-        cursor.execute("""
-            INSERT INTO departments (nazev, popis, vedouci)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (nazev) DO NOTHING
-        """, (nazev, popis, vedouci))
-
-    conn.commit()
-
-    # === INSERT LOCATIONS (Bound to departments) ===
-    cursor.execute("SELECT id, nazev FROM departments ORDER BY id")
-    depts = cursor.fetchall()
-    dept_map = {row['nazev']: row['id'] for row in depts}  # nazev -> id
-
-    locations = [
-        ("Mercury", "Bouda"),           # Mercury patří do oddělení Bouda
-        ("OC4Dvory", "Bouda"),          # OC4Dvory patří do oddělení Bouda
-        ("Bistro", "Bistro"),           # Bistro patří do oddělení Bistro
-    ]
-
-    for nazev, dept_name in locations:
-        if dept_name in dept_map:
+    with connection() as conn, conn.cursor() as cursor:
+        # Check if data already exists - skip if yes
+        cursor.execute("SELECT COUNT(*) as count FROM departments")
+        result = cursor.fetchone()
+        if result['count'] > 0:
+            return  # Data already exists, skip
+
+        # === INSERT DEPARTMENTS (OPRAVA: Bouda a Bistro jsou oddělení) ===
+        departments = [
+            ("Bouda", "Oddělení Bouda - Mercury & OC4Dvory", "Matěj, Thomas"),
+            ("Bistro", "Oddělení Bistro", "Michael"),
+        ]
+        for nazev, popis, vedouci in departments:
             cursor.execute("""
-                INSERT INTO locations (nazev, department_id, popis)
+                INSERT INTO departments (nazev, popis, vedouci)
                 VALUES (%s, %s, %s)
                 ON CONFLICT (nazev) DO NOTHING
-            """, (nazev, dept_map[dept_name], f"Lokalita {nazev}"))
+            """, (nazev, popis, vedouci))
+
+        conn.commit()
 
-    conn.commit()
+        # === INSERT LOCATIONS (Bound to departments) ===
+        cursor.execute("SELECT id, nazev FROM departments ORDER BY id")
+        depts = cursor.fetchall()
+        dept_map = {row['nazev']: row['id'] for row in depts}  # nazev -> id
 
-    # === INSERT OPERATIONAL MANAGERS (OPRAVA: přiřazeni oddělení!) ===
-    cursor.execute("SELECT id, nazev FROM departments ORDER BY id")
-    depts = cursor.fetchall()
-    dept_map = {row['nazev']: row['id'] for row in depts}
+        locations = [
+            ("Mercury", "Bouda"),           # Mercury patří do oddělení Bouda
+            ("OC4Dvory", "Bouda"),          # OC4Dvory patří do oddělení Bouda
+            ("Bistro", "Bistro"),           # Bistro patří do oddělení Bistro
+        ]
 
-    operational_mgrs = [
-        ("Matěj", "Bouda"),             # Matěj provozní v Boudě
-        ("Thomas", "Bouda"),            # Thomas provozní v Boudě
-        ("Michael", "Bistro"),          # Michael provozní v Bistrům
-    ]
+        for nazev, dept_name in locations:
+            if dept_name in dept_map:
+                cursor.execute("""
+                    INSERT INTO locations (nazev, department_id, popis)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (nazev) DO NOTHING
+                """, (nazev, dept_map[dept_name], f"Lokalita {nazev}"))
 
-    for jmeno, dept_name in operational_mgrs:
-        if dept_name in dept_map:
-            cursor.execute("""
-                INSERT INTO operational_managers (jmeno, department_id)
-                VALUES (%s, %s)
-            """, (jmeno, dept_map[dept_name]))
-
-    conn.commit()
-
-    # === INSERT KPI DEFINITIONS ===
-    kpis = [
-        ("Audit", "Provozní audit (%)", "%", "aggregated", 1),
-        ("Hodnocení rozvozy", "Hodnocení od zákazníků - rozvozy (★)", "★", "average", 2),
-        ("Hodnocení Google", "Hodnocení Google recenze (★)", "★", "average", 3),
-        ("Čas přípravy", "Průměrný čas přípravy objednávky (min)", "min", "average", 4),
-        ("Chybovost objednávek", "Procento chybných objednávek (%)", "%", "calculated", 5),
-        ("Mystery shop", "Mystery shopping hodnocení (%)", "%", "aggregated", 6),
-        ("Obratohodina", "Obrat na odpracovanou hodinu (Kč/h)", "Kč/h", "calculated", 7),
-        ("Hodnocení zaměstnanců", "Interní hodnocení týmu (0-10)", "0-10", "average", 8),
-        ("Zjištěná ztráta", "Zjištěná ztráta zboží (%)", "%", "aggregated", 9),
-        ("Nezjištěná ztráta", "Nezjištěná ztráta zboží (%)", "%", "aggregated", 10),
-    ]
-
-    for nazev, popis, jednotka, typ_vypoctu, poradi in kpis:
-        cursor.execute("""
-            INSERT INTO kpi_definitions (nazev, popis, jednotka, typ_vypoctu, poradi)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (nazev) DO NOTHING
-        """, (nazev, popis, jednotka, typ_vypoctu, poradi))
-
-    conn.commit()
-
-    # === INSERT KPI THRESHOLDS ===
-    kpi_thresholds = [
-        ("Audit", 85, None, "≥", 30, "≥85%"),
-        ("Audit", 75, 84.99, "mezi", 15, "75-84%"),
-        ("Audit", None, 75, "<", 0, "<75%"),
-        ("Hodnocení rozvozy", 4.6, None, "≥", 10, "≥4.6★"),
-        ("Hodnocení Google", 4.6, None, "≥", 5, "≥4.6★"),
-        ("Čas přípravy", None, 10, "≤", 10, "≤10min"),
-        ("Chybovost objednávek", None, 0.5, "<", 10, "<0.5%"),
-        ("Mystery shop", 85, None, "≥", 15, "≥85%"),
-        ("Obratohodina", 1250, None, "≥", 5, "≥1250 Kč/h"),
-        ("Hodnocení zaměstnanců", 8, None, "≥", 5, "≥8/10"),
-        ("Zjištěná ztráta", None, 0.5, "≤", 5, "≤0.5%"),
-        ("Nezjištěná ztráta", None, 0.5, "≤", 5, "≤0.5%"),
-    ]
-
-    for kpi_nazev, min_val, max_val, operator, bonus, popis in kpi_thresholds:
-        cursor.execute("SELECT id FROM kpi_definitions WHERE nazev = %s", (kpi_nazev,))
-        result = cursor.fetchone()
-        if result:
-            kpi_id = result['id']
+        conn.commit()
+
+        # === INSERT OPERATIONAL MANAGERS (OPRAVA: přiřazeni oddělení!) ===
+        cursor.execute("SELECT id, nazev FROM departments ORDER BY id")
+        depts = cursor.fetchall()
+        dept_map = {row['nazev']: row['id'] for row in depts}
+
+        operational_mgrs = [
+            ("Matěj", "Bouda"),             # Matěj provozní v Boudě
+            ("Thomas", "Bouda"),            # Thomas provozní v Boudě
+            ("Michael", "Bistro"),          # Michael provozní v Bistrům
+        ]
+
+        for jmeno, dept_name in operational_mgrs:
+            if dept_name in dept_map:
+                cursor.execute("""
+                    INSERT INTO operational_managers (jmeno, department_id)
+                    VALUES (%s, %s)
+                """, (jmeno, dept_map[dept_name]))
+
+        conn.commit()
+
+        # === INSERT KPI DEFINITIONS ===
+        kpis = [
+            ("Audit", "Provozní audit (%)", "%", "aggregated", 1),
+            ("Hodnocení rozvozy", "Hodnocení od zákazníků - rozvozy (★)", "★", "average", 2),
+            ("Hodnocení Google", "Hodnocení Google recenze (★)", "★", "average", 3),
+            ("Čas přípravy", "Průměrný čas přípravy objednávky (min)", "min", "average", 4),
+            ("Chybovost objednávek", "Procento chybných objednávek (%)", "%", "calculated", 5),
+            ("Mystery shop", "Mystery shopping hodnocení (%)", "%", "aggregated", 6),
+            ("Obratohodina", "Obrat na odpracovanou hodinu (Kč/h)", "Kč/h", "calculated", 7),
+            ("Hodnocení zaměstnanců", "Interní hodnocení týmu (0-10)", "0-10", "average", 8),
+            ("Zjištěná ztráta", "Zjištěná ztráta zboží (%)", "%", "aggregated", 9),
+            ("Nezjištěná ztráta", "Nezjištěná ztráta zboží (%)", "%", "aggregated", 10),
+        ]
+
+        for nazev, popis, jednotka, typ_vypoctu, poradi in kpis:
             cursor.execute("""
-                INSERT INTO kpi_thresholds
-                (kpi_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi)
-                VALUES (%s, %s, %s, %s, %s, %s, 1)
-            """, (kpi_id, min_val, max_val, operator, bonus, popis))
+                INSERT INTO kpi_definitions (nazev, popis, jednotka, typ_vypoctu, poradi)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (nazev) DO NOTHING
+            """, (nazev, popis, jednotka, typ_vypoctu, poradi))
+
+        conn.commit()
+
+        # === INSERT KPI THRESHOLDS ===
+        kpi_thresholds = [
+            ("Audit", 85, None, "≥", 30, "≥85%"),
+            ("Audit", 75, 84.99, "mezi", 15, "75-84%"),
+            ("Audit", None, 75, "<", 0, "<75%"),
+            ("Hodnocení rozvozy", 4.6, None, "≥", 10, "≥4.6★"),
+            ("Hodnocení Google", 4.6, None, "≥", 5, "≥4.6★"),
+            ("Čas přípravy", None, 10, "≤", 10, "≤10min"),
+            ("Chybovost objednávek", None, 0.5, "<", 10, "<0.5%"),
+            ("Mystery shop", 85, None, "≥", 15, "≥85%"),
+            ("Obratohodina", 1250, None, "≥", 5, "≥1250 Kč/h"),
+            ("Hodnocení zaměstnanců", 8, None, "≥", 5, "≥8/10"),
+            ("Zjištěná ztráta", None, 0.5, "≤", 5, "≤0.5%"),
+            ("Nezjištěná ztráta", None, 0.5, "≤", 5, "≤0.5%"),
+        ]
+
+        for kpi_nazev, min_val, max_val, operator, bonus, popis in kpi_thresholds:
+            cursor.execute("SELECT id FROM kpi_definitions WHERE nazev = %s", (kpi_nazev,))
+            result = cursor.fetchone()
+            if result:
+                kpi_id = result['id']
+                cursor.execute("""
+                    INSERT INTO kpi_thresholds
+                    (kpi_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi)
+                    VALUES (%s, %s, %s, %s, %s, %s, 1)
+                """, (kpi_id, min_val, max_val, operator, bonus, popis))
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        conn.commit()
+    invalidate_threshold_cache()
+    clear_cache()
 
 # ============ DEPARTMENTS FUNCTIONS ============
 
-@st.cache_data(ttl=3600)  # Cache for 1 hour (free tier is slow)
 def get_departments():
     """Get all active departments"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, nazev, vedouci, popis, aktivni
-        FROM departments
-        WHERE aktivni = TRUE
-        ORDER BY nazev
-    """)
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['id', 'nazev', 'vedouci', 'popis', 'aktivni'])
-    return df
+    return storage.get_departments(DIALECT)
 
 def add_department(nazev, vedouci=None, popis=None):
     """Add new department"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO departments (nazev, vedouci, popis)
-            VALUES (%s, %s, %s)
-        """, (nazev, vedouci, popis))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, f"Oddělení '{nazev}' přidáno"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e)
+    return storage.add_department(DIALECT, nazev, vedouci, popis)
 
 # ============ LOCATIONS FUNCTIONS ============
 
-@st.cache_data(ttl=3600)  # Cache for 1 hour (free tier is slow)
 def get_locations():
     """Get all active locations with department info"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT
-            l.id, l.nazev, l.department_id, d.nazev as department,
-            l.popis, l.aktivni
-        FROM locations l
-        JOIN departments d ON l.department_id = d.id
-        WHERE l.aktivni = TRUE
-        ORDER BY d.nazev, l.nazev
-    """)
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['id', 'nazev', 'department_id', 'department', 'popis', 'aktivni'])
-    return df
+    return storage.get_locations(DIALECT)
 
-@st.cache_data(ttl=3600)  # Cache for 1 hour (free tier is slow)
 def get_locations_by_department(department_id):
     """Get all locations in a department"""
-    department_id = safe_convert_id(department_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, nazev, popis
-        FROM locations
-        WHERE department_id = %s AND aktivni = TRUE
-        ORDER BY nazev
-    """, (department_id,))
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    # Convert to DataFrame
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['id', 'nazev', 'popis'])
-    return df
+    return storage.get_locations_by_department(DIALECT, department_id)
 
 def add_location(nazev, department_id, popis=None):
     """Add new location"""
-    department_id = safe_convert_id(department_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO locations (nazev, department_id, popis)
-            VALUES (%s, %s, %s)
-        """, (nazev, department_id, popis))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, f"Lokalita '{nazev}' přidána"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e)
+    return storage.add_location(DIALECT, nazev, department_id, popis)
 
 def update_location_department(location_id, department_id):
     """Update location's department"""
-    location_id = safe_convert_id(location_id)
-    department_id = safe_convert_id(department_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            UPDATE locations
-            SET department_id = %s
-            WHERE id = %s
-        """, (department_id, location_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "Lokalita přeřazena"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e)
+    return storage.update_location_department(DIALECT, location_id, department_id)
 
 # ============ OPERATIONAL MANAGERS FUNCTIONS ============
 
-@st.cache_data(ttl=3600)  # Cache for 1 hour (free tier is slow)
 def get_operational_managers():
     """Get all active operational managers"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT
-            om.id, om.jmeno, om.department_id, d.nazev as department,
-            om.email, om.aktivni
-        FROM operational_managers om
-        JOIN departments d ON om.department_id = d.id
-        WHERE om.aktivni = TRUE
-        ORDER BY d.nazev, om.jmeno
-    """)
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['id', 'jmeno', 'department_id', 'department', 'email', 'aktivni'])
-    return df
+    return storage.get_operational_managers(DIALECT)
 
 def get_operational_managers_by_department(department_id):
     """Get operational managers for a department"""
-    department_id = safe_convert_id(department_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, jmeno, email
-        FROM operational_managers
-        WHERE department_id = %s AND aktivni = TRUE
-        ORDER BY jmeno
-    """, (department_id,))
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['id', 'jmeno', 'email'])
-    return df
+    return storage.get_operational_managers_by_department(DIALECT, department_id)
 
 def add_operational_manager(jmeno, department_id, email=None):
     """Add new operational manager"""
-    department_id = safe_convert_id(department_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO operational_managers (jmeno, department_id, email)
-            VALUES (%s, %s, %s)
-            RETURNING id
-        """, (jmeno, department_id, email))
-        new_id = cursor.fetchone()['id']
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, f"Provozní '{jmeno}' přidán", new_id
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e), None
+    return storage.add_operational_manager(DIALECT, jmeno, department_id, email)
 
 def get_manager_kpis(manager_id):
     """Get all KPIs assigned to a manager"""
-    manager_id = safe_convert_id(manager_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT k.id, k.nazev, k.jednotka, k.popis
-        FROM manager_kpi_assignments a
-        JOIN kpi_definitions k ON a.kpi_id = k.id
-        WHERE a.manager_id = %s AND k.aktivni = TRUE
-        ORDER BY k.poradi
-    """, (manager_id,))
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['id', 'nazev', 'jednotka', 'popis'])
-    return df
+    return storage.get_manager_kpis(DIALECT, manager_id)
 
 def set_manager_kpis(manager_id, kpi_ids):
     """Set all KPIs for a manager (replaces existing)"""
-    manager_id = safe_convert_id(manager_id)
-    kpi_ids = [safe_convert_id(k) for k in kpi_ids] if kpi_ids else []
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-
-        # Remove all existing assignments
-        cursor.execute("DELETE FROM manager_kpi_assignments WHERE manager_id = %s", (manager_id,))
-
-        # Add new assignments
-        for kpi_id in kpi_ids:
-            cursor.execute("""
-                INSERT INTO manager_kpi_assignments (manager_id, kpi_id)
-                VALUES (%s, %s)
-            """, (manager_id, kpi_id))
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, f"KPI nastavena ({len(kpi_ids)} vybraných)"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, f"Chyba: {str(e)}"
+    return storage.set_manager_kpis(DIALECT, manager_id, kpi_ids)
 
 # ============ KPI DEFINITIONS & THRESHOLDS ============
 
-@st.cache_data(ttl=3600)  # Cache for 1 hour (free tier is slow)
 def get_kpi_definitions():
     """Get all active KPI definitions"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, nazev, popis, jednotka, typ_vypoctu, poradi
-        FROM kpi_definitions
-        WHERE aktivni = TRUE
-        ORDER BY poradi
-    """)
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['id', 'nazev', 'popis', 'jednotka', 'typ_vypoctu', 'poradi'])
-    return df
+    return storage.get_kpi_definitions(DIALECT)
 
 def get_kpi_thresholds(kpi_id=None):
     """Get KPI thresholds"""
-    kpi_id = safe_convert_id(kpi_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    if kpi_id:
-        cursor.execute("""
-            SELECT t.*, k.nazev as kpi_nazev, k.jednotka
-            FROM kpi_thresholds t
-            JOIN kpi_definitions k ON t.kpi_id = k.id
-            WHERE t.kpi_id = %s
-            ORDER BY t.poradi
-        """, (kpi_id,))
-    else:
-        cursor.execute("""
-            SELECT t.*, k.nazev as kpi_nazev, k.jednotka
-            FROM kpi_thresholds t
-            JOIN kpi_definitions k ON t.kpi_id = k.id
-            ORDER BY k.poradi, t.poradi
-        """)
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['id', 'kpi_id', 'operator', 'min_hodnota', 'max_hodnota', 'bonus_procento', 'popis', 'poradi', 'kpi_nazev', 'jednotka'])
-    return df
+    return storage.get_kpi_thresholds(DIALECT, kpi_id)
+
+# ============ THRESHOLD RULE CACHE ============
+
+# Compiled threshold rules per KPI, shared by all sessions of this process.
+# Filled by one full load; threshold writers invalidate only the KPI they touched.
+_rule_cache = {}
+_rule_cache_loaded = False
+_rule_cache_stale = set()
+_rule_cache_lock = threading.Lock()
+
+def load_kpi_thresholds(cursor, kpi_ids=None):
+    """Load KPI threshold rules in one query (input for bonus_engine)"""
+    return storage.load_kpi_thresholds(cursor, DIALECT, kpi_ids)
+
+def _refresh_rule_cache(cursor):
+    """Bring the rule cache up to date (caller holds _rule_cache_lock)"""
+    global _rule_cache, _rule_cache_loaded
+    if not _rule_cache_loaded:
+        _rule_cache = bonus_engine.compile_thresholds(load_kpi_thresholds(cursor))
+        _rule_cache_loaded = True
+        _rule_cache_stale.clear()
+    elif _rule_cache_stale:
+        stale = sorted(_rule_cache_stale)
+        compiled = bonus_engine.compile_thresholds(load_kpi_thresholds(cursor, stale))
+        for kpi_id in stale:
+            if kpi_id in compiled:
+                _rule_cache[kpi_id] = compiled[kpi_id]
+            else:
+                _rule_cache.pop(kpi_id, None)
+        _rule_cache_stale.clear()
+
+def get_compiled_rules(cursor=None):
+    """Compiled threshold rules {kpi_id: CompiledRules}; hits the DB only when cold or stale"""
+    with _rule_cache_lock:
+        if _rule_cache_loaded and not _rule_cache_stale:
+            return dict(_rule_cache)
+
+    if cursor is None:
+        with connection() as conn, conn.cursor() as cursor:
+            return get_compiled_rules(cursor)
+
+    with _rule_cache_lock:
+        _refresh_rule_cache(cursor)
+        return dict(_rule_cache)
+
+def invalidate_threshold_cache(kpi_id=None):
+    """Drop compiled rules of one KPI (or all of them when kpi_id is None)"""
+    global _rule_cache_loaded
+    _reference_store.invalidate()
+    with _rule_cache_lock:
+        if kpi_id is None:
+            _rule_cache.clear()
+            _rule_cache_stale.clear()
+            _rule_cache_loaded = False
+        else:
+            _rule_cache_stale.add(int(kpi_id))
 
 def calculate_bonus_for_value(kpi_id, hodnota, cursor=None):
     """Calculate bonus percentage for a KPI value based on thresholds
 
+    Uses the compiled rule cache, so a warm lookup is a binary search without
+    any database access.
+
     Args:
         kpi_id: KPI identifier
         hodnota: KPI value to evaluate
-        cursor: Optional database cursor (if None, creates new connection)
+        cursor: Optional database cursor (used only to (re)load the rule cache)
     """
     kpi_id = safe_convert_id(kpi_id)
     if pd.isna(hodnota):
         return 0
 
-    # Use provided cursor or create new connection
-    should_close = False
-    if cursor is None:
-        conn = get_connection()
-        cursor = conn.cursor()
-        should_close = True
-
-    try:
-        cursor.execute("""
-            SELECT min_hodnota, max_hodnota, operator, bonus_procento
-            FROM kpi_thresholds
-            WHERE kpi_id = %s
-            ORDER BY poradi
-        """, (kpi_id,))
-
-        thresholds = cursor.fetchall()
-
-        if not thresholds:
-            st.warning(f"⚠️ Žádné thresholdy pro KPI ID {kpi_id}")
-            return 0
-
-        for threshold in thresholds:
-            min_val = threshold['min_hodnota']
-            max_val = threshold['max_hodnota']
-            operator = threshold['operator']
-            bonus = threshold['bonus_procento']
-
-            if operator == "≥" and min_val is not None:
-                if hodnota >= min_val:
-                    return bonus
-            elif operator == "≤" and max_val is not None:
-                if hodnota <= max_val:
-                    return bonus
-            elif operator == "<" and max_val is not None:
-                if hodnota < max_val:
-                    return bonus
-            elif operator == ">" and min_val is not None:
-                if hodnota > min_val:
-                    return bonus
-            elif operator == "mezi" and min_val is not None and max_val is not None:
-                if min_val <= hodnota <= max_val:
-                    return bonus
-
+    rules = get_compiled_rules(cursor).get(int(kpi_id))
+    if rules is None or not rules.has_rules:
+        st.warning(f"⚠️ Žádné thresholdy pro KPI ID {kpi_id}")
         return 0
-    finally:
-        if should_close:
-            cursor.close()
-            conn.close()
+
+    return rules.lookup(hodnota)
 
 # ============ MONTHLY KPI DATA FUNCTIONS ============
 
@@ -720,456 +1049,729 @@ def add_monthly_kpi_data(mesic, location_id, kpi_id, hodnota, poznamka=None, zdr
     """Add or update monthly KPI data"""
     location_id = safe_convert_id(location_id)
     kpi_id = safe_convert_id(kpi_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        # Convert to int to be safe
-        location_id = int(location_id)
-        kpi_id = int(kpi_id)
-
-        # Verify location and KPI exist
-        cursor.execute("SELECT id FROM locations WHERE id = %s AND aktivni = TRUE", (location_id,))
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return False, f"Lokalita ID {location_id} neexistuje nebo není aktivní"
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            # Convert to int to be safe
+            location_id = int(location_id)
+            kpi_id = int(kpi_id)
+
+            # Verify location and KPI exist
+            cursor.execute("SELECT id FROM locations WHERE id = %s AND aktivni = TRUE", (location_id,))
+            if not cursor.fetchone():
+                return False, f"Lokalita ID {location_id} neexistuje nebo není aktivní"
+
+            cursor.execute("SELECT id FROM kpi_definitions WHERE id = %s AND aktivni = TRUE", (kpi_id,))
+            if not cursor.fetchone():
+                return False, f"KPI ID {kpi_id} neexistuje nebo není aktivní"
+
+            storage.upsert_kpi_values(cursor, DIALECT, [(mesic, location_id, kpi_id, float(hodnota), poznamka, zdroj)])
+            enqueue_recalculation(mark_dirty(cursor, [(mesic, location_id)]), cursor, scope='DIRTY')
+            catalog_changed = refresh_month_catalog(cursor, [mesic])
+            conn.commit()
+            invalidate_cache('monthly_kpi_data', mesic)
+            if catalog_changed:
+                invalidate_cache('month_catalog', mesic)
+            wake_recalc_worker()
+            return True, "Data uložena"
+        except Exception as e:
+            return False, f"Chyba: {str(e)}"
+
+def _inactive_kpis(cursor, kpi_ids):
+    """KPI IDs from kpi_ids that do not exist or are not active (one query)"""
+    return storage.inactive_ids(cursor, DIALECT, 'kpi_definitions', kpi_ids)
+
+def add_monthly_kpi_data_bulk(mesic, location_id, values, poznamka=None, zdroj="MANUAL"):
+    """Add or update several KPI values of one location/month in one transaction
+
+    Validates the location and all KPIs once, upserts every value with a single
+    statement and evaluates bonuses for exactly those rows before committing.
+    The month's cube and department summary are refreshed by the recalculation
+    queue, so the save does not wait for them.
 
-        cursor.execute("SELECT id FROM kpi_definitions WHERE id = %s AND aktivni = TRUE", (kpi_id,))
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return False, f"KPI ID {kpi_id} neexistuje nebo není aktivní"
+    Args:
+        mesic: Month (YYYY-MM)
+        location_id: Location ID
+        values: {kpi_id: hodnota}
 
-        cursor.execute("""
-            INSERT INTO monthly_kpi_data
-            (mesic, location_id, kpi_id, hodnota, poznamka, zdroj, status, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, 'ACTIVE', CURRENT_TIMESTAMP)
-            ON CONFLICT(mesic, location_id, kpi_id)
-            DO UPDATE SET
-                hodnota = EXCLUDED.hodnota,
-                poznamka = EXCLUDED.poznamka,
-                updated_at = CURRENT_TIMESTAMP,
-                zdroj = EXCLUDED.zdroj
-        """, (mesic, location_id, kpi_id, float(hodnota), poznamka, zdroj))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "Data uložena"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, f"Chyba: {str(e)}"
+    Returns:
+        (success, message, number of evaluated records)
+    """
+    location_id = safe_convert_id(location_id)
+    values = {int(safe_convert_id(kpi_id)): float(hodnota) for kpi_id, hodnota in values.items()}
+    if not values:
+        return True, "Data uložena", 0
 
-@st.cache_data(ttl=1800)  # Cache for 30 minutes (data changes more often)
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            location_id = int(location_id)
+
+            # Verify location and KPIs exist
+            cursor.execute("SELECT id FROM locations WHERE id = %s AND aktivni = TRUE", (location_id,))
+            if not cursor.fetchone():
+                return False, f"Lokalita ID {location_id} neexistuje nebo není aktivní", 0
+
+            inactive = _inactive_kpis(cursor, values.keys())
+            if inactive:
+                return False, ", ".join(f"KPI ID {kpi_id} neexistuje nebo není aktivní" for kpi_id in inactive), 0
+
+            rows = [(mesic, location_id, kpi_id, hodnota, poznamka, zdroj) for kpi_id, hodnota in values.items()]
+            storage.upsert_kpi_values(cursor, DIALECT, rows)
+
+            data = pd.DataFrame(
+                [(location_id, kpi_id, hodnota) for kpi_id, hodnota in values.items()],
+                columns=['location_id', 'kpi_id', 'hodnota'],
+            )
+            evaluated = upsert_evaluation(cursor, mesic, data, get_compiled_rules(cursor))
+            # Cube + department summary in the background
+            enqueue_recalculation(mark_dirty(cursor, [(mesic, location_id)]), cursor, scope='DIRTY')
+            catalog_changed = refresh_month_catalog(cursor, [mesic])
+            conn.commit()
+            invalidate_cache('monthly_kpi_data', mesic)
+            invalidate_cache('monthly_kpi_evaluation', mesic)
+            if catalog_changed:
+                invalidate_cache('month_catalog', mesic)
+            wake_recalc_worker()
+            return True, "Data uložena", len(evaluated)
+        except Exception as e:
+            return False, f"Chyba: {str(e)}", 0
+
+def _monthly_kpi_data_query(mesic=None, location_id=None, kpi_id=None):
+    """SQL and params of get_monthly_kpi_data (shared with the EXPLAIN check)"""
+    return storage.monthly_kpi_data_query(mesic, location_id, kpi_id)
+
+@data_cache.cached(_data_cache, ttl=1800, tags=lambda mesic=None, location_id=None, kpi_id=None: [
+    'monthly_kpi_data', data_cache.month_tag('monthly_kpi_data', mesic), 'locations', 'kpi_definitions'])  # Cache for 30 minutes (data changes more often)
 def get_monthly_kpi_data(mesic=None, location_id=None, kpi_id=None):
     """Get monthly KPI data with filters"""
     location_id = safe_convert_id(location_id)
     kpi_id = safe_convert_id(kpi_id)
-    conn = get_connection()
-
-    query = """
-        SELECT
-            d.id, d.mesic, d.location_id, l.nazev as location,
-            d.kpi_id, k.nazev as kpi_nazev, k.jednotka,
-            d.hodnota, d.status, d.poznamka, d.zdroj,
-            d.created_at, d.updated_at
-        FROM monthly_kpi_data d
-        JOIN locations l ON d.location_id = l.id
-        JOIN kpi_definitions k ON d.kpi_id = k.id
-        WHERE d.status = 'ACTIVE'
-    """
-
-    params = []
-    if mesic:
-        query += " AND d.mesic = %s"
-        params.append(mesic)
-    if location_id:
-        query += " AND d.location_id = %s"
-        params.append(location_id)
-    if kpi_id:
-        query += " AND d.kpi_id = %s"
-        params.append(kpi_id)
-
-    query += " ORDER BY d.mesic DESC, l.nazev, k.poradi"
-
-    cursor = conn.cursor()
-    cursor.execute(query, tuple(params))
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['id', 'mesic', 'location_id', 'location', 'kpi_id', 'kpi_nazev', 'jednotka', 'hodnota', 'status', 'poznamka', 'zdroj', 'created_at', 'updated_at'])
-    return df
+    with connection() as conn, conn.cursor() as cursor:
+        return storage.fetch_monthly_kpi_data(cursor, DIALECT, mesic, location_id, kpi_id)
 
 def get_monthly_kpi_by_location_month(mesic, location_id):
-    """Get all KPI data for a location in a month"""
-    location_id = safe_convert_id(location_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT
-            d.kpi_id, k.nazev, k.jednotka, k.poradi,
-            d.hodnota, d.poznamka
-        FROM monthly_kpi_data d
-        JOIN kpi_definitions k ON d.kpi_id = k.id
-        WHERE d.mesic = %s AND d.location_id = %s AND d.status = 'ACTIVE'
-        ORDER BY k.poradi
-    """, (mesic, location_id))
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['kpi_id', 'nazev', 'jednotka', 'poradi', 'hodnota', 'poznamka'])
-    return df
-
-def delete_monthly_kpi_data(mesic, location_id):
-    """Delete all KPI data for a location in a month"""
-    location_id = safe_convert_id(location_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        # Delete from monthly_kpi_data
-        cursor.execute("""
-            DELETE FROM monthly_kpi_data
-            WHERE mesic = %s AND location_id = %s
-        """, (mesic, location_id))
-
-        # Also delete evaluation data
-        cursor.execute("""
-            DELETE FROM monthly_kpi_evaluation
-            WHERE mesic = %s AND location_id = %s
-        """, (mesic, location_id))
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "Data smazána"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, f"Chyba při mazání: {str(e)}"
-
-# ============ MONTHLY EVALUATION & BONUS CALCULATION ============
-
-def calculate_monthly_kpi_evaluation(mesic, location_id=None, verbose=False):
-    """Calculate KPI evaluation and bonuses for a month
-
-    Args:
-        mesic: Month to calculate for
-        location_id: Optional specific location ID
-        verbose: If True, show detailed progress messages
-    """
-    import traceback
-    try:
-        if verbose:
-            st.info(f"🔄 Výpočet bonusů pro {mesic}" + (f" (lokalita {location_id})" if location_id else ""))
-
-        location_id = safe_convert_id(location_id)
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        if location_id:
-            cursor.execute("""
-                SELECT d.location_id, d.kpi_id, d.hodnota
-                FROM monthly_kpi_data d
-                WHERE d.mesic = %s AND d.location_id = %s AND d.status = 'ACTIVE'
-            """, (mesic, location_id))
-        else:
-            cursor.execute("""
-                SELECT d.location_id, d.kpi_id, d.hodnota
-                FROM monthly_kpi_data d
-                WHERE d.mesic = %s AND d.status = 'ACTIVE'
-            """, (mesic,))
-
-        evaluations = cursor.fetchall()
-
-        if not evaluations:
-            cursor.close()
-            conn.close()
-            return 0  # No data to process
-
-        processed = 0
-        errors = []
-        for idx, row in enumerate(evaluations):
-            try:
-                loc_id, kpi_id, value = row['location_id'], row['kpi_id'], row['hodnota']
-
-                # Pass cursor to avoid creating new connections
-                bonus = calculate_bonus_for_value(kpi_id, value, cursor)
-                splneno = 1 if bonus > 0 else 0
-
-                cursor.execute("""
-                    INSERT INTO monthly_kpi_evaluation
-                    (mesic, location_id, kpi_id, hodnota, splneno, bonus_procento, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT(mesic, location_id, kpi_id)
-                    DO UPDATE SET
-                        hodnota = EXCLUDED.hodnota,
-                        splneno = EXCLUDED.splneno,
-                        bonus_procento = EXCLUDED.bonus_procento,
-                        updated_at = CURRENT_TIMESTAMP
-                """, (mesic, loc_id, kpi_id, value, splneno, bonus))
-                processed += 1
-            except Exception as e:
-                error_msg = f"Chyba při zpracování záznamu {idx+1}: {str(e)}"
-                errors.append(error_msg)
-                if verbose:
-                    st.error(error_msg)
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-
-        if errors and verbose:
-            st.warning(f"⚠️ Dokončeno s {len(errors)} chybami")
-
-        return processed
-    except Exception as e:
-        error_trace = traceback.format_exc()
-        if verbose:
-            st.error(f"❌ Chyba při výpočtu bonusů: {str(e)}")
-            st.code(error_trace)
-        if 'conn' in locals():
-            try:
-                conn.close()
-            except:
-                pass
-        return 0
-
-@st.cache_data(ttl=1800)  # Cache for 30 minutes (this changes more often)
-def get_monthly_kpi_evaluation(mesic, location_id=None):
-    """Get KPI evaluation for a month"""
-    location_id = safe_convert_id(location_id)
-    conn = get_connection()
-
-    query = """
-        SELECT
-            e.mesic, e.location_id, l.nazev as location,
-            e.kpi_id, k.nazev as kpi_nazev, k.jednotka,
-            e.hodnota, e.splneno, e.bonus_procento
-        FROM monthly_kpi_evaluation e
-        LEFT JOIN locations l ON e.location_id = l.id
-        LEFT JOIN kpi_definitions k ON e.kpi_id = k.id
-        WHERE e.mesic = %s
-    """
-
-    params = [mesic]
-    if location_id:
-        query += " AND e.location_id = %s"
-        params.append(location_id)
-
-    query += " ORDER BY l.nazev, k.poradi"
-
-    cursor = conn.cursor()
-
-
-    cursor.execute(query, tuple(params) if params else ())
-
-
-    results = cursor.fetchall()
-
-
-    cursor.close()
+    """Get all KPI data for a location in a month"""
+    location_id = safe_convert_id(location_id)
+    with connection() as conn, conn.cursor() as cursor:
+        return storage.fetch_kpi_by_location_month(cursor, DIALECT, mesic, location_id)
 
+def delete_monthly_kpi_data(mesic, location_id):
+    """Delete all KPI data for a location in a month"""
+    location_id = safe_convert_id(location_id)
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            # KPI data and their evaluation
+            storage.delete_kpi_values(cursor, DIALECT, mesic, location_id)
+            # Cube + department summary in the background
+            enqueue_recalculation(mark_dirty(cursor, [(mesic, location_id)]), cursor, scope='DIRTY')
+            catalog_changed = refresh_month_catalog(cursor, [mesic])
+
+            conn.commit()
+            invalidate_cache('monthly_kpi_data', mesic)
+            invalidate_cache('monthly_kpi_evaluation', mesic)
+            if catalog_changed:
+                invalidate_cache('month_catalog', mesic)
+            wake_recalc_worker()
+            return True, "Data smazána"
+        except Exception as e:
+            return False, f"Chyba při mazání: {str(e)}"
 
-    conn.close()
+# ============ MONTHLY EVALUATION & BONUS CALCULATION ============
 
+def evaluate_month(cursor, mesic, rules, location_id=None, location_ids=None):
+    """Evaluate one month set-based and bulk upsert monthly_kpi_evaluation
 
-    
+    Runs on the caller's cursor/transaction (no commit). Returns the frame of
+    evaluated rows (location_id, kpi_id, hodnota, splneno, bonus_procento).
+    location_id or location_ids limit the evaluation to some locations.
+    """
+    if location_id:
+        location_ids = [location_id]
+    return storage.evaluate_month(cursor, DIALECT, mesic, rules, location_ids)
 
+def upsert_evaluation(cursor, mesic, data, rules):
+    """Evaluate the given (location_id, kpi_id, hodnota) rows and bulk upsert them (no commit)"""
+    return storage.upsert_evaluation(cursor, DIALECT, mesic, data, rules)
 
-    if results:
+def calculate_monthly_kpi_evaluation(mesic, location_id=None, verbose=False):
+    """Calculate KPI evaluation and bonuses for a month
 
+    Uses the compiled threshold rules, the whole month is evaluated vectorized
+    and written back with a single bulk upsert.
 
-        df = pd.DataFrame(results)
+    Args:
+        mesic: Month to calculate for
+        location_id: Optional specific location ID
+        verbose: If True, show detailed progress messages
+    """
+    import traceback
+    try:
+        if verbose:
+            st.info(f"🔄 Výpočet bonusů pro {mesic}" + (f" (lokalita {location_id})" if location_id else ""))
 
+        location_id = safe_convert_id(location_id)
+        with connection() as conn, conn.cursor() as cursor:
+            rules = get_compiled_rules(cursor)
+            evaluated = evaluate_month(cursor, mesic, rules, location_id)
+            refresh_kpi_cube(cursor, [mesic])
+            conn.commit()
+        invalidate_cache('monthly_kpi_evaluation', mesic)
+        invalidate_cache('monthly_kpi_cube', mesic)
+
+        if evaluated.empty:
+            return 0  # No data to process
 
-    else:
+        for kpi_id in bonus_engine.kpis_without_thresholds(evaluated['kpi_id'].unique(), rules):
+            st.warning(f"⚠️ Žádné thresholdy pro KPI ID {kpi_id}")
 
+        return len(evaluated)
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        if verbose:
+            st.error(f"❌ Chyba při výpočtu bonusů: {str(e)}")
+            st.code(error_trace)
+        return 0
 
-        df = pd.DataFrame()
+def recalculate_month(cursor, mesic, rules):
+    """Evaluation, cube and department summary of one month
 
+    Runs on the caller's cursor/transaction (no commit), so every month can be
+    committed on its own. Clears the month's dirty marks. Returns the number
+    of evaluated records.
+    """
+    cursor.execute("DELETE FROM recalc_dirty WHERE mesic = %s", (mesic,))
+    evaluated = evaluate_month(cursor, mesic, rules)
+    refresh_kpi_cube(cursor, [mesic])
+    summarize_departments(cursor, [mesic], rules=rules)
+    return len(evaluated)
+
+# ============ DIRTY TRACKING ============
+
+# recalc_dirty holds the (month, location) pairs whose data or thresholds
+# changed after their last evaluation. Writers mark pairs in their own
+# transaction and queue a DIRTY job for the month; the job evaluates only
+# those locations and clears them in the same transaction.
+DIRTY_SEED_SQL = """
+    INSERT INTO recalc_dirty (mesic, location_id)
+    SELECT DISTINCT d.mesic, d.location_id
+    FROM monthly_kpi_data d
+    LEFT JOIN monthly_kpi_evaluation e
+        ON e.mesic = d.mesic AND e.location_id = d.location_id AND e.kpi_id = d.kpi_id
+    WHERE d.status = 'ACTIVE' AND (e.id IS NULL OR e.hodnota IS DISTINCT FROM d.hodnota)
+    ON CONFLICT DO NOTHING
+"""
 
-    return df
+def mark_dirty(cursor, pairs):
+    """Mark (mesic, location_id) pairs for re-evaluation; returns their months
 
-def get_department_monthly_summary(mesic=None, department_id=None):
-    """Get department monthly KPI summary"""
-    department_id = safe_convert_id(department_id)
-    conn = get_connection()
-
-    query = """
-        SELECT
-            s.mesic, s.department_id, d.nazev as department,
-            s.celkovy_bonus, s.aktivnich_kpi, s.splnenych_kpi
-        FROM department_monthly_summary s
-        JOIN departments d ON s.department_id = d.id
-        WHERE 1=1
+    Runs on the caller's cursor/transaction (no commit).
     """
+    pairs = sorted({(str(mesic), int(location_id)) for mesic, location_id in pairs})
+    if not pairs:
+        return []
+    cursor.execute("""
+        INSERT INTO recalc_dirty (mesic, location_id)
+        SELECT * FROM unnest(%s::text[], %s::int[])
+        ON CONFLICT DO NOTHING
+    """, ([mesic for mesic, _ in pairs], [location_id for _, location_id in pairs]))
+    return sorted({mesic for mesic, _ in pairs})
 
-    params = []
-    if mesic:
-        query += " AND s.mesic = %s"
-        params.append(mesic)
-    if department_id:
-        query += " AND s.department_id = %s"
-        params.append(department_id)
+def mark_kpi_dirty(cursor, kpi_id):
+    """Mark every (month, location) holding data of a KPI (threshold edits)
 
-    query += " ORDER BY s.mesic DESC, d.nazev"
+    Returns the affected months, including months where only department
+    own-KPI data use the KPI (their summaries depend on the thresholds too).
+    """
+    cursor.execute("""
+        WITH pairs AS (
+            SELECT DISTINCT mesic, location_id
+            FROM monthly_kpi_data
+            WHERE kpi_id = %s AND status = 'ACTIVE'
+        ), marked AS (
+            INSERT INTO recalc_dirty (mesic, location_id)
+            SELECT mesic, location_id FROM pairs
+            ON CONFLICT DO NOTHING
+        )
+        SELECT mesic FROM pairs
+        UNION
+        SELECT mesic FROM monthly_department_kpi_data WHERE kpi_id = %s AND status = 'ACTIVE'
+    """, (int(kpi_id), int(kpi_id)))
+    return sorted(row['mesic'] for row in cursor.fetchall())
+
+def recalculate_dirty_month(cursor, mesic, rules):
+    """Evaluate only the dirty locations of one month, then its cube and department summary
+
+    Evaluation rows without active data are removed for those locations. Runs
+    on the caller's cursor/transaction (no commit); the dirty marks are
+    cleared by the same transaction. Returns the number of evaluated records.
+    """
+    cursor.execute("DELETE FROM recalc_dirty WHERE mesic = %s RETURNING location_id", (mesic,))
+    location_ids = sorted(row['location_id'] for row in cursor.fetchall())
+    evaluated = 0
+    if location_ids:
+        cursor.execute("""
+            DELETE FROM monthly_kpi_evaluation e
+            WHERE e.mesic = %s AND e.location_id = ANY(%s)
+              AND NOT EXISTS (
+                  SELECT 1 FROM monthly_kpi_data d
+                  WHERE d.mesic = e.mesic AND d.location_id = e.location_id
+                    AND d.kpi_id = e.kpi_id AND d.status = 'ACTIVE'
+              )
+        """, (mesic, location_ids))
+        evaluated = len(evaluate_month(cursor, mesic, rules, location_ids=location_ids))
+        refresh_kpi_cube(cursor, [mesic])
+    summarize_departments(cursor, [mesic], rules=rules)
+    return evaluated
+
+def get_dirty_months():
+    """Months with dirty locations: DataFrame mesic, locations, oldest mark"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT mesic, COUNT(*) AS locations, MIN(marked_at) AS marked_at
+            FROM recalc_dirty
+            GROUP BY mesic
+            ORDER BY mesic DESC
+        """)
+        results = cursor.fetchall()
+    return pd.DataFrame(results, columns=['mesic', 'locations', 'marked_at'])
 
-    cursor = conn.cursor()
+def recalculate_dirty(max_workers=1, progress=None):
+    """Re-evaluate only the dirty (month, location) pairs; returns {mesic: evaluated records}"""
+    return recalculate_months(get_dirty_months()['mesic'].tolist(), max_workers, progress, dirty_only=True)
 
+def recalculate_months(months, max_workers=1, progress=None, dirty_only=False):
+    """Recalculate KPI evaluation, cube and department summaries for several months
 
-    cursor.execute(query, tuple(params) if params else ())
+    Threshold rules are taken once for all months; each month runs in its own
+    transaction on a pooled connection. With max_workers > 1 the months are
+    spread over a thread pool (capped so that page reads still find a free
+    connection). Returns dict {mesic: number of evaluated records}.
 
+    Args:
+        months: months to recalculate
+        max_workers: number of months recalculated at the same time
+        progress: optional callback(done, total, mesic, processed, seconds) after each month
+        dirty_only: evaluate only the dirty locations of each month
+    """
+    months = list(dict.fromkeys(months))
+    rules = get_compiled_rules()
+    recalculate_unit = recalculate_dirty_month if dirty_only else recalculate_month
+
+    def recalculate(mesic):
+        started = time.perf_counter()
+        with connection() as conn, conn.cursor() as cursor:
+            processed = recalculate_unit(cursor, mesic, rules)
+            conn.commit()
+        invalidate_cache('monthly_kpi_evaluation', mesic)
+        invalidate_cache('monthly_kpi_cube', mesic)
+        return processed, time.perf_counter() - started
+
+    processed = {}
+    max_workers = max(1, min(int(max_workers), len(months), get_pool().max_size - 1))
+    if max_workers == 1:
+        for mesic in months:
+            processed[mesic], seconds = recalculate(mesic)
+            if progress:
+                progress(len(processed), len(months), mesic, processed[mesic], seconds)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recalc") as executor:
+            futures = {executor.submit(recalculate, mesic): mesic for mesic in months}
+            for future in as_completed(futures):
+                mesic = futures[future]
+                processed[mesic], seconds = future.result()
+                if progress:
+                    progress(len(processed), len(months), mesic, processed[mesic], seconds)
+    return {mesic: processed[mesic] for mesic in months}
+
+# ============ RECALCULATION QUEUE ============
+
+# Month recalculations (evaluation + cube + department summary) run in a
+# background worker instead of the Streamlit script thread. recalc_jobs holds
+# at most one PENDING job per month, so repeated saves of the same month
+# coalesce; workers of all app processes claim jobs with SKIP LOCKED.
+RECALC_JOB_COLUMNS = ['id', 'mesic', 'status', 'scope', 'requests', 'attempts', 'processed', 'message',
+                      'requested_at', 'started_at', 'finished_at', 'duration_s']
+RECALC_STALE_MINUTES = 15  # RUNNING longer than this = the worker died, the month is queued again
+RECALC_KEEP_DAYS = 7  # finished jobs are kept this long for the status display
+
+def enqueue_recalculation(months, cursor=None, scope='FULL'):
+    """Queue a recalculation of the given months; returns the job ids
+
+    scope 'FULL' recalculates whole months, 'DIRTY' only their dirty
+    locations. A month that already has a waiting job reuses it (a FULL
+    request widens a waiting DIRTY job). With cursor the jobs are added to the
+    caller's transaction (the caller commits and calls wake_recalc_worker()).
+    """
+    months = sorted({str(m) for m in months if m})
+    if not months:
+        return []
+    if cursor is None:
+        with connection() as conn, conn.cursor() as cursor:
+            job_ids = enqueue_recalculation(months, cursor, scope)
+            conn.commit()
+        wake_recalc_worker()
+        return job_ids
 
-    results = cursor.fetchall()
+    cursor.execute("""
+        INSERT INTO recalc_jobs (mesic, scope)
+        SELECT unnest(%s::text[]), %s
+        ON CONFLICT (mesic) WHERE status = 'PENDING'
+        DO UPDATE SET
+            requests = recalc_jobs.requests + 1,
+            scope = CASE WHEN EXCLUDED.scope = 'FULL' THEN 'FULL' ELSE recalc_jobs.scope END
+        RETURNING id
+    """, (months, scope))
+    return [row['id'] for row in cursor.fetchall()]
+
+def _claim_recalc_job():
+    """Take the oldest waiting job whose month is not being recalculated right now"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE recalc_jobs
+            SET status = 'RUNNING', started_at = CURRENT_TIMESTAMP, attempts = attempts + 1, worker = %s
+            WHERE id = (
+                SELECT j.id
+                FROM recalc_jobs j
+                WHERE j.status = 'PENDING'
+                  AND NOT EXISTS (SELECT 1 FROM recalc_jobs r WHERE r.mesic = j.mesic AND r.status = 'RUNNING')
+                ORDER BY j.requested_at, j.id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, mesic, scope
+        """, (PROCESS_ORIGIN,))
+        job = cursor.fetchone()
+        conn.commit()
+    return dict(job) if job else None
 
+def run_recalc_job(job):
+    """Recalculate one month and mark its job DONE in the same transaction (FAILED on error)"""
+    mesic = job['mesic']
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            # Serializes runs of the same month across workers
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"recalc:{mesic}",))
+            # Rules read in this transaction: a threshold edit on another
+            # instance may not have reached this process' rule cache yet
+            rules = bonus_engine.compile_thresholds(load_kpi_thresholds(cursor))
+            if job.get('scope') == 'DIRTY':
+                processed = recalculate_dirty_month(cursor, mesic, rules)
+            else:
+                processed = recalculate_month(cursor, mesic, rules)
+            # clock_timestamp(): CURRENT_TIMESTAMP would be the start of this transaction
+            cursor.execute("""
+                UPDATE recalc_jobs
+                SET status = 'DONE', processed = %s, finished_at = clock_timestamp()
+                WHERE id = %s
+            """, (processed, job['id']))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            cursor.execute("""
+                UPDATE recalc_jobs
+                SET status = 'FAILED', message = %s, finished_at = clock_timestamp()
+                WHERE id = %s
+            """, (str(e)[:500], job['id']))
+            conn.commit()
+            raise
+    invalidate_cache('monthly_kpi_evaluation', mesic)
+    invalidate_cache('monthly_kpi_cube', mesic)
+
+def _recalc_housekeeping():
+    """Requeue months of jobs abandoned by a dead worker, drop old finished jobs"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            WITH stale AS (
+                UPDATE recalc_jobs
+                SET status = 'FAILED', message = 'Přepočet přerušen - měsíc zařazen znovu', finished_at = CURRENT_TIMESTAMP
+                WHERE status = 'RUNNING' AND started_at < CURRENT_TIMESTAMP - make_interval(mins => %s)
+                RETURNING mesic
+            )
+            INSERT INTO recalc_jobs (mesic)
+            SELECT DISTINCT mesic FROM stale
+            ON CONFLICT (mesic) WHERE status = 'PENDING' DO NOTHING
+        """, (RECALC_STALE_MINUTES,))
+        cursor.execute("""
+            DELETE FROM recalc_jobs
+            WHERE status IN ('DONE', 'FAILED') AND finished_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+        """, (RECALC_KEEP_DAYS,))
+        conn.commit()
 
-    cursor.close()
+_recalc_worker = job_queue.JobWorker(_claim_recalc_job, run_recalc_job, _recalc_housekeeping, name="recalc-worker")
 
+def get_recalc_concurrency():
+    """Months recalculated in parallel by one process ([database] recalc_concurrency, default 2)
 
-    conn.close()
+    Capped one below pool_max_size so that page reads always find a connection.
+    """
+    config = st.secrets["database"]
+    return max(1, min(int(config.get("recalc_concurrency", 2)), int(config.get("pool_max_size", 10)) - 1))
 
+def start_recalc_worker():
+    """Start the background recalculation worker of this process
 
-    
+    Disabled with recalc_worker = false in the [database] section, e.g. when
+    a dedicated process runs run_recalc_worker() instead.
+    """
+    if not st.secrets["database"].get("recalc_worker", True):
+        return False
+    _recalc_worker.concurrency = get_recalc_concurrency()
+    return _recalc_worker.start()
+
+def run_recalc_worker():
+    """Run the recalculation worker in the foreground (dedicated worker process)"""
+    _recalc_worker.concurrency = get_recalc_concurrency()
+    _recalc_worker.start()
+    try:
+        while _recalc_worker.stats()['running']:
+            time.sleep(1)
+    finally:
+        _recalc_worker.stop()
+
+def wake_recalc_worker():
+    _recalc_worker.wake()
+
+def process_recalc_queue(workers=1):
+    """Run waiting jobs in the calling thread (workers > 1: that many threads); returns the number of jobs run"""
+    if workers <= 1:
+        return _recalc_worker.run_pending()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="recalc") as executor:
+        return sum(executor.map(lambda _: _recalc_worker.run_pending(), range(workers)))
+
+def get_recalc_status(months):
+    """Latest job of each given month (months that were never queued are left out)"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT DISTINCT ON (mesic) {', '.join(RECALC_JOB_COLUMNS[:-1])},
+                EXTRACT(EPOCH FROM finished_at - started_at)::float AS duration_s
+            FROM recalc_jobs
+            WHERE mesic = ANY(%s)
+            ORDER BY mesic, id DESC
+        """, (list(months),))
+        results = cursor.fetchall()
+    return pd.DataFrame(results, columns=RECALC_JOB_COLUMNS)
+
+def get_recalc_queue_stats():
+    """Queue counts by status plus worker statistics (for the Admin Debug tab)"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT status, COUNT(*) AS count FROM recalc_jobs GROUP BY status")
+        counts = {row['status']: row['count'] for row in cursor.fetchall()}
+    stats = {status: counts.get(status, 0) for status in ['PENDING', 'RUNNING', 'DONE', 'FAILED']}
+    stats['worker'] = _recalc_worker.stats()
+    return stats
+
+@data_cache.cached(_data_cache, ttl=1800, tags=lambda mesic, location_id=None: [
+    'monthly_kpi_evaluation', data_cache.month_tag('monthly_kpi_evaluation', mesic), 'locations', 'kpi_definitions'])  # Cache for 30 minutes (this changes more often)
+def get_monthly_kpi_evaluation(mesic, location_id=None):
+    """Get KPI evaluation for a month"""
+    location_id = safe_convert_id(location_id)
+    with connection() as conn, conn.cursor() as cursor:
+        return storage.fetch_kpi_evaluation(cursor, DIALECT, mesic, location_id)
 
+EVALUATION_RANGE_COLUMNS = storage.EVALUATION_RANGE_COLUMNS
 
-    if results:
+@data_cache.cached(_data_cache, ttl=1800, tags=lambda start_mesic, end_mesic, location_ids, kpi_ids: [
+    'monthly_kpi_evaluation', data_cache.month_tag('monthly_kpi_evaluation'), 'locations', 'kpi_definitions'])  # Cache for 30 minutes (this changes more often)
+def _kpi_evaluation_range(start_mesic, end_mesic, location_ids, kpi_ids):
+    # ID filters arrive as tuples (hashable cache key)
+    with connection() as conn, conn.cursor() as cursor:
+        return storage.fetch_kpi_evaluation_range(cursor, DIALECT, start_mesic, end_mesic, location_ids, kpi_ids)
 
+def get_kpi_evaluation_range(start_mesic, end_mesic, location_ids=None, kpi_ids=None, pivot=False):
+    """Get KPI evaluation for all months from start_mesic to end_mesic (inclusive) in one query
 
-        df = pd.DataFrame(results)
+    Args:
+        start_mesic: First month (YYYY-MM)
+        end_mesic: Last month (YYYY-MM)
+        location_ids: Optional list of location IDs
+        kpi_ids: Optional list of KPI IDs
+        pivot: If True, return one row per month with (value, location_id, kpi_id)
+            MultiIndex columns for hodnota, splneno and bonus_procento
+
+    Returns:
+        Long-format DataFrame (one row per month, location and KPI) or the pivoted frame
+    """
+    location_ids = [int(safe_convert_id(i)) for i in location_ids] if location_ids is not None else None
+    kpi_ids = [int(safe_convert_id(i)) for i in kpi_ids] if kpi_ids is not None else None
+    df = _kpi_evaluation_range(
+        start_mesic, end_mesic,
+        tuple(location_ids) if location_ids is not None else None,
+        tuple(kpi_ids) if kpi_ids is not None else None,
+    )
+    if pivot:
+        return storage.pivot_kpi_evaluation_range(df)
+    return df
 
+# ============ KPI CUBE (materialized month aggregates) ============
+
+# One row per month x manager at three levels (uroven):
+#   'kpi'      - manager x location x KPI (hodnota, splneno and bonus of the evaluation row)
+#   'location' - manager x location totals
+#   'manager'  - manager totals; avg_bonus = bonus_sum / all active locations of the department
+# Managers see every active location of their department, like on the dashboard pages.
+KPI_CUBE_REFRESH_SQL = """
+    INSERT INTO monthly_kpi_cube
+    (mesic, uroven, department_id, manager_id, location_id, kpi_id, hodnota,
+     bonus_sum, kpi_count, met_count, locations_with_data, location_count, avg_bonus)
+    SELECT
+        m.mesic,
+        CASE GROUPING(l.id, e.kpi_id) WHEN 0 THEN 'kpi' WHEN 1 THEN 'location' ELSE 'manager' END,
+        om.department_id,
+        om.id,
+        CASE WHEN GROUPING(l.id) = 0 THEN l.id END,
+        e.kpi_id,
+        AVG(e.hodnota),
+        COALESCE(SUM(e.bonus_procento), 0),
+        COUNT(e.kpi_id),
+        COALESCE(SUM(e.splneno), 0),
+        COUNT(DISTINCT e.location_id),
+        COUNT(DISTINCT l.id),
+        COALESCE(SUM(e.bonus_procento), 0) / COUNT(DISTINCT l.id)
+    FROM unnest(%s::text[]) AS m(mesic)
+    CROSS JOIN operational_managers om
+    JOIN locations l ON l.department_id = om.department_id AND l.aktivni = TRUE
+    LEFT JOIN monthly_kpi_evaluation e ON e.mesic = m.mesic AND e.location_id = l.id
+    WHERE om.aktivni = TRUE
+      AND (%s::int[] IS NULL OR om.department_id = ANY(%s::int[]))
+    GROUP BY GROUPING SETS (
+        (m.mesic, om.department_id, om.id, l.id, e.kpi_id),
+        (m.mesic, om.department_id, om.id, l.id),
+        (m.mesic, om.department_id, om.id)
+    )
+    HAVING GROUPING(e.kpi_id) = 1 OR e.kpi_id IS NOT NULL
+"""
 
-    else:
+def refresh_kpi_cube(cursor, months=None, department_ids=None):
+    """Rebuild the cube rows of the given months (None = every month in the cube or evaluation)
 
+    department_ids limits the rebuild to those departments (reference data
+    changes touch only the department of the location/manager).
+    Runs on the caller's cursor/transaction (no commit); callers invalidate
+    the 'monthly_kpi_cube' cache after committing.
+    """
+    if months is None:
+        cursor.execute("""
+            SELECT mesic FROM monthly_kpi_evaluation
+            UNION
+            SELECT mesic FROM monthly_kpi_cube
+        """)
+        months = [row['mesic'] for row in cursor.fetchall()]
+    months = sorted(set(months))
+    if not months:
+        return
+    if department_ids is not None:
+        department_ids = sorted({int(department_id) for department_id in department_ids if department_id is not None})
+    cursor.execute("""
+        DELETE FROM monthly_kpi_cube
+        WHERE mesic = ANY(%s) AND (%s::int[] IS NULL OR department_id = ANY(%s::int[]))
+    """, (months, department_ids, department_ids))
+    cursor.execute(KPI_CUBE_REFRESH_SQL, (months, department_ids, department_ids))
+
+KPI_CUBE_MANAGER_SQL = """
+    SELECT
+        c.manager_id, om.jmeno, c.department_id, d.nazev as department,
+        c.bonus_sum as total_bonus, c.kpi_count as total_kpis, c.met_count as met_kpis,
+        c.locations_with_data, c.location_count, c.avg_bonus
+    FROM monthly_kpi_cube c
+    JOIN operational_managers om ON c.manager_id = om.id
+    JOIN departments d ON c.department_id = d.id
+    WHERE c.mesic = %s AND c.uroven = 'manager'
+    ORDER BY d.nazev, om.jmeno
+"""
 
-        df = pd.DataFrame()
+KPI_CUBE_DETAIL_SQL = """
+    SELECT
+        c.manager_id, om.jmeno, c.department_id, c.location_id, l.nazev as location,
+        c.kpi_id, k.nazev as kpi_nazev, k.jednotka,
+        c.hodnota, c.met_count as splneno, c.bonus_sum as bonus_procento
+    FROM monthly_kpi_cube c
+    JOIN operational_managers om ON c.manager_id = om.id
+    JOIN departments d ON c.department_id = d.id
+    JOIN locations l ON c.location_id = l.id
+    LEFT JOIN kpi_definitions k ON c.kpi_id = k.id
+    WHERE c.mesic = %s AND c.uroven = 'kpi'
+    ORDER BY d.nazev, om.jmeno, l.nazev, k.poradi
+"""
 
+KPI_CUBE_MANAGER_COLUMNS = ['manager_id', 'jmeno', 'department_id', 'department', 'total_bonus', 'total_kpis',
+                            'met_kpis', 'locations_with_data', 'location_count', 'avg_bonus']
+KPI_CUBE_DETAIL_COLUMNS = ['manager_id', 'jmeno', 'department_id', 'location_id', 'location', 'kpi_id',
+                           'kpi_nazev', 'jednotka', 'hodnota', 'splneno', 'bonus_procento']
+
+@data_cache.cached(_data_cache, ttl=1800, tags=lambda mesic: [
+    'monthly_kpi_cube', data_cache.month_tag('monthly_kpi_cube', mesic), 'operational_managers', 'departments'])  # Cache for 30 minutes (this changes more often)
+def get_manager_kpi_summary(mesic):
+    """Bonus/KPI totals per active manager for a month (📊 Přehled cards, 👥 Porovnání)"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(KPI_CUBE_MANAGER_SQL, (mesic,))
+        results = cursor.fetchall()
+    return pd.DataFrame(results, columns=KPI_CUBE_MANAGER_COLUMNS)
+
+@data_cache.cached(_data_cache, ttl=1800, tags=lambda mesic: [
+    'monthly_kpi_cube', data_cache.month_tag('monthly_kpi_cube', mesic), 'operational_managers', 'locations', 'kpi_definitions'])  # Cache for 30 minutes (this changes more often)
+def get_manager_kpi_details(mesic):
+    """Evaluated KPIs per manager and location for a month (📈 Detail, KPI tables)"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(KPI_CUBE_DETAIL_SQL, (mesic,))
+        results = cursor.fetchall()
+    return pd.DataFrame(results, columns=KPI_CUBE_DETAIL_COLUMNS)
 
-    return df
+def get_department_monthly_summary(mesic=None, department_id=None):
+    """Get department monthly KPI summary"""
+    return storage.get_department_monthly_summary(DIALECT, mesic, department_id)
 
 def calculate_monthly_department_kpi_evaluation(mesic, department_id=None):
     """Calculate KPI evaluation and bonuses for departments with own KPI"""
     department_id = safe_convert_id(department_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    if department_id:
-        cursor.execute("""
-            SELECT d.department_id, d.kpi_id, d.hodnota
-            FROM monthly_department_kpi_data d
-            WHERE d.mesic = %s AND d.department_id = %s AND d.status = 'ACTIVE'
-        """, (mesic, department_id))
-    else:
-        cursor.execute("""
-            SELECT d.department_id, d.kpi_id, d.hodnota
-            FROM monthly_department_kpi_data d
-            WHERE d.mesic = %s AND d.status = 'ACTIVE'
-        """, (mesic,))
-
-    evaluations = cursor.fetchall()
-
-    for row in evaluations:
-        dept_id, kpi_id, value = row['department_id'], row['kpi_id'], row['hodnota']
-        bonus = calculate_bonus_for_value(kpi_id, value)
-        splneno = 1 if bonus > 0 else 0
-
-        # Store evaluation in department_monthly_summary or create separate table if needed
-        # For now, we'll calculate summary directly
-
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def calculate_department_summary(mesic):
-    """Calculate department monthly summary - handles both own KPI and location averages"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT id, ma_vlastni_kpi FROM departments WHERE aktivni = TRUE")
-    departments = cursor.fetchall()
-
-    for dept_row in departments:
-        dept_id = dept_row['id']
-        ma_vlastni_kpi = dept_row['ma_vlastni_kpi']
-
-        if ma_vlastni_kpi:
-            # Department has own KPI - calculate from monthly_department_kpi_data
+    with connection() as conn, conn.cursor() as cursor:
+        if department_id:
             cursor.execute("""
-                SELECT d.kpi_id, d.hodnota
+                SELECT d.department_id, d.kpi_id, d.hodnota
                 FROM monthly_department_kpi_data d
                 WHERE d.mesic = %s AND d.department_id = %s AND d.status = 'ACTIVE'
-            """, (mesic, dept_id))
+            """, (mesic, department_id))
+        else:
+            cursor.execute("""
+                SELECT d.department_id, d.kpi_id, d.hodnota
+                FROM monthly_department_kpi_data d
+                WHERE d.mesic = %s AND d.status = 'ACTIVE'
+            """, (mesic,))
 
-            kpi_data = cursor.fetchall()
-            total_bonus = 0
-            total_active = len(kpi_data)
-            total_met = 0
+        evaluations = cursor.fetchall()
 
-            for kpi_row in kpi_data:
-                kpi_id = kpi_row['kpi_id']
-                hodnota = kpi_row['hodnota']
-                bonus = calculate_bonus_for_value(kpi_id, hodnota, cursor)
-                total_bonus += bonus
-                if bonus > 0:
-                    total_met += 1
+        for row in evaluations:
+            dept_id, kpi_id, value = row['department_id'], row['kpi_id'], row['hodnota']
+            bonus = calculate_bonus_for_value(kpi_id, value, cursor)
+            splneno = 1 if bonus > 0 else 0
 
-        else:
-            # Department uses average from locations
-            cursor.execute("""
-                SELECT id FROM locations
-                WHERE department_id = %s AND aktivni = TRUE
-            """, (dept_id,))
-            locations = cursor.fetchall()
+            # Store evaluation in department_monthly_summary or create separate table if needed
+            # For now, we'll calculate summary directly
 
-            total_bonus = 0
-            total_active = 0
-            total_met = 0
+        conn.commit()
 
-            for loc_row in locations:
-                loc_id = loc_row['id']
+def summarize_departments(cursor, months, department_ids=None, rules=None):
+    """Compute department_monthly_summary rows for the given months set-based
 
-                cursor.execute("""
-                    SELECT
-                        SUM(bonus_procento) as total_bonus,
-                        COUNT(*) as kpi_count,
-                        SUM(splneno) as met_count
-                    FROM monthly_kpi_evaluation
-                    WHERE mesic = %s AND location_id = %s
-                """, (mesic, loc_id))
-
-                result = cursor.fetchone()
-                if result and result['total_bonus']:
-                    total_bonus += result['total_bonus']
-                    total_active += result['kpi_count'] or 0
-                    total_met += result['met_count'] or 0
-
-            if locations:
-                # Average across locations
-                avg_bonus = total_bonus / len(list(locations)) if locations else 0
-                total_bonus = avg_bonus
-
-        # Save summary
-        if total_active > 0 or not ma_vlastni_kpi:
-            cursor.execute("""
-                INSERT INTO department_monthly_summary
-                (mesic, department_id, celkovy_bonus, aktivnich_kpi, splnenych_kpi)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT(mesic, department_id)
-                DO UPDATE SET
-                    celkovy_bonus = EXCLUDED.celkovy_bonus,
-                    aktivnich_kpi = EXCLUDED.aktivnich_kpi,
-                    splnenych_kpi = EXCLUDED.splnenych_kpi
-            """, (mesic, dept_id, total_bonus, total_active, total_met))
+    storage.summarize_departments with the process-cached rules unless the
+    caller passes the compiled rules of its own transaction. Runs on the
+    caller's cursor (no commit) and returns a DataFrame of the upserted rows.
+    """
+    if rules is None:
+        rules = get_compiled_rules(cursor)
+    return storage.summarize_departments(cursor, DIALECT, months, rules, department_ids)
+
+def calculate_department_summary(mesic):
+    """Calculate department monthly summary - handles both own KPI and location averages"""
+    return calculate_department_summaries([mesic])
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+def calculate_department_summaries(months):
+    """Calculate department monthly summaries for several months in one pass
+
+    Returns the number of upserted summary rows.
+    """
+    with connection() as conn, conn.cursor() as cursor:
+        summary = summarize_departments(cursor, months)
+        conn.commit()
+    return len(summary)
 
 # ============ IMPORT/EXPORT FUNCTIONS ============
 
@@ -1195,510 +1797,385 @@ def generate_import_template_excel():
     output.seek(0)
     return output.getvalue()
 
-def import_monthly_data_csv(csv_content):
-    """Import monthly KPI data from CSV"""
-    try:
-        df = pd.read_csv(io.StringIO(csv_content))
-        conn = get_connection()
-        cursor = conn.cursor()
+def get_import_lookups(cursor):
+    """Name -> ID dictionaries for imports: ({location nazev: id}, {kpi nazev: id})"""
+    return storage.fetch_import_lookups(cursor, DIALECT)
 
-        imported = 0
-        errors = []
+def merge_import_rows(cursor, rows):
+    """COPY validated import rows into a staging table and merge them with one upsert
 
-        for idx, row in df.iterrows():
-            try:
-                mesic = str(row.get("Měsíc (YYYY-MM)", "")).strip()
-                location_name = str(row.get("Lokalita", "")).strip()
-                kpi_name = str(row.get("KPI", "")).strip()
-                value = float(row.get("Hodnota", 0))
-                poznamka = str(row.get("Poznámka", ""))
-
-                # Get IDs
-                cursor.execute("SELECT id FROM locations WHERE nazev = %s", (location_name,))
-                loc_result = cursor.fetchone()
-                if not loc_result:
-                    errors.append(f"Řada {idx+2}: Lokalita '{location_name}' nebyla nalezena")
-                    continue
-
-                location_id = loc_result['id']
-
-                cursor.execute("SELECT id FROM kpi_definitions WHERE nazev = %s", (kpi_name,))
-                kpi_result = cursor.fetchone()
-                if not kpi_result:
-                    errors.append(f"Řada {idx+2}: KPI '{kpi_name}' nebyla nalezena")
-                    continue
-
-                kpi_id = kpi_result['id']
-
-                # Insert data
-                cursor.execute("""
-                    INSERT INTO monthly_kpi_data
-                    (mesic, location_id, kpi_id, hodnota, poznamka, zdroj)
-                    VALUES (%s, %s, %s, %s, %s, 'IMPORT')
-                    ON CONFLICT(mesic, location_id, kpi_id)
-                    DO UPDATE SET
-                        hodnota = EXCLUDED.hodnota,
-                        poznamka = EXCLUDED.poznamka,
-                        updated_at = CURRENT_TIMESTAMP,
-                        zdroj = 'IMPORT'
-                """, (mesic, location_id, kpi_id, value, poznamka if poznamka else None))
-
-                imported += 1
-
-            except Exception as e:
-                errors.append(f"Řada {idx+2}: {str(e)}")
+    Runs on the caller's cursor/transaction (no commit).
+    """
+    rows = import_engine.deduplicate(rows)
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS import_staging (
+            mesic TEXT,
+            location_id INTEGER,
+            kpi_id INTEGER,
+            hodnota REAL,
+            poznamka TEXT
+        ) ON COMMIT DELETE ROWS
+    """)
+    cursor.execute("TRUNCATE import_staging")
+    cursor.copy_expert(
+        "COPY import_staging (mesic, location_id, kpi_id, hodnota, poznamka) FROM STDIN WITH (FORMAT csv)",
+        import_engine.to_copy_buffer(rows),
+    )
+    cursor.execute("""
+        INSERT INTO monthly_kpi_data
+        (mesic, location_id, kpi_id, hodnota, poznamka, zdroj)
+        SELECT mesic, location_id, kpi_id, hodnota, poznamka, 'IMPORT'
+        FROM import_staging
+        ON CONFLICT(mesic, location_id, kpi_id)
+        DO UPDATE SET
+            hodnota = EXCLUDED.hodnota,
+            poznamka = EXCLUDED.poznamka,
+            updated_at = CURRENT_TIMESTAMP,
+            zdroj = 'IMPORT'
+    """)
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+def import_monthly_data(df):
+    """Import monthly KPI data from a DataFrame with the template columns
 
-        return imported, errors
+    The whole frame is validated vectorized; valid rows are written with one
+    COPY + merge in a single transaction. Returns (imported, errors).
+    """
+    with connection() as conn, conn.cursor() as cursor:
+        location_ids, kpi_ids = get_import_lookups(cursor)
+        rows, errors = import_engine.prepare_import(df, location_ids, kpi_ids)
+        if rows.empty:
+            return 0, errors
+        try:
+            merge_import_rows(cursor, rows)
+            months = mark_dirty(cursor, zip(rows['mesic'], rows['location_id']))
+            enqueue_recalculation(months, cursor, scope='DIRTY')
+            catalog_changed = refresh_month_catalog(cursor, months)
+            conn.commit()
+        except Exception as e:
+            return 0, errors + [f"Chyba při importu: {str(e)}"]
+
+    for mesic in months:
+        invalidate_cache('monthly_kpi_data', mesic)
+    if catalog_changed:
+        invalidate_cache('month_catalog')
+    wake_recalc_worker()
+    return len(rows), errors
+
+IMPORT_CHUNK_SIZE = 5000
+
+def _checkpoint_key(file_hash):
+    return f"import_checkpoint:{file_hash}"
+
+def get_import_checkpoint(file_hash):
+    """Number of rows of a file already committed by an interrupted streaming import"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT hodnota FROM settings WHERE klic = %s", (_checkpoint_key(file_hash),))
+        result = cursor.fetchone()
+    return int(result['hodnota']) if result else 0
+
+def import_monthly_data_chunks(chunks, file_hash=None, progress=None):
+    """Import an iterable of (DataFrame, fraction) chunks, each committed as its own batch
+
+    With file_hash the number of committed rows is stored in settings in the
+    same transaction as every chunk, so a failed import can be started again
+    and continues after the last committed chunk. Returns (imported, errors).
+
+    Args:
+        chunks: iterable of (chunk DataFrame, fraction of the file read or None)
+        file_hash: upload identifier (import_engine.file_hash) for the checkpoint
+        progress: optional callback(rows_done, fraction)
+    """
+    resume_from = get_import_checkpoint(file_hash) if file_hash else 0
+    imported = 0
+    errors = []
+    imported_months = set()
+    catalog_changed = False
+
+    with connection() as conn, conn.cursor() as cursor:
+        location_ids, kpi_ids = get_import_lookups(cursor)
+        rows_done = 0
+        completed = True
+        try:
+            for chunk, fraction in chunks:
+                chunk_start = rows_done
+                rows_done += len(chunk)
+                if rows_done <= resume_from:
+                    continue  # committed by an earlier run
+                if chunk_start < resume_from:
+                    chunk = chunk.iloc[resume_from - chunk_start:]
+
+                rows, chunk_errors = import_engine.prepare_import(chunk, location_ids, kpi_ids)
+                try:
+                    if not rows.empty:
+                        merge_import_rows(cursor, rows)
+                        chunk_months = mark_dirty(cursor, zip(rows['mesic'], rows['location_id']))
+                        enqueue_recalculation(chunk_months, cursor, scope='DIRTY')
+                        catalog_changed = refresh_month_catalog(cursor, chunk_months) or catalog_changed
+                    if file_hash:
+                        cursor.execute("""
+                            INSERT INTO settings (klic, hodnota, updated_at)
+                            VALUES (%s, %s, CURRENT_TIMESTAMP)
+                            ON CONFLICT(klic) DO UPDATE SET
+                                hodnota = EXCLUDED.hodnota,
+                                updated_at = CURRENT_TIMESTAMP
+                        """, (_checkpoint_key(file_hash), str(rows_done)))
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    first_row = chunk.index[0] + 2 if len(chunk) else chunk_start + 2
+                    errors.append(f"Chyba při importu od řady {first_row}: {str(e)} - import lze spustit znovu, naváže od této řady")
+                    completed = False
+                    break
+
+                imported += len(rows)
+                errors.extend(chunk_errors)
+                imported_months.update(rows['mesic'].unique())
+                if progress:
+                    progress(rows_done, fraction)
+
+        except Exception as e:
+            # Reading/parsing the file failed - committed chunks stay, the checkpoint allows a resume
+            errors.append(f"Chyba při čtení souboru po řadě {rows_done + 1}: {str(e)} - import lze spustit znovu, naváže od řady {rows_done + 2}")
+            completed = False
+
+        if completed and file_hash:
+            cursor.execute("DELETE FROM settings WHERE klic = %s", (_checkpoint_key(file_hash),))
+            conn.commit()
+
+    for mesic in imported_months:
+        invalidate_cache('monthly_kpi_data', mesic)
+    if catalog_changed:
+        invalidate_cache('month_catalog')
+    wake_recalc_worker()
+    return imported, errors
+
+def import_monthly_data_csv(csv_content, chunksize=None, progress=None):
+    """Import monthly KPI data from CSV
+
+    Args:
+        csv_content: CSV text or a file-like upload
+        chunksize: stream the file in chunks of this many rows (resumable)
+        progress: optional callback(rows_done, fraction), streaming mode only
+    """
+    if chunksize:
+        try:
+            return import_monthly_data_chunks(import_engine.csv_chunks(csv_content, chunksize),
+                                              import_engine.file_hash(csv_content), progress)
+        except Exception as e:
+            return 0, [f"Chyba při čtení CSV: {str(e)}"]
 
+    try:
+        if isinstance(csv_content, str):
+            csv_content = io.StringIO(csv_content)
+        df = pd.read_csv(csv_content)
     except Exception as e:
         return 0, [f"Chyba při čtení CSV: {str(e)}"]
+    return import_monthly_data(df)
+
+def import_monthly_data_excel(excel_file, chunksize=None, progress=None):
+    """Import monthly KPI data from Excel
+
+    Args:
+        excel_file: file-like upload
+        chunksize: stream the first sheet in chunks of this many rows (.xlsx only, resumable)
+        progress: optional callback(rows_done, fraction), streaming mode only
+    """
+    if chunksize:
+        try:
+            return import_monthly_data_chunks(import_engine.excel_chunks(excel_file, chunksize),
+                                              import_engine.file_hash(excel_file), progress)
+        except Exception as e:
+            return 0, [f"Chyba při čtení Excel: {str(e)}"]
 
-def import_monthly_data_excel(excel_file):
-    """Import monthly KPI data from Excel"""
     try:
         df = pd.read_excel(excel_file)
-        # Převedi na CSV string a použi existující funkcí
-        csv_content = df.to_csv(index=False)
-        return import_monthly_data_csv(csv_content)
     except Exception as e:
         return 0, [f"Chyba při čtení Excel: {str(e)}"]
+    return import_monthly_data(df)
 
-def get_all_months_with_data():
-    """Get all months that have KPI data"""
-    conn = get_connection()
-    cursor = conn.cursor()
+# ============ MONTH CATALOG ============
+
+# month_catalog lists the months with active KPI data, so the month selector
+# (read on every rerun) never scans monthly_kpi_data. Writers call
+# refresh_month_catalog() for the months they touched and invalidate the
+# 'month_catalog' cache only when the catalog changed.
+ALL_MONTHS_SQL = storage.ALL_MONTHS_SQL
+
+MONTH_CATALOG_SQL = "SELECT mesic FROM month_catalog ORDER BY mesic DESC"
+
+def refresh_month_catalog(cursor, months=None):
+    """Bring catalog entries of the given months (None = all) in line with monthly_kpi_data
+
+    Runs on the caller's cursor/transaction (no commit). Returns True when
+    the catalog changed (the caller then invalidates 'month_catalog').
+    """
+    if months is None:
+        cursor.execute(f"""
+            DELETE FROM month_catalog
+            WHERE mesic NOT IN (SELECT mesic FROM ({ALL_MONTHS_SQL}) AS months)
+        """)
+        removed = cursor.rowcount
+        cursor.execute(f"""
+            INSERT INTO month_catalog (mesic)
+            SELECT mesic FROM ({ALL_MONTHS_SQL}) AS months
+            ON CONFLICT DO NOTHING
+        """)
+        return removed + cursor.rowcount > 0
+
+    months = sorted({str(m) for m in months if m})
+    if not months:
+        return False
+    # Lock the months' catalog rows first: a concurrent writer of the same month
+    # waits for this transaction, so the checks below see its committed data
+    cursor.execute("SELECT mesic FROM month_catalog WHERE mesic = ANY(%s) ORDER BY mesic FOR UPDATE", (months,))
     cursor.execute("""
-        SELECT DISTINCT mesic
-        FROM monthly_kpi_data
-        WHERE status = 'ACTIVE'
-        ORDER BY mesic DESC
-    """)
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
+        DELETE FROM month_catalog c
+        WHERE c.mesic = ANY(%s)
+          AND NOT EXISTS (SELECT 1 FROM monthly_kpi_data d WHERE d.mesic = c.mesic AND d.status = 'ACTIVE')
+    """, (months,))
+    removed = cursor.rowcount
+    cursor.execute("""
+        INSERT INTO month_catalog (mesic)
+        SELECT m.mesic FROM unnest(%s::text[]) AS m(mesic)
+        WHERE EXISTS (SELECT 1 FROM monthly_kpi_data d WHERE d.mesic = m.mesic AND d.status = 'ACTIVE')
+        ON CONFLICT DO NOTHING
+    """, (months,))
+    return removed + cursor.rowcount > 0
+
+@data_cache.cached(_data_cache, ttl=3600, tags=lambda: [
+    'month_catalog', data_cache.month_tag('month_catalog')])  # Cache for 1 hour (writers invalidate on change)
+def get_all_months_with_data():
+    """Get all months that have KPI data (newest first)"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(MONTH_CATALOG_SQL)
+        results = cursor.fetchall()
+    return [row['mesic'] for row in results]
 
-    if not results:
-        return []
-    # Extract mesic values from dict rows
-    months = [row['mesic'] for row in results]
-    return sorted(set(months), reverse=True)
+# ============ QUERY PLAN CHECK ============
+
+INDEX_NODE_TYPES = {'Index Scan', 'Index Only Scan', 'Bitmap Index Scan'}
+
+def _plan_nodes(plan):
+    """Flatten an EXPLAIN (FORMAT JSON) plan tree"""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+def explain_hot_queries():
+    """EXPLAIN the hot read queries and report whether they use an index
+
+    Every query is planned twice: as the planner would run it now (on small
+    tables a sequential scan is often cheaper) and with sequential scans
+    disabled, which shows whether a usable index exists at all.
+    """
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT mesic, location_id, kpi_id FROM monthly_kpi_data WHERE status = 'ACTIVE' ORDER BY mesic DESC LIMIT 1")
+        sample = cursor.fetchone() or {'mesic': datetime.now().strftime('%Y-%m'), 'location_id': 1, 'kpi_id': 1}
+        cursor.execute("SELECT id FROM departments WHERE aktivni = TRUE ORDER BY id LIMIT 1")
+        department = cursor.fetchone()
+        department_id = department['id'] if department else 1
+
+        queries = [
+            ("get_monthly_kpi_data (měsíc)", *_monthly_kpi_data_query(sample['mesic'])),
+            ("get_monthly_kpi_data (lokalita)", *_monthly_kpi_data_query(location_id=sample['location_id'])),
+            ("get_monthly_kpi_data (KPI)", *_monthly_kpi_data_query(kpi_id=sample['kpi_id'])),
+            ("get_all_months_with_data", MONTH_CATALOG_SQL, []),
+            ("get_department_kpi_value (vlastní)", DEPARTMENT_OWN_KPI_VALUE_SQL, [sample['mesic'], department_id, sample['kpi_id']]),
+            ("get_department_kpi_value (průměr)", DEPARTMENT_AVG_KPI_VALUE_SQL, [sample['mesic'], department_id, sample['kpi_id']]),
+            ("get_manager_kpi_summary", KPI_CUBE_MANAGER_SQL, [sample['mesic']]),
+            ("get_manager_kpi_details", KPI_CUBE_DETAIL_SQL, [sample['mesic']]),
+        ]
+
+        report = []
+        for name, query, params in queries:
+            row = {'dotaz': name}
+            for label, force_index in [('plán', False), ('s indexem', True)]:
+                cursor.execute("SET LOCAL enable_seqscan = %s", ('off' if force_index else 'on',))
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query, tuple(params))
+                plan = cursor.fetchone()['QUERY PLAN'][0]['Plan']
+                nodes = list(_plan_nodes(plan))
+                indexes = sorted({n['Index Name'] for n in nodes if n.get('Index Name')})
+                row[label] = ", ".join(sorted({n['Node Type'] for n in nodes if 'Scan' in n['Node Type']}))
+                if force_index:
+                    row['index_scan'] = any(n['Node Type'] in INDEX_NODE_TYPES for n in nodes)
+                    row['indexy'] = ", ".join(indexes)
+            report.append(row)
+        conn.rollback()
+
+    return pd.DataFrame(report, columns=['dotaz', 'plán', 's indexem', 'indexy', 'index_scan'])
 
 # ============ DELETE FUNCTIONS ============
 
 def delete_department(department_id):
     """Soft delete department (set aktivni=FALSE)"""
-    department_id = safe_convert_id(department_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        # Check if department has locations or managers
-        cursor.execute("SELECT COUNT(*) as count FROM locations WHERE department_id = %s AND aktivni = TRUE", (department_id,))
-        loc_count = cursor.fetchone()['count']
-        cursor.execute("SELECT COUNT(*) as count FROM operational_managers WHERE department_id = %s AND aktivni = TRUE", (department_id,))
-        mgr_count = cursor.fetchone()['count']
-
-        if loc_count > 0 or mgr_count > 0:
-            cursor.close()
-            conn.close()
-            return False, f"Nelze smazat oddělení s aktivními lokalitami ({loc_count}) nebo provozními ({mgr_count})"
-
-        cursor.execute("UPDATE departments SET aktivni = FALSE WHERE id = %s", (department_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "Oddělení smazáno"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e)
+    return storage.delete_department(DIALECT, department_id)
 
 def delete_location(location_id):
     """Soft delete location (set aktivni=FALSE)"""
-    location_id = safe_convert_id(location_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE locations SET aktivni = FALSE WHERE id = %s", (location_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "Lokalita smazána"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e)
+    return storage.delete_location(DIALECT, location_id)
 
 def delete_operational_manager(manager_id):
     """Soft delete operational manager (set aktivni=FALSE)"""
-    manager_id = safe_convert_id(manager_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE operational_managers SET aktivni = FALSE WHERE id = %s", (manager_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "Provozní smazán"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e)
+    return storage.delete_operational_manager(DIALECT, manager_id)
 
 # ============ KPI DEFINITIONS CRUD ============
 
 def add_kpi_definition(nazev, popis=None, jednotka=None, typ_vypoctu=None, poradi=None):
     """Add new KPI definition"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        if poradi is None:
-            cursor.execute("SELECT MAX(poradi) as max FROM kpi_definitions")
-            result = cursor.fetchone()
-            max_poradi = result['max'] if result['max'] is not None else 0
-            poradi = max_poradi + 1
-
-        cursor.execute("""
-            INSERT INTO kpi_definitions (nazev, popis, jednotka, typ_vypoctu, poradi)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id
-        """, (nazev, popis, jednotka, typ_vypoctu, poradi))
-        new_id = cursor.fetchone()['id']
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, f"KPI '{nazev}' přidáno", new_id
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e), None
+    return storage.add_kpi_definition(DIALECT, nazev, popis, jednotka, typ_vypoctu, poradi)
 
 def update_kpi_definition(kpi_id, nazev=None, popis=None, jednotka=None, typ_vypoctu=None, poradi=None):
     """Update KPI definition"""
-    kpi_id = safe_convert_id(kpi_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        updates = []
-        params = []
-
-        if nazev is not None:
-            updates.append("nazev = %s")
-            params.append(nazev)
-        if popis is not None:
-            updates.append("popis = %s")
-            params.append(popis)
-        if jednotka is not None:
-            updates.append("jednotka = %s")
-            params.append(jednotka)
-        if typ_vypoctu is not None:
-            updates.append("typ_vypoctu = %s")
-            params.append(typ_vypoctu)
-        if poradi is not None:
-            updates.append("poradi = %s")
-            params.append(poradi)
-
-        if not updates:
-            cursor.close()
-            conn.close()
-            return False, "Žádné změny"
-
-        params.append(kpi_id)
-        query = f"UPDATE kpi_definitions SET {', '.join(updates)} WHERE id = %s"
-        cursor.execute(query, params)
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "KPI upraveno"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e)
+    return storage.update_kpi_definition(DIALECT, kpi_id, nazev, popis, jednotka, typ_vypoctu, poradi)
 
 def delete_kpi_definition(kpi_id):
     """Soft delete KPI definition (set aktivni=FALSE)"""
-    kpi_id = safe_convert_id(kpi_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE kpi_definitions SET aktivni = FALSE WHERE id = %s", (kpi_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "KPI smazáno"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e)
+    return storage.delete_kpi_definition(DIALECT, kpi_id)
 
 def get_all_kpi_definitions(include_inactive=False):
     """Get all KPI definitions (including inactive if specified)"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    if include_inactive:
-        cursor.execute("SELECT * FROM kpi_definitions ORDER BY poradi, nazev")
-    else:
-        cursor.execute("SELECT * FROM kpi_definitions WHERE aktivni = TRUE ORDER BY poradi, nazev")
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['id', 'nazev', 'popis', 'jednotka', 'typ_vypoctu', 'poradi', 'aktivni'])
-    return df
+    return storage.get_all_kpi_definitions(DIALECT, include_inactive)
 
 # ============ KPI THRESHOLDS CRUD ============
 
 def add_kpi_threshold(kpi_id, operator, bonus_procento, min_hodnota=None, max_hodnota=None, popis=None, poradi=None):
-    """Add new KPI threshold"""
-    kpi_id = safe_convert_id(kpi_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        # Convert to int to be safe
-        kpi_id = int(kpi_id)
-
-        # Verify KPI exists
-        cursor.execute("SELECT id FROM kpi_definitions WHERE id = %s AND aktivni = TRUE", (kpi_id,))
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return False, f"KPI ID {kpi_id} neexistuje nebo není aktivní", None
-
-        if poradi is None:
-            cursor.execute("SELECT MAX(poradi) as max FROM kpi_thresholds WHERE kpi_id = %s", (kpi_id,))
-            result = cursor.fetchone()
-            max_poradi = result['max'] if result['max'] is not None else 0
-            poradi = max_poradi + 1
-
-        cursor.execute("""
-            INSERT INTO kpi_thresholds (kpi_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (kpi_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi))
-        new_id = cursor.fetchone()['id']
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "Hranice přidána", new_id
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, f"Chyba: {str(e)}", None
+    """Add new KPI threshold (its months are queued for recalculation)"""
+    return storage.add_kpi_threshold(DIALECT, kpi_id, operator, bonus_procento, min_hodnota, max_hodnota, popis, poradi)
 
 def update_kpi_threshold(threshold_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi):
     """Update KPI threshold - updates all fields"""
-    threshold_id = safe_convert_id(threshold_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            UPDATE kpi_thresholds
-            SET min_hodnota = %s,
-                max_hodnota = %s,
-                operator = %s,
-                bonus_procento = %s,
-                popis = %s,
-                poradi = %s
-            WHERE id = %s
-        """, (min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi, threshold_id))
-
-        if cursor.rowcount == 0:
-            cursor.close()
-            conn.close()
-            return False, "Hranice nenalezena"
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "Hranice upravena"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, f"Chyba: {str(e)}"
+    return storage.update_kpi_threshold(DIALECT, threshold_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi)
 
 def delete_kpi_threshold(threshold_id):
     """Delete KPI threshold"""
-    threshold_id = safe_convert_id(threshold_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("DELETE FROM kpi_thresholds WHERE id = %s", (threshold_id,))
-
-        if cursor.rowcount == 0:
-            cursor.close()
-            conn.close()
-            return False, "Hranice nenalezena"
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "Hranice smazána"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, f"Chyba: {str(e)}"
+    return storage.delete_kpi_threshold(DIALECT, threshold_id)
 
 # ============ DEPARTMENT VLASTNI KPI FUNCTIONS ============
 
 def update_department_vlastni_kpi(department_id, ma_vlastni_kpi):
     """Update whether department has own KPI values"""
-    department_id = safe_convert_id(department_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            UPDATE departments
-            SET ma_vlastni_kpi = %s
-            WHERE id = %s
-        """, (ma_vlastni_kpi, department_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "Nastavení vlastních KPI upraveno"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e)
+    return storage.update_department_vlastni_kpi(DIALECT, department_id, ma_vlastni_kpi)
 
 def add_monthly_department_kpi_data(mesic, department_id, kpi_id, hodnota, poznamka=None, zdroj="MANUAL"):
     """Add or update monthly KPI data for department with own KPI"""
-    department_id = safe_convert_id(department_id)
-    kpi_id = safe_convert_id(kpi_id)
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO monthly_department_kpi_data (mesic, department_id, kpi_id, hodnota, poznamka, zdroj, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-            ON CONFLICT(mesic, department_id, kpi_id) DO UPDATE SET
-                hodnota = EXCLUDED.hodnota,
-                poznamka = EXCLUDED.poznamka,
-                zdroj = EXCLUDED.zdroj,
-                updated_at = CURRENT_TIMESTAMP
-        """, (mesic, department_id, kpi_id, hodnota, poznamka, zdroj))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, "Data uložena"
-    except Exception as e:
-        cursor.close()
-        conn.close()
-        return False, str(e)
+    return storage.add_monthly_department_kpi_data(DIALECT, mesic, department_id, kpi_id, hodnota, poznamka, zdroj)
+
+def add_monthly_department_kpi_data_bulk(mesic, department_id, values, poznamka=None, zdroj="MANUAL"):
+    """Add or update several KPI values of one own-KPI department/month in one transaction (with its summary)"""
+    return storage.add_monthly_department_kpi_data_bulk(DIALECT, mesic, department_id, values, poznamka, zdroj)
 
 def get_monthly_department_kpi_data(mesic, department_id=None):
     """Get monthly KPI data for department(s) with own KPI"""
-    department_id = safe_convert_id(department_id)
-    conn = get_connection()
-    if department_id:
-        query = """
-            SELECT d.mesic, d.department_id, dept.nazev as department_nazev,
-                   d.kpi_id, k.nazev as kpi_nazev, d.hodnota, d.poznamka, d.zdroj
-            FROM monthly_department_kpi_data d
-            JOIN departments dept ON d.department_id = dept.id
-            JOIN kpi_definitions k ON d.kpi_id = k.id
-            WHERE d.mesic = %s AND d.department_id = %s AND d.status = 'ACTIVE'
-            ORDER BY k.poradi
-        """
-        cursor = conn.cursor()
-        cursor.execute(query, (mesic, department_id))
-        results = cursor.fetchall()
-        cursor.close()
-        if results:
-            df = pd.DataFrame(results)
-        else:
-            df = pd.DataFrame(columns=['mesic', 'department_id', 'department_nazev', 'kpi_id', 'kpi_nazev', 'hodnota', 'poznamka', 'zdroj'])
-    else:
-        query = """
-            SELECT d.mesic, d.department_id, dept.nazev as department_nazev,
-                   d.kpi_id, k.nazev as kpi_nazev, d.hodnota, d.poznamka, d.zdroj
-            FROM monthly_department_kpi_data d
-            JOIN departments dept ON d.department_id = dept.id
-            JOIN kpi_definitions k ON d.kpi_id = k.id
-            WHERE d.mesic = %s AND d.status = 'ACTIVE'
-            ORDER BY dept.nazev, k.poradi
-        """
-        cursor = conn.cursor()
-        cursor.execute(query, (mesic,))
-        results = cursor.fetchall()
-        cursor.close()
-        if results:
-            df = pd.DataFrame(results)
-        else:
-            df = pd.DataFrame(columns=['mesic', 'department_id', 'department_nazev', 'kpi_id', 'kpi_nazev', 'hodnota', 'poznamka', 'zdroj'])
-    conn.close()
-    return df
-
-def get_department_kpi_value(mesic, department_id, kpi_id):
-    """
-    Get KPI value for department - either own value or average from locations
-    Returns: (hodnota, zdroj) where zdroj is 'VLASTNI' or 'PRUMER_Z_LOKALIT'
-    """
-    department_id = safe_convert_id(department_id)
-    kpi_id = safe_convert_id(kpi_id)
-    conn = get_connection()
-    cursor = conn.cursor()
+    return storage.get_monthly_department_kpi_data(DIALECT, mesic, department_id)
 
-    # Check if department has own KPI
-    cursor.execute("SELECT ma_vlastni_kpi FROM departments WHERE id = %s", (department_id,))
-    result = cursor.fetchone()
-    if not result:
-        cursor.close()
-        conn.close()
-        return None, None
+DEPARTMENT_OWN_KPI_VALUE_SQL = storage.DEPARTMENT_OWN_KPI_VALUE_SQL
 
-    ma_vlastni_kpi = result['ma_vlastni_kpi']
+DEPARTMENT_AVG_KPI_VALUE_SQL = storage.DEPARTMENT_AVG_KPI_VALUE_SQL
 
-    if ma_vlastni_kpi:
-        # Get own KPI value
-        cursor.execute("""
-            SELECT hodnota
-            FROM monthly_department_kpi_data
-            WHERE mesic = %s AND department_id = %s AND kpi_id = %s AND status = 'ACTIVE'
-        """, (mesic, department_id, kpi_id))
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        if result:
-            return result['hodnota'], 'VLASTNI'
-        else:
-            return None, None
-    else:
-        # Calculate average from locations
-        cursor.execute("""
-            SELECT AVG(mkd.hodnota) as prumer
-            FROM monthly_kpi_data mkd
-            JOIN locations l ON mkd.location_id = l.id
-            WHERE mkd.mesic = %s AND l.department_id = %s AND mkd.kpi_id = %s
-                  AND mkd.status = 'ACTIVE' AND l.aktivni = TRUE
-        """, (mesic, department_id, kpi_id))
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        if result and result['prumer'] is not None:
-            return result['prumer'], 'PRUMER_Z_LOKALIT'
-        else:
-            return None, None
+def get_department_kpi_value(mesic, department_id, kpi_id):
+    """Get KPI value for department as (hodnota, zdroj) - own value ('VLASTNI') or location average ('PRUMER_Z_LOKALIT')"""
+    return storage.get_department_kpi_value(DIALECT, mesic, department_id, kpi_id)
 
 def get_departments_with_vlastni_kpi():
     """Get list of departments that have own KPI values"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, nazev, vedouci, ma_vlastni_kpi
-        FROM departments
-        WHERE aktivni = TRUE
-        ORDER BY nazev
-    """)
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    if results:
-        df = pd.DataFrame(results)
-    else:
-        df = pd.DataFrame(columns=['id', 'nazev', 'vedouci', 'ma_vlastni_kpi'])
-    return df
+    return storage.get_departments_with_vlastni_kpi(DIALECT)
@@ -0,0 +1,161 @@
+"""
+RESTO - Import Engine
+Vectorized validation of CSV/Excel KPI imports:
+- Location and KPI names are resolved to IDs with one dictionary lookup per column
+- Per-row Czech error messages match the former row-by-row import
+- Valid rows are deduplicated (last row wins) and serialized for COPY
+- Large files are read in fixed-size chunks (CSV via pandas, Excel via openpyxl read-only)
+"""
+
+import io
+import hashlib
+import pandas as pd
+import numpy as np
+
+COL_MESIC = "Měsíc (YYYY-MM)"
+COL_LOCATION = "Lokalita"
+COL_KPI = "KPI"
+COL_VALUE = "Hodnota"
+COL_NOTE = "Poznámka"
+
+STAGING_COLUMNS = ['mesic', 'location_id', 'kpi_id', 'hodnota', 'poznamka']
+
+def _text_column(df, column):
+    """Stripped text column (missing column -> empty strings)"""
+    if column not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    return df[column].astype(str).str.strip()
+
+def _parse_values(df):
+    """Hodnota as float plus per-row error text (None where the value is fine)"""
+    errors = pd.Series(None, index=df.index, dtype=object)
+    if COL_VALUE not in df.columns:
+        return pd.Series(0.0, index=df.index), errors
+
+    raw = df[COL_VALUE]
+    values = pd.to_numeric(raw, errors='coerce').astype('float64')
+    errors[raw.isna()] = "Hodnota chybí"
+
+    # Anything pandas could not parse goes through float() for the exact message
+    for idx in raw.index[values.isna() & raw.notna()]:
+        try:
+            values[idx] = float(raw[idx])
+        except (TypeError, ValueError) as e:
+            errors[idx] = str(e)
+    return values, errors
+
+def prepare_import(df, location_ids, kpi_ids):
+    """Validate an import frame against {nazev: id} lookups
+
+    Returns (rows, errors): rows has STAGING_COLUMNS for every valid input row
+    (duplicates included, in file order), errors are "Řada N: ..." messages in
+    row order. Only the first problem of a row is reported (value, location, KPI).
+    """
+    row_numbers = pd.Series(np.asarray(df.index) + 2, index=df.index)
+    mesic = _text_column(df, COL_MESIC)
+    location_name = _text_column(df, COL_LOCATION)
+    kpi_name = _text_column(df, COL_KPI)
+    values, value_errors = _parse_values(df)
+
+    location_id = location_name.map(location_ids)
+    kpi_id = kpi_name.map(kpi_ids)
+
+    messages = value_errors.copy()
+    missing_location = messages.isna() & location_id.isna()
+    messages[missing_location] = "Lokalita '" + location_name[missing_location] + "' nebyla nalezena"
+    missing_kpi = messages.isna() & kpi_id.isna()
+    messages[missing_kpi] = "KPI '" + kpi_name[missing_kpi] + "' nebyla nalezena"
+
+    invalid = messages.notna()
+    errors = [f"Řada {n}: {msg}" for n, msg in zip(row_numbers[invalid], messages[invalid])]
+
+    if COL_NOTE in df.columns:
+        has_note = df[COL_NOTE].notna()
+        poznamka = pd.Series(None, index=df.index, dtype=object)
+        poznamka[has_note] = df.loc[has_note, COL_NOTE].astype(str)
+        poznamka[poznamka == ""] = None
+    else:
+        poznamka = pd.Series(None, index=df.index, dtype=object)
+
+    valid = ~invalid
+    rows = pd.DataFrame({
+        'mesic': mesic[valid],
+        'location_id': location_id[valid].astype('int64'),
+        'kpi_id': kpi_id[valid].astype('int64'),
+        'hodnota': values[valid],
+        'poznamka': poznamka[valid],
+    }, columns=STAGING_COLUMNS)
+    return rows.reset_index(drop=True), errors
+
+def deduplicate(rows):
+    """One row per (mesic, location_id, kpi_id) - the last one in the file wins"""
+    return rows.drop_duplicates(['mesic', 'location_id', 'kpi_id'], keep='last')
+
+def to_copy_buffer(rows):
+    """Serialize staging rows as CSV for COPY ... FROM STDIN (empty field = NULL)"""
+    buffer = io.StringIO()
+    rows[STAGING_COLUMNS].to_csv(buffer, index=False, header=False, float_format='%.17g')
+    buffer.seek(0)
+    return buffer
+
+def _as_stream(source):
+    """File-like view of an upload (CSV text is accepted as str)"""
+    if isinstance(source, str):
+        return io.BytesIO(source.encode('utf-8'))
+    source.seek(0)
+    return source
+
+def file_hash(source, block_size=1024 * 1024):
+    """SHA-256 of an upload, read in blocks (identifies the file for checkpoints)"""
+    stream = _as_stream(source)
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(block_size), b''):
+        digest.update(block.encode('utf-8') if isinstance(block, str) else block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def _stream_size(stream):
+    position = stream.tell()
+    size = stream.seek(0, io.SEEK_END)
+    stream.seek(position)
+    return size
+
+def csv_chunks(source, chunksize):
+    """Yield (chunk, fraction read) from a CSV upload; row index continues across chunks"""
+    stream = _as_stream(source)
+    size = _stream_size(stream)
+    with pd.read_csv(stream, chunksize=chunksize, encoding='utf-8') as reader:
+        for chunk in reader:
+            yield chunk, (min(stream.tell() / size, 1.0) if size else None)
+
+def excel_chunks(source, chunksize):
+    """Yield (chunk, fraction read) from the first sheet of an .xlsx upload
+
+    The index of every chunk is the sheet row number - 2, so error messages
+    point at the same rows as a non-streamed import.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(_as_stream(source), read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+        total = (sheet.max_row - 1) if sheet.max_row else None
+
+        batch, index = [], []
+        for row_no, row in enumerate(rows):
+            if all(v is None for v in row):
+                continue
+            batch.append(tuple(row[:len(columns)]) + (None,) * (len(columns) - len(row)))
+            index.append(row_no)
+            if len(batch) == chunksize:
+                yield pd.DataFrame(batch, columns=columns, index=index), (min((row_no + 1) / total, 1.0) if total else None)
+                batch, index = [], []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns, index=index), 1.0
+    finally:
+        workbook.close()
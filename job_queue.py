@@ -0,0 +1,110 @@
+"""
+RESTO - Background Job Worker
+Runs queued jobs off the Streamlit request path:
+- claim_fn() takes the next job from the queue (or returns None when it is empty)
+- run_fn(job) does the work and records the outcome in the queue itself
+- housekeeping_fn() runs every housekeeping_interval seconds (stale/old jobs)
+- wake() lets a local enqueue start the next job without waiting for the poll
+- concurrency > 1 runs that many loops in parallel (the claim must skip
+  jobs taken by other loops, e.g. FOR UPDATE SKIP LOCKED)
+The queue lives in the database, so workers in several processes share it.
+"""
+
+import threading
+import time
+
+class JobWorker:
+    """Poll loops that claim and run jobs, one job per loop at a time"""
+
+    def __init__(self, claim_fn, run_fn, housekeeping_fn=None, name="worker",
+                 concurrency=1, poll_interval=2.0, housekeeping_interval=60.0):
+        self._claim_fn = claim_fn
+        self._run_fn = run_fn
+        self._housekeeping_fn = housekeeping_fn
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.poll_interval = float(poll_interval)
+        self.housekeeping_interval = float(housekeeping_interval)
+
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._last_housekeeping = 0.0
+        self._stats = {
+            'claimed': 0,
+            'done': 0,
+            'errors': 0,
+            'current': [],
+            'last_error': None,
+        }
+
+    def start(self):
+        """Start concurrency worker threads (no-op when they are already running)"""
+        with self._lock:
+            if any(thread.is_alive() for thread in self._threads):
+                return False
+            self._stop.clear()
+            self._threads = [threading.Thread(target=self.run, name=f"{self.name}-{i + 1}", daemon=True)
+                             for i in range(self.concurrency)]
+            for thread in self._threads:
+                thread.start()
+            return True
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['current'] = list(stats['current'])
+        stats['threads'] = sum(thread.is_alive() for thread in self._threads)
+        stats['running'] = stats['threads'] > 0
+        return stats
+
+    def _record(self, key, started=None, finished=None, **values):
+        with self._lock:
+            if key:
+                self._stats[key] += 1
+            if started is not None:
+                self._stats['current'].append(started)
+            if finished is not None:
+                self._stats['current'].remove(finished)
+            self._stats.update(values)
+
+    def run_pending(self, limit=None):
+        """Run queued jobs in the calling thread until the queue is empty; returns the number run"""
+        count = 0
+        while limit is None or count < limit:
+            job = self._claim_fn()
+            if job is None:
+                break
+            self._record('claimed', started=job)
+            try:
+                self._run_fn(job)
+                self._record('done', finished=job)
+            except Exception as e:
+                self._record('errors', finished=job, last_error=str(e))
+            count += 1
+        return count
+
+    def run(self):
+        """Worker loop (thread target, or the main loop of a dedicated worker process)"""
+        while not self._stop.is_set():
+            try:
+                if self._housekeeping_fn is not None and \
+                        time.monotonic() - self._last_housekeeping > self.housekeeping_interval:
+                    self._last_housekeeping = time.monotonic()
+                    self._housekeeping_fn()
+                self.run_pending()
+            except Exception as e:
+                # Lost connection etc. - try again after the poll interval
+                self._record('errors', last_error=str(e))
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
@@ -2,23 +2,80 @@
 RESTO v3 - SQLite to PostgreSQL Migration Script
 Migrates all data from local resto_data.db to Supabase PostgreSQL
 
+Tables are streamed from SQLite cursors page by page into PostgreSQL with
+COPY FROM STDIN (via a staging table, so existing rows are kept - same as
+ON CONFLICT DO NOTHING). Independent tables are migrated concurrently in
+dependency waves, and row counts plus key checksums are verified at the end.
+
 Prerequisites:
 1. Supabase project created with PostgreSQL database
 2. Connection string added to .streamlit/secrets.toml
 3. PostgreSQL tables created (run database_postgres.init_database() first)
 
+Incremental sync (--sync) transfers only rows changed since the last run:
+tables with updated_at are read after a per-table high-water mark stored in
+the PostgreSQL settings table (sync_hwm:<table>) and upserted; the mark is
+committed together with every page, so an interrupted sync continues where
+it stopped. Small tables without updated_at are compared in full and only
+differing rows are written. Deleted SQLite rows are not propagated.
+
 Usage:
     python migrate_sqlite_to_postgres.py
+    python migrate_sqlite_to_postgres.py --sync
 """
 
+import argparse
 import sqlite3
 import psycopg2
-import pandas as pd
+import psycopg2.extras
+import hashlib
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import sys
 
 # Configuration
 SQLITE_DB = "resto_data.db"
+PAGE_SIZE = 10000   # rows per COPY batch (bounds memory per table)
+MAX_WORKERS = 4     # tables migrated at the same time within a wave
+
+# Dependency waves - a table only references tables from earlier waves
+MIGRATION_WAVES = [
+    ["departments", "kpi_definitions", "settings"],
+    ["locations", "operational_managers", "kpi_thresholds",
+     "monthly_department_kpi_data", "department_monthly_summary"],
+    ["manager_kpi_assignments", "monthly_kpi_data", "monthly_kpi_evaluation"],
+]
+
+# Text primary key per table (used for checksums and sync paging), other tables use id
+TABLE_KEYS = {"settings": "klic"}
+
+# Natural keys for sync upserts - ids of these tables are assigned by PostgreSQL,
+# all other tables keep their SQLite ids (foreign keys point at them)
+SYNC_CONFLICT_KEYS = {
+    "settings": ("klic",),
+    "manager_kpi_assignments": ("manager_id", "kpi_id"),
+    "monthly_kpi_data": ("mesic", "location_id", "kpi_id"),
+    "monthly_kpi_evaluation": ("mesic", "location_id", "kpi_id"),
+    "monthly_department_kpi_data": ("mesic", "department_id", "kpi_id"),
+    "department_monthly_summary": ("mesic", "department_id"),
+}
+
+SYNC_MARK_PREFIX = "sync_hwm:"
+
+# monthly_kpi_cube is built from the evaluation and these tables - a synced
+# change in them touches every month of the cube
+CUBE_TABLE = "monthly_kpi_evaluation"
+CUBE_REFERENCE_TABLES = ("locations", "operational_managers")
+
+# Settings rows that only PostgreSQL has (sync marks, import checkpoints of
+# database_postgres) - left out of the verification
+INTERNAL_SETTINGS_PREFIXES = (SYNC_MARK_PREFIX, "import_checkpoint:")
+VERIFY_FILTERS = {
+    "settings": " AND ".join(f"substr(klic, 1, {len(prefix)}) <> '{prefix}'" for prefix in INTERNAL_SETTINGS_PREFIXES),
+}
 
 def get_postgres_connection():
     """Get PostgreSQL connection from secrets file"""
@@ -44,60 +101,307 @@ def get_sqlite_connection():
     conn.row_factory = sqlite3.Row
     return conn
 
+def normalize_value(value):
+    """SQLite value -> Python value for PostgreSQL (binary IDs from older versions become int)"""
+    if isinstance(value, bytes):
+        return int.from_bytes(value, byteorder='little')
+    return value
+
+def _copy_text(value):
+    """Encode one value for COPY ... FROM STDIN (text format)"""
+    value = normalize_value(value)
+    if value is None:
+        return r"\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, float):
+        return repr(value)
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def stream_rows(sqlite_conn, query, params=(), page_size=PAGE_SIZE):
+    """Yield pages of rows from a SQLite query without loading the whole table"""
+    cursor = sqlite_conn.execute(query, params)
+    while True:
+        page = cursor.fetchmany(page_size)
+        if not page:
+            break
+        yield page
+
+def get_sqlite_columns(sqlite_conn, table_name):
+    return [row[1] for row in sqlite_conn.execute(f"PRAGMA table_info({table_name})")]
+
+def get_postgres_columns(pg_cursor, table_name):
+    pg_cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+    """, (table_name,))
+    return {row[0] for row in pg_cursor.fetchall()}
+
+def copy_pages(pg_cursor, staging_table, cols, pages, transform_fn=None):
+    """COPY pages of SQLite rows into a PostgreSQL table, returns number of rows sent"""
+    sent = 0
+    copy_sql = f"COPY {staging_table} ({', '.join(cols)}) FROM STDIN"
+    for page in pages:
+        buffer = io.StringIO()
+        for row in page:
+            values = list(row)
+            if transform_fn:
+                values = transform_fn(values, cols)
+            buffer.write("\t".join(_copy_text(v) for v in values))
+            buffer.write("\n")
+        buffer.seek(0)
+        pg_cursor.copy_expert(copy_sql, buffer)
+        sent += len(page)
+    return sent
+
 def migrate_table(table_name, sqlite_conn, pg_conn, columns=None, transform_fn=None):
     """
     Migrate a table from SQLite to PostgreSQL
 
+    Rows are streamed with COPY into a temporary staging table and merged
+    with INSERT ... ON CONFLICT DO NOTHING in one transaction.
+
     Args:
         table_name: Name of the table
         sqlite_conn: SQLite connection
         pg_conn: PostgreSQL connection
-        columns: List of columns to migrate (None = all)
+        columns: List of columns to migrate (None = all columns present in both databases)
         transform_fn: Optional function to transform each row
+
+    Returns:
+        Number of inserted rows
     """
-    print(f"  📦 Migrating {table_name}...", end=" ")
+    pg_cursor = pg_conn.cursor()
 
-    # Read from SQLite
-    if columns:
-        col_str = ", ".join(columns)
-        query = f"SELECT {col_str} FROM {table_name}"
-    else:
-        query = f"SELECT * FROM {table_name}"
+    if not columns:
+        pg_columns = get_postgres_columns(pg_cursor, table_name)
+        columns = [c for c in get_sqlite_columns(sqlite_conn, table_name) if c in pg_columns]
+    col_names = ", ".join(columns)
+    staging_table = f"migrate_{table_name}"
+
+    pg_cursor.execute(f"CREATE TEMP TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+    copy_pages(pg_cursor, staging_table, columns,
+               stream_rows(sqlite_conn, f"SELECT {col_names} FROM {table_name}"), transform_fn)
+    pg_cursor.execute(f"""
+        INSERT INTO {table_name} ({col_names})
+        SELECT {col_names} FROM {staging_table}
+        ON CONFLICT DO NOTHING
+    """)
+    inserted = pg_cursor.rowcount
+    pg_conn.commit()
+    return inserted
 
-    df = pd.read_sql_query(query, sqlite_conn)
+def _migrate_table_worker(table_name):
+    """Migrate one table on its own SQLite and PostgreSQL connections (thread worker)"""
+    start = time.time()
+    sqlite_conn = get_sqlite_connection()
+    pg_conn = get_postgres_connection()
+    try:
+        inserted = migrate_table(table_name, sqlite_conn, pg_conn)
+        return table_name, inserted, None, time.time() - start
+    except Exception as e:
+        pg_conn.rollback()
+        return table_name, 0, str(e), time.time() - start
+    finally:
+        sqlite_conn.close()
+        pg_conn.close()
 
-    if df.empty:
-        print("⚠️  No data to migrate")
-        return 0
+def run_waves(worker, waves=MIGRATION_WAVES, max_workers=MAX_WORKERS, label="rows migrated"):
+    """Run worker(table) wave by wave, tables within a wave concurrently
 
-    # Get column names
-    cols = df.columns.tolist()
+    Returns dict {table: (rows, error)}.
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for number, wave in enumerate(waves, start=1):
+            print(f"  🌊 Wave {number}: {', '.join(wave)}")
+            for table_name, rows, error, elapsed in executor.map(worker, wave):
+                if error:
+                    print(f"    ⚠️  {table_name}: {error}")
+                else:
+                    print(f"    📦 {table_name}: ✅ {rows} {label} ({elapsed:.1f} s)")
+                results[table_name] = (rows, error)
+    return results
+
+def migrate_waves(waves=MIGRATION_WAVES, max_workers=MAX_WORKERS):
+    """Migrate tables wave by wave, tables within a wave concurrently"""
+    return run_waves(_migrate_table_worker, waves, max_workers)
+
+# ============================================================
+# INCREMENTAL SYNC
+# ============================================================
+
+def get_sync_mark(pg_cursor, table_name):
+    """Stored high-water mark {"ts", "key", "done"} of a table (None = never synced)"""
+    pg_cursor.execute("SELECT hodnota FROM settings WHERE klic = %s", (SYNC_MARK_PREFIX + table_name,))
+    result = pg_cursor.fetchone()
+    return json.loads(result[0]) if result else None
+
+def save_sync_mark(pg_cursor, table_name, mark):
+    pg_cursor.execute("""
+        INSERT INTO settings (klic, hodnota, updated_at)
+        VALUES (%s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT(klic) DO UPDATE SET
+            hodnota = EXCLUDED.hodnota,
+            updated_at = CURRENT_TIMESTAMP
+    """, (SYNC_MARK_PREFIX + table_name, json.dumps(mark)))
+
+def _upsert_sql(table_name, staging_table, cols, conflict_keys, returning=None):
+    col_names = ", ".join(cols)
+    updated = [c for c in cols if c not in conflict_keys]
+    returning_sql = f"RETURNING {returning}" if returning else ""
+    if not updated:
+        return f"""
+            INSERT INTO {table_name} ({col_names})
+            SELECT {col_names} FROM {staging_table}
+            ON CONFLICT ({', '.join(conflict_keys)}) DO NOTHING
+            {returning_sql}
+        """
+    return f"""
+        INSERT INTO {table_name} ({col_names})
+        SELECT {col_names} FROM {staging_table}
+        ON CONFLICT ({', '.join(conflict_keys)}) DO UPDATE SET
+            {', '.join(f"{c} = EXCLUDED.{c}" for c in updated)}
+        WHERE ({', '.join(f"{table_name}.{c}" for c in updated)})
+            IS DISTINCT FROM ({', '.join(f"EXCLUDED.{c}" for c in updated)})
+        {returning_sql}
+    """
+
+def sync_table(table_name, sqlite_conn, pg_conn, page_size=PAGE_SIZE, months=None):
+    """
+    Upsert rows of a table changed since the last sync
 
-    # Prepare PostgreSQL insert
+    Tables with updated_at are paged by (updated_at, key) after the stored
+    high-water mark; every page and its new mark are committed together.
+    A finished run rereads rows of the mark's second next time, as SQLite
+    timestamps only have one-second resolution.
+    months (optional set) collects the mesic of inserted or changed rows.
+
+    Returns:
+        Number of inserted or changed rows
+    """
     pg_cursor = pg_conn.cursor()
-    placeholders = ", ".join(["%s"] * len(cols))
-    col_names = ", ".join(cols)
-    insert_query = f"INSERT INTO {table_name} ({col_names}) VALUES ({placeholders}) ON CONFLICT DO NOTHING"
+    pg_columns = get_postgres_columns(pg_cursor, table_name)
+    sqlite_columns = get_sqlite_columns(sqlite_conn, table_name)
+    conflict_keys = SYNC_CONFLICT_KEYS.get(table_name, ("id",))
+    columns = [c for c in sqlite_columns if c in pg_columns and (c != "id" or "id" in conflict_keys)]
+    col_names = ", ".join(columns)
+    staging_table = f"sync_{table_name}"
+
+    pg_cursor.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {staging_table} ON COMMIT DELETE ROWS AS
+        SELECT {col_names} FROM {table_name} WITH NO DATA
+    """)
+    collect_months = months is not None and "mesic" in columns
+    upsert_sql = _upsert_sql(table_name, staging_table, columns, conflict_keys,
+                             returning="mesic" if collect_months else None)
+
+    if "updated_at" not in sqlite_columns:
+        # Small reference table - compare everything, write only differences
+        copy_pages(pg_cursor, staging_table, columns,
+                   stream_rows(sqlite_conn, f"SELECT {col_names} FROM {table_name}"))
+        pg_cursor.execute(upsert_sql)
+        changed = pg_cursor.rowcount
+        if collect_months:
+            months.update(row[0] for row in pg_cursor.fetchall())
+        pg_conn.commit()
+        return changed
+
+    key = TABLE_KEYS.get(table_name, "id")
+    ts = "COALESCE(updated_at, created_at, '')" if "created_at" in sqlite_columns else "COALESCE(updated_at, '')"
+    mark = get_sync_mark(pg_cursor, table_name)
+    pg_conn.commit()
 
-    # Insert rows
-    inserted = 0
-    for _, row in df.iterrows():
-        try:
-            values = [row[col] for col in cols]
+    changed = 0
+    while True:
+        if mark is None:
+            where, params = "1 = 1", ()
+        elif mark["done"]:
+            where, params = f"{ts} >= ?", (mark["ts"],)
+        else:
+            where, params = f"({ts} > ? OR ({ts} = ? AND {key} > ?))", (mark["ts"], mark["ts"], mark["key"])
+        page = sqlite_conn.execute(f"""
+            SELECT {col_names}, {ts} AS sync_ts, {key} AS sync_key FROM {table_name}
+            WHERE {where}
+            ORDER BY {ts}, {key}
+            LIMIT ?
+        """, params + (page_size,)).fetchall()
+        if not page:
+            break
+
+        copy_pages(pg_cursor, staging_table, columns, [[tuple(row)[:len(columns)] for row in page]])
+        pg_cursor.execute(upsert_sql)
+        changed += pg_cursor.rowcount
+        if collect_months:
+            months.update(row[0] for row in pg_cursor.fetchall())
+        mark = {"ts": page[-1]["sync_ts"], "key": normalize_value(page[-1]["sync_key"]), "done": False}
+        save_sync_mark(pg_cursor, table_name, mark)
+        pg_conn.commit()
+
+    if mark is not None and not mark["done"]:
+        mark["done"] = True
+        save_sync_mark(pg_cursor, table_name, mark)
+        pg_conn.commit()
+    return changed
+
+def _sync_table_worker(table_name, months=None):
+    """Sync one table on its own SQLite and PostgreSQL connections (thread worker)"""
+    start = time.time()
+    sqlite_conn = get_sqlite_connection()
+    pg_conn = get_postgres_connection()
+    try:
+        changed = sync_table(table_name, sqlite_conn, pg_conn, months=months)
+        return table_name, changed, None, time.time() - start
+    except Exception as e:
+        pg_conn.rollback()
+        return table_name, 0, str(e), time.time() - start
+    finally:
+        sqlite_conn.close()
+        pg_conn.close()
 
-            # Apply transformation if provided
-            if transform_fn:
-                values = transform_fn(values, cols)
+def sync_waves(waves=MIGRATION_WAVES, max_workers=MAX_WORKERS, cube_months=None):
+    """Incrementally sync tables wave by wave, tables within a wave concurrently
 
-            pg_cursor.execute(insert_query, values)
-            inserted += 1
-        except Exception as e:
-            print(f"\n    ⚠️  Error inserting row: {str(e)}")
-            continue
+    cube_months (optional set) collects the months of changed evaluation rows.
+    """
+    def worker(table_name):
+        return _sync_table_worker(table_name, cube_months if table_name == CUBE_TABLE else None)
+    return run_waves(worker, waves, max_workers, label="rows synced")
 
-    pg_conn.commit()
-    print(f"✅ {inserted} rows migrated")
-    return inserted
+def _key_checksum(keys):
+    digest = hashlib.md5()
+    for i, key in enumerate(keys):
+        digest.update(((',' if i else '') + str(key)).encode('utf-8'))
+    return digest.hexdigest()
+
+def verify_migration(sqlite_conn, pg_conn, tables):
+    """Compare row counts and primary-key checksums of SQLite and PostgreSQL tables
+
+    Returns list of (table, sqlite_count, pg_count, checksums_match).
+    """
+    print("\n🔍 Verifying migration...")
+    pg_cursor = pg_conn.cursor()
+    report = []
+    for table in tables:
+        key = TABLE_KEYS.get(table, "id")
+        where = f" WHERE {VERIFY_FILTERS[table]}" if table in VERIFY_FILTERS else ""
+        # Text keys in code point order on both sides (Python sorted() = COLLATE "C"),
+        # whatever the database collation is
+        order = f'{key} COLLATE "C"' if table in TABLE_KEYS else key
+
+        sqlite_keys = sorted(normalize_value(row[0]) for page in
+                             stream_rows(sqlite_conn, f"SELECT {key} FROM {table}{where}") for row in page)
+        pg_cursor.execute(f"SELECT COUNT(*), md5(COALESCE(string_agg({key}::text, ',' ORDER BY {order}), '')) "
+                          f"FROM {table}{where}")
+        pg_count, pg_checksum = pg_cursor.fetchone()
+
+        match = len(sqlite_keys) == pg_count and _key_checksum(sqlite_keys) == pg_checksum
+        report.append((table, len(sqlite_keys), pg_count, match))
+        status = "✅" if match else "⚠️ "
+        print(f"  {status} {table}: SQLite {len(sqlite_keys)} / PostgreSQL {pg_count}" +
+              ("" if match else " - klíče se liší (v PostgreSQL jsou jiné nebo chybějící řádky)"))
+    return report
 
 def reset_sequences(pg_conn):
     """Reset PostgreSQL sequences to match current max IDs"""
@@ -134,6 +438,68 @@ def reset_sequences(pg_conn):
 
     pg_conn.commit()
 
+def rebuild_month_catalog(pg_conn):
+    """Rebuild the month catalog (month selector) from the migrated KPI data"""
+    print("\n📅 Rebuilding month catalog...")
+    import database_postgres as db  # needs the app's secrets, import only when used
+
+    pg_cursor = pg_conn.cursor()
+    try:
+        changed = db.refresh_month_catalog(pg_cursor)
+        pg_conn.commit()
+        print(f"  ✅ month_catalog: {'updated' if changed else 'up to date'}")
+    except Exception as e:
+        pg_conn.rollback()
+        print(f"  ⚠️  month_catalog: {str(e)}")
+
+def rebuild_kpi_cube(pg_conn, months=None):
+    """Rebuild the dashboards' KPI cube of the given months (None = all months)"""
+    print("\n🧊 Rebuilding KPI cube...")
+    import database_postgres as db  # needs the app's secrets, import only when used
+
+    pg_cursor = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        db.refresh_kpi_cube(pg_cursor, months)
+        pg_conn.commit()
+        print(f"  ✅ monthly_kpi_cube: {'all months' if months is None else ', '.join(sorted(months))}")
+    except Exception as e:
+        pg_conn.rollback()
+        print(f"  ⚠️  monthly_kpi_cube: {str(e)}")
+
+def sync():
+    """Incremental sync of changed rows (nightly job for stores on SQLite)"""
+    print("=" * 60)
+    print("🔄 RESTO v3 - SQLite → PostgreSQL Sync")
+    print("=" * 60)
+    print()
+
+    print("📊 Syncing changed rows...\n")
+    start = time.time()
+    cube_months = set()
+    results = sync_waves(cube_months=cube_months)
+    total_synced = sum(changed for changed, _ in results.values())
+    failed = [table for table, (_, error) in results.items() if error]
+
+    # Reference tables keep their SQLite ids
+    pg_conn = get_postgres_connection()
+    reset_sequences(pg_conn)
+    rebuild_month_catalog(pg_conn)
+    if any(results.get(table, (0, None))[0] for table in CUBE_REFERENCE_TABLES):
+        rebuild_kpi_cube(pg_conn)
+    elif cube_months:
+        rebuild_kpi_cube(pg_conn, cube_months)
+    pg_conn.close()
+
+    print()
+    print("=" * 60)
+    print(f"✅ Sync Complete!" if not failed else f"⚠️  Sync finished with errors: {', '.join(failed)}")
+    print(f"📊 Total rows synced: {total_synced} ({time.time() - start:.1f} s)")
+    print("=" * 60)
+    if failed:
+        print("\n📝 Spusťte synchronizaci znovu - pokračuje od poslední uložené dávky.")
+    print()
+    return not failed
+
 def main():
     """Main migration function"""
     print("=" * 60)
@@ -149,46 +515,20 @@ def main():
     print("  ✅ Connected to PostgreSQL")
     print()
 
-    # Migration order (respects foreign keys)
+    # Migration in dependency waves (respects foreign keys)
     print("📊 Starting migration...\n")
-
-    total_migrated = 0
-
-    # 1. Departments (no dependencies)
-    total_migrated += migrate_table("departments", sqlite_conn, pg_conn)
-
-    # 2. Locations (depends on departments)
-    total_migrated += migrate_table("locations", sqlite_conn, pg_conn)
-
-    # 3. Operational Managers (depends on departments)
-    total_migrated += migrate_table("operational_managers", sqlite_conn, pg_conn)
-
-    # 4. KPI Definitions (no dependencies)
-    total_migrated += migrate_table("kpi_definitions", sqlite_conn, pg_conn)
-
-    # 5. KPI Thresholds (depends on kpi_definitions)
-    total_migrated += migrate_table("kpi_thresholds", sqlite_conn, pg_conn)
-
-    # 6. Manager KPI Assignments (depends on managers and kpi_definitions)
-    total_migrated += migrate_table("manager_kpi_assignments", sqlite_conn, pg_conn)
-
-    # 7. Monthly KPI Data (depends on locations and kpi_definitions)
-    total_migrated += migrate_table("monthly_kpi_data", sqlite_conn, pg_conn)
-
-    # 8. Monthly KPI Evaluation (depends on locations and kpi_definitions)
-    total_migrated += migrate_table("monthly_kpi_evaluation", sqlite_conn, pg_conn)
-
-    # 9. Monthly Department KPI Data (depends on departments and kpi_definitions)
-    total_migrated += migrate_table("monthly_department_kpi_data", sqlite_conn, pg_conn)
-
-    # 10. Department Monthly Summary (depends on departments)
-    total_migrated += migrate_table("department_monthly_summary", sqlite_conn, pg_conn)
-
-    # 11. Settings (no dependencies)
-    total_migrated += migrate_table("settings", sqlite_conn, pg_conn)
+    start = time.time()
+    results = migrate_waves()
+    total_migrated = sum(inserted for inserted, _ in results.values())
+    failed = [table for table, (_, error) in results.items() if error]
 
     # Reset sequences
     reset_sequences(pg_conn)
+    rebuild_month_catalog(pg_conn)
+    rebuild_kpi_cube(pg_conn)
+
+    # Verify
+    report = verify_migration(sqlite_conn, pg_conn, [table for wave in MIGRATION_WAVES for table in wave])
 
     # Close connections
     sqlite_conn.close()
@@ -197,8 +537,9 @@ def main():
     # Summary
     print()
     print("=" * 60)
-    print(f"✅ Migration Complete!")
-    print(f"📊 Total rows migrated: {total_migrated}")
+    print(f"✅ Migration Complete!" if not failed else f"⚠️  Migration finished with errors: {', '.join(failed)}")
+    print(f"📊 Total rows migrated: {total_migrated} ({time.time() - start:.1f} s)")
+    print(f"🔍 Verified tables: {sum(1 for r in report if r[3])}/{len(report)}")
     print("=" * 60)
     print()
     print("🎉 Vaše data jsou nyní v Supabase PostgreSQL!")
@@ -208,8 +549,16 @@ def main():
     print()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RESTO SQLite → PostgreSQL migration")
+    parser.add_argument("--sync", action="store_true",
+                        help="přenést jen nové a změněné řádky od posledního běhu")
+    args = parser.parse_args()
     try:
-        main()
+        if args.sync:
+            if not sync():
+                sys.exit(1)
+        else:
+            main()
     except KeyboardInterrupt:
         print("\n\n❌ Migrace přerušena uživatelem")
         sys.exit(1)
@@ -0,0 +1,263 @@
+"""
+RESTO - Query Instrumentation
+Timing of every database statement, aggregated to find slow pages and queries:
+- Statements are grouped by fingerprint (literals, placeholders and value lists
+  collapsed), each call records duration, row count and the calling function
+- A Streamlit rerun is scoped to its script thread: begin_rerun() ... end_rerun()
+  collect the query count, time and cache hits/misses of one page render
+- Statements slower than slow_ms go to the slow log (recent entries in memory,
+  optionally appended to a JSON lines file)
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE)
+_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s|\?")
+_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_REPEATED_TUPLE = re.compile(r"(\([^()]*\))(?:\s*,\s*\1)+")
+_SPACE = re.compile(r"\s+")
+
+def sql_text(sql):
+    """Statement as text (psycopg2 passes bytes for execute_values)"""
+    if isinstance(sql, bytes):
+        return sql.decode('utf-8', 'replace')
+    return str(sql)
+
+def fingerprint(sql):
+    """Normalized statement text: same query shape -> same fingerprint"""
+    text = _STRING.sub("?", sql_text(sql))
+    text = _NUMBER.sub("?", text)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _LIST.sub("?, …", text)
+    text = _REPEATED_TUPLE.sub(r"\1, …", text)
+    return _SPACE.sub(" ", text).strip()
+
+class QueryRecorder:
+    """Thread-safe statement statistics, per-rerun summaries and slow log
+
+    skip_modules are module name prefixes ignored when looking for the calling
+    function (cursor wrappers, shared SQL helpers, drivers).
+    """
+
+    def __init__(self, slow_ms=200.0, slow_log=None, skip_modules=(), history=50, enabled=True):
+        self.enabled = enabled
+        self.slow_ms = float(slow_ms)
+        self.slow_log = slow_log
+        self._skip = tuple(skip_modules) + (__name__, 'psycopg2', 'pandas', 'sqlite3', 'contextlib', 'data_cache')
+        self._history = history
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._queries = {}  # fingerprint -> stats
+            self._pages = {}  # page -> stats
+            self._reruns = deque(maxlen=self._history)
+            self._slow = deque(maxlen=self._history)
+            self._open = {}  # thread ident -> rerun being recorded
+            self._last_error = None
+
+    # ---- recording ----
+
+    def _caller(self):
+        frame = sys._getframe(3)  # _caller <- measure <- cursor wrapper <- caller
+        while frame is not None:
+            module = frame.f_globals.get('__name__', '')
+            if not module.startswith(self._skip):
+                if module == '__main__':
+                    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+                return f"{module}.{frame.f_code.co_name}"
+            frame = frame.f_back
+        return None
+
+    def measure(self, cursor, sql, fn, *args):
+        """Run fn(*args) (the driver's execute) and record it as one statement"""
+        if not self.enabled:
+            return fn(*args)
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            rows = getattr(cursor, 'rowcount', -1)
+            self.record(sql, time.perf_counter() - start, rows if rows is not None and rows >= 0 else None,
+                        self._caller())
+
+    def record(self, sql, seconds, rows=None, caller=None):
+        ms = seconds * 1000.0
+        key = fingerprint(sql)
+        slow = None
+        with self._lock:
+            stats = self._queries.get(key)
+            if stats is None:
+                stats = self._queries[key] = {'query': key, 'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                              'rows': 0, 'callers': {}}
+            stats['calls'] += 1
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            stats['rows'] += rows or 0
+            if caller:
+                stats['callers'][caller] = stats['callers'].get(caller, 0) + 1
+
+            rerun = self._open.get(threading.get_ident())
+            if rerun is not None:
+                rerun['queries'] += 1
+                rerun['query_ms'] += ms
+                rerun['_last'] = time.perf_counter()
+                calls = rerun['by_query'].setdefault(key, [0, 0.0])
+                calls[0] += 1
+                calls[1] += ms
+
+            if ms >= self.slow_ms:
+                slow = {
+                    'time': time.time(),
+                    'ms': round(ms, 1),
+                    'rows': rows,
+                    'caller': caller,
+                    'page': rerun['page'] if rerun is not None else None,
+                    'query': key,
+                    'sql': sql_text(sql)[:2000],
+                }
+                self._slow.append(slow)
+                if rerun is not None:
+                    rerun['slow'] += 1
+        if slow is not None and self.slow_log:
+            self._write_slow(slow)
+
+    def record_cache(self, key, hit):
+        """Cache lookup of the current rerun (TaggedCache on_lookup hook)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            rerun = self._open.get(threading.get_ident())
+            if rerun is not None:
+                rerun['cache_hits' if hit else 'cache_misses'] += 1
+
+    def _write_slow(self, entry):
+        try:
+            with self._file_lock:
+                with open(self.slow_log, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            with self._lock:
+                self._last_error = str(e)
+
+    # ---- reruns ----
+
+    def begin_rerun(self, page=None):
+        """Start recording the rerun of the calling thread"""
+        if not self.enabled:
+            return
+        ident = threading.get_ident()
+        alive = {thread.ident for thread in threading.enumerate()}
+        with self._lock:
+            # Reruns ended by st.rerun()/st.stop() never reach end_rerun()
+            for other in [i for i in self._open if i == ident or i not in alive]:
+                self._finish(self._open.pop(other), complete=False)
+            self._open[ident] = {
+                'page': page, 'started': time.time(), '_start': time.perf_counter(), '_last': time.perf_counter(),
+                'queries': 0, 'query_ms': 0.0, 'cache_hits': 0, 'cache_misses': 0, 'slow': 0,
+                'by_query': {},
+            }
+
+    def set_page(self, page):
+        """Name the page of the calling thread's rerun once it is known"""
+        with self._lock:
+            rerun = self._open.get(threading.get_ident())
+            if rerun is not None:
+                rerun['page'] = page
+
+    def end_rerun(self):
+        """Finish the calling thread's rerun, returns its summary (None when not recording)"""
+        with self._lock:
+            rerun = self._open.pop(threading.get_ident(), None)
+            if rerun is None:
+                return None
+            return self._finish(rerun, complete=True)
+
+    def _finish(self, rerun, complete):
+        """Turn an open rerun into its summary (caller holds the lock)"""
+        by_query = rerun.pop('by_query')
+        # An interrupted rerun ends with its last statement
+        end = time.perf_counter() if complete else rerun['_last']
+        rerun['total_ms'] = (end - rerun.pop('_start')) * 1000.0
+        del rerun['_last']
+        rerun['complete'] = complete
+        rerun['page'] = rerun['page'] or "?"
+        if by_query:
+            top, (calls, ms) = max(by_query.items(), key=lambda item: item[1][1])
+            rerun['top_query'], rerun['top_calls'], rerun['top_ms'] = top, calls, ms
+        else:
+            rerun['top_query'], rerun['top_calls'], rerun['top_ms'] = None, 0, 0.0
+        rerun['distinct_queries'] = len(by_query)
+        self._reruns.append(rerun)
+
+        page = self._pages.get(rerun['page'])
+        if page is None:
+            page = self._pages[rerun['page']] = {'page': rerun['page'], 'reruns': 0, 'queries': 0, 'query_ms': 0.0,
+                                                 'max_queries': 0, 'max_query_ms': 0.0,
+                                                 'cache_hits': 0, 'cache_misses': 0, 'slow': 0}
+        page['reruns'] += 1
+        page['queries'] += rerun['queries']
+        page['query_ms'] += rerun['query_ms']
+        page['max_queries'] = max(page['max_queries'], rerun['queries'])
+        page['max_query_ms'] = max(page['max_query_ms'], rerun['query_ms'])
+        page['cache_hits'] += rerun['cache_hits']
+        page['cache_misses'] += rerun['cache_misses']
+        page['slow'] += rerun['slow']
+        return dict(rerun)
+
+    # ---- reports ----
+
+    def top_queries(self, limit=10, order='total_ms'):
+        """Statement fingerprints with the highest total (or max/calls) cost"""
+        with self._lock:
+            queries = [dict(stats, callers=dict(stats['callers'])) for stats in self._queries.values()]
+        queries.sort(key=lambda stats: stats[order], reverse=True)
+        for stats in queries:
+            stats['avg_ms'] = stats['total_ms'] / stats['calls']
+            stats['caller'] = max(stats['callers'], key=stats['callers'].get) if stats['callers'] else None
+        return queries[:limit]
+
+    def pages(self):
+        """Per-page totals of the recorded reruns"""
+        with self._lock:
+            pages = [dict(page) for page in self._pages.values()]
+        for page in pages:
+            page['avg_queries'] = page['queries'] / page['reruns']
+            page['avg_query_ms'] = page['query_ms'] / page['reruns']
+            lookups = page['cache_hits'] + page['cache_misses']
+            page['cache_hit_ratio'] = page['cache_hits'] / lookups if lookups else None
+        return sorted(pages, key=lambda page: page['query_ms'], reverse=True)
+
+    def reruns(self, limit=None):
+        """Most recent rerun summaries, newest first"""
+        with self._lock:
+            reruns = [dict(rerun) for rerun in reversed(self._reruns)]
+        return reruns[:limit] if limit else reruns
+
+    def slow_queries(self, limit=None):
+        """Most recent slow statements, newest first"""
+        with self._lock:
+            slow = [dict(entry) for entry in reversed(self._slow)]
+        return slow[:limit] if limit else slow
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'slow_ms': self.slow_ms,
+                'slow_log': self.slow_log,
+                'statements': sum(stats['calls'] for stats in self._queries.values()),
+                'fingerprints': len(self._queries),
+                'rerun_count': sum(page['reruns'] for page in self._pages.values()),
+                'slow': len(self._slow),
+                'last_error': self._last_error,
+            }
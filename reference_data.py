@@ -0,0 +1,151 @@
+"""
+RESTO - Reference Data Store
+Departments, locations, managers, KPI definitions and thresholds held once per process:
+- A snapshot is immutable: every table is a tuple of named rows with id/name/group
+  indexes, so lookups such as "location by name" are dictionary hits
+- Each table's DataFrame is built once per snapshot and shared by all sessions;
+  callers get frame_copy(), which is shallow only when pandas copies on write
+  (pandas 3, or pandas 2 with mode.copy_on_write) and deep otherwise, so their
+  changes never leak back into the snapshot
+- Writers bump the version; the next reader loads a fresh snapshot while
+  sessions holding the old one keep a consistent view
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+def copy_on_write():
+    """True when pandas copies shared data on write (always from pandas 3)"""
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    return pd.options.mode.copy_on_write is True
+
+ReferenceData = namedtuple('ReferenceData', ['version', 'departments', 'locations', 'managers', 'kpis', 'thresholds'])
+
+class ReferenceTable:
+    """Read-only table: rows in query order plus id, label and group indexes"""
+
+    def __init__(self, name, columns, records, label=None, group_by=None):
+        self.name = name
+        self.columns = tuple(columns)
+        self.Row = namedtuple(f"{name}_row", self.columns)
+        self.rows = tuple(self.Row(*(record[c] for c in self.columns)) for record in records)
+        self._by_id = {row.id: row for row in self.rows}
+        self._by_label = {}
+        if label:
+            for row in self.rows:
+                self._by_label.setdefault(getattr(row, label), row)  # first row wins, like .iloc[0]
+        self._groups = {}
+        if group_by:
+            for row in self.rows:
+                self._groups.setdefault(getattr(row, group_by), []).append(row)
+            self._groups = {key: tuple(rows) for key, rows in self._groups.items()}
+        self._frame = None
+        self._frame_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def get(self, row_id):
+        """Row by id (None when missing)"""
+        return self._by_id.get(int(row_id)) if row_id is not None else None
+
+    def by_label(self, label):
+        """Row by name (nazev/jmeno), None when missing"""
+        return self._by_label.get(label)
+
+    def id_of(self, label):
+        """ID of the row with this name (None when missing)"""
+        row = self._by_label.get(label)
+        return row.id if row is not None else None
+
+    def labels(self):
+        return list(self._by_label)
+
+    def group(self, key):
+        """Rows whose group column equals key (e.g. locations of a department)"""
+        return self._groups.get(key, ())
+
+    def to_frame(self, rows=None):
+        """New DataFrame of the given rows (all rows by default)"""
+        return pd.DataFrame(list(self.rows if rows is None else rows), columns=list(self.columns))
+
+    @property
+    def frame(self):
+        """DataFrame of all rows, built once and shared - treat as read-only"""
+        if self._frame is None:
+            with self._frame_lock:
+                if self._frame is None:
+                    self._frame = self.to_frame()
+        return self._frame
+
+    def frame_copy(self, columns=None):
+        """The shared frame (optionally only some columns) as the caller's own DataFrame"""
+        frame = self.frame if columns is None else self.frame[list(columns)]
+        return frame.copy(deep=not copy_on_write())
+
+class ReferenceStore:
+    """Process-wide holder of the current ReferenceData snapshot
+
+    loader(version) returns a ReferenceData; it runs on first use, after
+    invalidate() and when the snapshot is older than ttl seconds.
+    """
+
+    def __init__(self, loader, ttl):
+        self._loader = loader
+        self._ttl = ttl
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._version = 0
+        self._loads = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _current(self):
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != self._version:
+            return None
+        if time.monotonic() - self._loaded_at > self._ttl:
+            return None
+        return snapshot
+
+    def get(self):
+        with self._lock:
+            snapshot = self._current()
+        if snapshot is not None:
+            return snapshot
+
+        with self._load_lock:  # one loader at a time, others wait and reuse its result
+            with self._lock:
+                snapshot = self._current()
+                version = self._version
+            if snapshot is not None:
+                return snapshot
+            snapshot = self._loader(version)
+            with self._lock:
+                # An invalidation during the load leaves version != snapshot.version,
+                # so the next get() loads again
+                self._snapshot = snapshot
+                self._loaded_at = time.monotonic()
+                self._loads += 1
+            return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+
+    def stats(self):
+        with self._lock:
+            snapshot = self._snapshot
+            return {
+                'version': self._version,
+                'loads': self._loads,
+                'current': snapshot is not None and snapshot.version == self._version,
+                'age_s': round(time.monotonic() - self._loaded_at, 1) if snapshot is not None else None,
+            }
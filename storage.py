@@ -0,0 +1,1160 @@
+"""
+RESTO - Shared Storage Code
+Queries and writes written once for PostgreSQL and SQLite:
+- Shared SQL uses %s placeholders; a Dialect adapts it to the database
+  (placeholders, array filters, value lists, bulk upserts, new ids)
+- KPI data, evaluation and department summary queries run on the caller's
+  cursor; reference reads and admin writes (departments, locations, managers,
+  KPI definitions, thresholds, own department KPIs) take the dialect and use
+  its backend hooks: connection(), reference_data(), rules() and the
+  changed()/committed() write hooks
+- database_postgres.py and database.py implement the hooks in their Dialect
+  subclass; pooling, the tagged cache, the recalculation queue and the KPI
+  cube exist only in database_postgres.py
+- get_backend() selects the module for the app, scripts and benchmarks
+  (RESTO_BACKEND environment variable or backend in the [database] secrets);
+  both modules implement BACKEND_API
+"""
+
+import importlib
+import logging
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+
+import bonus_engine
+import reference_data
+
+logger = logging.getLogger(__name__)
+
+# ============ DIALECTS ============
+
+class Dialect(ABC):
+    """SQL differences between the backends (shared SQL uses %s placeholders)"""
+
+    name = None
+
+    def sql(self, query):
+        return query
+
+    def execute(self, cursor, query, params=()):
+        cursor.execute(self.sql(query), tuple(params))
+
+    @abstractmethod
+    def in_list(self, column, values):
+        """Filter "column is one of values" as (SQL fragment, params)"""
+
+    @abstractmethod
+    def insert_values(self, cursor, query, rows, template):
+        """Run a multi-row INSERT; query contains "VALUES %s", template is one row"""
+
+    @abstractmethod
+    def text_table(self, alias, column, values):
+        """Derived table of text values for FROM/JOIN as (SQL fragment, params)"""
+
+    @abstractmethod
+    def insert_id(self, cursor, query, params=()):
+        """Run a single-row INSERT and return the new id"""
+
+    # Backend hooks - implemented by the Dialect subclass of each backend module
+
+    @abstractmethod
+    def connection(self):
+        """Context manager of a connection; the caller commits, the rest is rolled back"""
+
+    @abstractmethod
+    def reference_data(self):
+        """Current reference_data.ReferenceData snapshot"""
+
+    def rules(self, cursor):
+        """Compiled threshold rules to evaluate with (None = load them per call)"""
+        return None
+
+    def changed(self, cursor, table, keys=()):
+        """Keep derived data in step with a write, inside its transaction
+
+        keys are department ids for locations/operational_managers and KPI ids
+        for kpi_thresholds.
+        """
+
+    def committed(self, table, keys=()):
+        """Invalidate cached reads after a committed write (same keys as changed())"""
+
+class PostgresDialect(Dialect):
+    name = 'postgres'
+
+    def in_list(self, column, values):
+        return f"{column} = ANY(%s)", [list(values)]
+
+    def insert_values(self, cursor, query, rows, template):
+        import psycopg2.extras
+        if rows:
+            psycopg2.extras.execute_values(cursor, query, rows, template=template, page_size=len(rows))
+
+    def text_table(self, alias, column, values):
+        return f"unnest(%s::text[]) AS {alias}({column})", [list(values)]
+
+    def insert_id(self, cursor, query, params=()):
+        self.execute(cursor, query + " RETURNING id", params)
+        return fetch_value(cursor)
+
+class SqliteDialect(Dialect):
+    name = 'sqlite'
+
+    def sql(self, query):
+        return query.replace("%s", "?")
+
+    def in_list(self, column, values):
+        values = list(values)
+        if not values:
+            return "1 = 0", []
+        return f"{column} IN ({', '.join(['%s'] * len(values))})", values
+
+    def insert_values(self, cursor, query, rows, template):
+        if rows:
+            cursor.executemany(self.sql(query.replace("VALUES %s", f"VALUES {template}", 1)), rows)
+
+    def text_table(self, alias, column, values):
+        values = list(values)
+        return f"({' UNION ALL '.join([f'SELECT %s AS {column}'] * len(values))}) AS {alias}", values
+
+    def insert_id(self, cursor, query, params=()):
+        self.execute(cursor, query, params)
+        return cursor.lastrowid
+
+def safe_convert_id(value):
+    """Safely convert any ID value to Python int (handles numpy, pandas types)"""
+    if value is None:
+        return None
+
+    # Handle string representations
+    if isinstance(value, str):
+        try:
+            return int(float(value))
+        except (ValueError, TypeError):
+            pass
+
+    # Handle numeric types
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return int(value)
+    if isinstance(value, bytes):
+        return int.from_bytes(value, byteorder='little')
+
+    # Handle pandas/numpy scalar types
+    if hasattr(value, 'item'):
+        try:
+            return int(value.item())
+        except (ValueError, TypeError, AttributeError):
+            pass
+
+    # Last resort: try direct conversion
+    try:
+        # Handle any other numeric-like types
+        converted = float(value)
+        return int(converted)
+    except (ValueError, TypeError) as e:
+        # Better error message with type info
+        raise ValueError(f"Cannot convert {type(value).__name__} (module: {type(value).__module__}) value '{value}' to int. Error: {e}")
+
+def fetch_value(cursor):
+    """First column of the next row (None when there is none)"""
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+def fetch_frame(cursor, columns=None):
+    """Rows of the last query as a DataFrame (dict rows and tuple rows alike)"""
+    rows = cursor.fetchall()
+    names = columns or [d[0] for d in cursor.description]
+    return pd.DataFrame([tuple(row.values()) if isinstance(row, dict) else tuple(row) for row in rows],
+                        columns=names)
+
+# ============ BACKEND SELECTION ============
+
+BACKENDS = {
+    'postgres': 'database_postgres',
+    'sqlite': 'database',
+}
+
+# Functions every backend module provides with the same signature and results:
+# what app_cz.py, the scripts and the benchmarks call on the module that
+# get_backend() returns. The PostgreSQL-only services (pool, read cache, change
+# listener, recalculation worker) have SQLite versions that report None/False.
+BACKEND_API = (
+    'add_department',
+    'add_kpi_definition',
+    'add_kpi_threshold',
+    'add_location',
+    'add_monthly_department_kpi_data_bulk',
+    'add_monthly_kpi_data',
+    'add_monthly_kpi_data_bulk',
+    'add_operational_manager',
+    'begin_rerun',
+    'calculate_bonus_for_value',
+    'calculate_department_summary',
+    'calculate_monthly_kpi_evaluation',
+    'clear_cache',
+    'connection',
+    'delete_department',
+    'delete_kpi_definition',
+    'delete_kpi_threshold',
+    'delete_location',
+    'delete_monthly_kpi_data',
+    'delete_operational_manager',
+    'end_rerun',
+    'enqueue_recalculation',
+    'explain_hot_queries',
+    'generate_import_template',
+    'get_all_kpi_definitions',
+    'get_all_months_with_data',
+    'get_cache_stats',
+    'get_departments',
+    'get_departments_with_vlastni_kpi',
+    'get_dirty_months',
+    'get_kpi_definitions',
+    'get_kpi_evaluation_range',
+    'get_kpi_thresholds',
+    'get_listener_stats',
+    'get_locations',
+    'get_manager_kpi_details',
+    'get_manager_kpi_summary',
+    'get_manager_kpis',
+    'get_monthly_department_kpi_data',
+    'get_monthly_kpi_by_location_month',
+    'get_monthly_kpi_data',
+    'get_monthly_kpi_evaluation',
+    'get_operational_managers',
+    'get_pool_stats',
+    'get_query_stats',
+    'get_recalc_concurrency',
+    'get_recalc_queue_stats',
+    'get_recalc_status',
+    'get_reference_data',
+    'get_reference_stats',
+    'import_monthly_data_csv',
+    'import_monthly_data_excel',
+    'init_database',
+    'insert_default_data',
+    'invalidate_cache',
+    'load_kpi_thresholds',
+    'refresh_month_catalog',
+    'reset_query_stats',
+    'set_manager_kpis',
+    'set_rerun_page',
+    'start_change_listener',
+    'start_recalc_worker',
+    'update_department_vlastni_kpi',
+    'update_kpi_definition',
+    'update_kpi_threshold',
+    'update_location_department',
+)
+
+def backend_name():
+    """Configured backend: RESTO_BACKEND, else backend in [database] secrets, else postgres"""
+    name = os.environ.get("RESTO_BACKEND")
+    if not name:
+        try:
+            import streamlit as st
+            name = st.secrets["database"].get("backend")
+        except Exception:
+            name = None
+    return (name or 'postgres').lower()
+
+def get_backend(name=None):
+    """Backend module by name (default: the configured one)"""
+    name = (name or backend_name()).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Neznámý backend databáze: {name} (podporované: {', '.join(BACKENDS)})")
+    module = importlib.import_module(BACKENDS[name])
+    missing = [fn for fn in BACKEND_API if not callable(getattr(module, fn, None))]
+    if missing:
+        raise ValueError(f"Backend {name} neimplementuje: {', '.join(missing)}")
+    return module
+
+# ============ INDEXES ============
+
+# Indexes of the hot KPI reads, valid in both dialects (partial indexes need
+# SQLite 3.8+); database_postgres.py adds the ones of its PostgreSQL-only tables
+INDEX_STATEMENTS = [
+    """CREATE INDEX IF NOT EXISTS idx_monthly_kpi_data_active_mesic
+       ON monthly_kpi_data (mesic DESC) WHERE status = 'ACTIVE'""",
+    """CREATE INDEX IF NOT EXISTS idx_monthly_kpi_data_active_location
+       ON monthly_kpi_data (location_id, mesic DESC) WHERE status = 'ACTIVE'""",
+    """CREATE INDEX IF NOT EXISTS idx_monthly_kpi_data_active_kpi
+       ON monthly_kpi_data (kpi_id, mesic DESC) WHERE status = 'ACTIVE'""",
+    """CREATE INDEX IF NOT EXISTS idx_monthly_kpi_evaluation_location
+       ON monthly_kpi_evaluation (location_id, mesic DESC)""",
+    """CREATE INDEX IF NOT EXISTS idx_monthly_kpi_evaluation_kpi
+       ON monthly_kpi_evaluation (kpi_id, mesic DESC)""",
+    """CREATE INDEX IF NOT EXISTS idx_monthly_department_kpi_data_active_department
+       ON monthly_department_kpi_data (department_id, mesic DESC) WHERE status = 'ACTIVE'""",
+    """CREATE INDEX IF NOT EXISTS idx_locations_department
+       ON locations (department_id) WHERE aktivni = TRUE""",
+]
+
+# ============ THRESHOLDS ============
+
+def load_kpi_thresholds(cursor, dialect, kpi_ids=None):
+    """Load KPI threshold rules in one query (input for bonus_engine)"""
+    query = """
+        SELECT id, kpi_id, min_hodnota, max_hodnota, operator, bonus_procento, poradi
+        FROM kpi_thresholds
+    """
+    params = []
+    if kpi_ids is not None:
+        condition, params = dialect.in_list("kpi_id", [int(k) for k in kpi_ids])
+        query += f" WHERE {condition}"
+    dialect.execute(cursor, query + " ORDER BY kpi_id, poradi, id", params)
+    return bonus_engine.prepare_thresholds(fetch_frame(cursor))
+
+# ============ MONTHLY KPI DATA ============
+
+MONTHLY_KPI_DATA_COLUMNS = ['id', 'mesic', 'location_id', 'location', 'kpi_id', 'kpi_nazev', 'jednotka',
+                            'hodnota', 'status', 'poznamka', 'zdroj', 'created_at', 'updated_at']
+
+ALL_MONTHS_SQL = """
+    SELECT DISTINCT mesic
+    FROM monthly_kpi_data
+    WHERE status = 'ACTIVE'
+    ORDER BY mesic DESC
+"""
+
+def monthly_kpi_data_query(mesic=None, location_id=None, kpi_id=None):
+    """SQL (%s placeholders) and params of the monthly KPI data listing"""
+    query = """
+        SELECT
+            d.id, d.mesic, d.location_id, l.nazev as location,
+            d.kpi_id, k.nazev as kpi_nazev, k.jednotka,
+            d.hodnota, d.status, d.poznamka, d.zdroj,
+            d.created_at, d.updated_at
+        FROM monthly_kpi_data d
+        JOIN locations l ON d.location_id = l.id
+        JOIN kpi_definitions k ON d.kpi_id = k.id
+        WHERE d.status = 'ACTIVE'
+    """
+
+    params = []
+    if mesic:
+        query += " AND d.mesic = %s"
+        params.append(mesic)
+    if location_id:
+        query += " AND d.location_id = %s"
+        params.append(location_id)
+    if kpi_id:
+        query += " AND d.kpi_id = %s"
+        params.append(kpi_id)
+
+    query += " ORDER BY d.mesic DESC, l.nazev, k.poradi"
+    return query, params
+
+def fetch_monthly_kpi_data(cursor, dialect, mesic=None, location_id=None, kpi_id=None):
+    query, params = monthly_kpi_data_query(mesic, location_id, kpi_id)
+    dialect.execute(cursor, query, params)
+    return fetch_frame(cursor, MONTHLY_KPI_DATA_COLUMNS)
+
+def fetch_kpi_by_location_month(cursor, dialect, mesic, location_id):
+    dialect.execute(cursor, """
+        SELECT
+            d.kpi_id, k.nazev, k.jednotka, k.poradi,
+            d.hodnota, d.poznamka
+        FROM monthly_kpi_data d
+        JOIN kpi_definitions k ON d.kpi_id = k.id
+        WHERE d.mesic = %s AND d.location_id = %s AND d.status = 'ACTIVE'
+        ORDER BY k.poradi
+    """, (mesic, location_id))
+    return fetch_frame(cursor, ['kpi_id', 'nazev', 'jednotka', 'poradi', 'hodnota', 'poznamka'])
+
+def fetch_months(cursor, dialect):
+    """Months with active KPI data, newest first (full scan - see the month catalog)"""
+    dialect.execute(cursor, ALL_MONTHS_SQL)
+    return fetch_frame(cursor, ['mesic'])['mesic'].tolist()
+
+def fetch_import_lookups(cursor, dialect):
+    """Name -> ID dictionaries for imports: ({location nazev: id}, {kpi nazev: id})"""
+    location_ids = {}
+    dialect.execute(cursor, "SELECT id, nazev FROM locations ORDER BY aktivni DESC, id")
+    for row in fetch_frame(cursor, ['id', 'nazev']).itertuples(index=False):
+        location_ids.setdefault(row.nazev, int(row.id))
+    dialect.execute(cursor, "SELECT id, nazev FROM kpi_definitions")
+    kpi_ids = {row.nazev: int(row.id) for row in fetch_frame(cursor, ['id', 'nazev']).itertuples(index=False)}
+    return location_ids, kpi_ids
+
+def inactive_ids(cursor, dialect, table, ids):
+    """IDs from ids that do not exist in table or are not active (one query)"""
+    ids = [int(i) for i in ids]
+    condition, params = dialect.in_list("id", ids)
+    dialect.execute(cursor, f"SELECT id FROM {table} WHERE {condition} AND aktivni = TRUE", params)
+    active = set(fetch_frame(cursor, ['id'])['id'].tolist())
+    return [i for i in ids if i not in active]
+
+def upsert_kpi_values(cursor, dialect, rows):
+    """Insert or update (mesic, location_id, kpi_id, hodnota, poznamka, zdroj) rows
+
+    Runs on the caller's cursor/transaction (no commit).
+    """
+    dialect.insert_values(cursor, """
+        INSERT INTO monthly_kpi_data
+        (mesic, location_id, kpi_id, hodnota, poznamka, zdroj, status, updated_at)
+        VALUES %s
+        ON CONFLICT(mesic, location_id, kpi_id)
+        DO UPDATE SET
+            hodnota = EXCLUDED.hodnota,
+            poznamka = EXCLUDED.poznamka,
+            updated_at = CURRENT_TIMESTAMP,
+            zdroj = EXCLUDED.zdroj
+    """, [tuple(row) for row in rows], "(%s, %s, %s, %s, %s, %s, 'ACTIVE', CURRENT_TIMESTAMP)")
+
+def delete_kpi_values(cursor, dialect, mesic, location_id):
+    """Delete a location's KPI data and evaluation of one month (no commit)"""
+    dialect.execute(cursor, """
+        DELETE FROM monthly_kpi_data
+        WHERE mesic = %s AND location_id = %s
+    """, (mesic, location_id))
+    dialect.execute(cursor, """
+        DELETE FROM monthly_kpi_evaluation
+        WHERE mesic = %s AND location_id = %s
+    """, (mesic, location_id))
+
+# ============ EVALUATION ============
+
+def evaluate_month(cursor, dialect, mesic, rules, location_ids=None):
+    """Evaluate one month set-based and bulk upsert monthly_kpi_evaluation
+
+    Runs on the caller's cursor/transaction (no commit). Returns the frame of
+    evaluated rows (location_id, kpi_id, hodnota, splneno, bonus_procento).
+    """
+    query = """
+        SELECT d.location_id, d.kpi_id, d.hodnota
+        FROM monthly_kpi_data d
+        WHERE d.mesic = %s AND d.status = 'ACTIVE'
+    """
+    params = [mesic]
+    if location_ids is not None:
+        condition, location_params = dialect.in_list("d.location_id", [int(l) for l in location_ids])
+        query += f" AND {condition}"
+        params += location_params
+    dialect.execute(cursor, query, params)
+
+    data = fetch_frame(cursor, ['location_id', 'kpi_id', 'hodnota'])
+    return upsert_evaluation(cursor, dialect, mesic, data, rules)
+
+def upsert_evaluation(cursor, dialect, mesic, data, rules):
+    """Evaluate the given (location_id, kpi_id, hodnota) rows and bulk upsert them
+
+    Runs on the caller's cursor/transaction (no commit). Returns data with
+    splneno and bonus_procento columns added.
+    """
+    if data.empty:
+        return data.assign(splneno=pd.Series(dtype=int), bonus_procento=pd.Series(dtype=float))
+
+    data = data.join(bonus_engine.evaluate_bonuses(data, rules))
+
+    rows = list(zip(
+        [mesic] * len(data),
+        data['location_id'].tolist(),
+        data['kpi_id'].tolist(),
+        data['hodnota'].tolist(),
+        data['splneno'].tolist(),
+        data['bonus_procento'].tolist(),
+    ))
+    dialect.insert_values(cursor, """
+        INSERT INTO monthly_kpi_evaluation
+        (mesic, location_id, kpi_id, hodnota, splneno, bonus_procento, updated_at)
+        VALUES %s
+        ON CONFLICT(mesic, location_id, kpi_id)
+        DO UPDATE SET
+            hodnota = EXCLUDED.hodnota,
+            splneno = EXCLUDED.splneno,
+            bonus_procento = EXCLUDED.bonus_procento,
+            updated_at = CURRENT_TIMESTAMP
+    """, rows, "(%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)")
+    return data
+
+def fetch_kpi_evaluation(cursor, dialect, mesic, location_id=None):
+    query = """
+        SELECT
+            e.mesic, e.location_id, l.nazev as location,
+            e.kpi_id, k.nazev as kpi_nazev, k.jednotka,
+            e.hodnota, e.splneno, e.bonus_procento
+        FROM monthly_kpi_evaluation e
+        LEFT JOIN locations l ON e.location_id = l.id
+        LEFT JOIN kpi_definitions k ON e.kpi_id = k.id
+        WHERE e.mesic = %s
+    """
+
+    params = [mesic]
+    if location_id:
+        query += " AND e.location_id = %s"
+        params.append(location_id)
+
+    query += " ORDER BY l.nazev, k.poradi"
+    dialect.execute(cursor, query, params)
+    return fetch_frame(cursor)
+
+EVALUATION_RANGE_COLUMNS = ['mesic', 'location_id', 'location', 'department_id', 'kpi_id', 'kpi_nazev', 'jednotka',
+                            'hodnota', 'splneno', 'bonus_procento']
+
+def fetch_kpi_evaluation_range(cursor, dialect, start_mesic, end_mesic, location_ids=None, kpi_ids=None):
+    """Evaluation of all months from start_mesic to end_mesic (inclusive), optionally of some locations/KPIs"""
+    query = """
+        SELECT
+            e.mesic, e.location_id, l.nazev as location, l.department_id,
+            e.kpi_id, k.nazev as kpi_nazev, k.jednotka,
+            e.hodnota, e.splneno, e.bonus_procento
+        FROM monthly_kpi_evaluation e
+        LEFT JOIN locations l ON e.location_id = l.id
+        LEFT JOIN kpi_definitions k ON e.kpi_id = k.id
+        WHERE e.mesic BETWEEN %s AND %s
+    """
+    params = [start_mesic, end_mesic]
+    for column, ids in [('e.location_id', location_ids), ('e.kpi_id', kpi_ids)]:
+        if ids is not None:
+            condition, ids = dialect.in_list(column, ids)
+            query += f" AND {condition}"
+            params += ids
+
+    dialect.execute(cursor, query + " ORDER BY e.mesic, l.nazev, k.poradi", params)
+    return fetch_frame(cursor, EVALUATION_RANGE_COLUMNS)
+
+def pivot_kpi_evaluation_range(df):
+    """One row per month with (value, location_id, kpi_id) MultiIndex columns for hodnota, splneno and bonus_procento"""
+    return df.pivot(index='mesic', columns=['location_id', 'kpi_id'],
+                    values=['hodnota', 'splneno', 'bonus_procento']).sort_index(axis=1)
+
+# ============ MANAGER KPI TOTALS ============
+
+# The manager and KPI rows of PostgreSQL's monthly_kpi_cube computed from the
+# evaluation: every active manager with the active locations of the department
+MANAGER_KPI_SUMMARY_SQL = """
+    SELECT
+        om.id as manager_id, om.jmeno, om.department_id, d.nazev as department,
+        COALESCE(SUM(e.bonus_procento), 0) as total_bonus, COUNT(e.kpi_id) as total_kpis,
+        COALESCE(SUM(e.splneno), 0) as met_kpis, COUNT(DISTINCT e.location_id) as locations_with_data,
+        COUNT(DISTINCT l.id) as location_count,
+        COALESCE(SUM(e.bonus_procento), 0) * 1.0 / COUNT(DISTINCT l.id) as avg_bonus
+    FROM operational_managers om
+    JOIN departments d ON om.department_id = d.id
+    JOIN locations l ON l.department_id = om.department_id AND l.aktivni = TRUE
+    LEFT JOIN monthly_kpi_evaluation e ON e.mesic = %s AND e.location_id = l.id
+    WHERE om.aktivni = TRUE
+    GROUP BY om.id, om.jmeno, om.department_id, d.nazev
+    ORDER BY d.nazev, om.jmeno
+"""
+
+MANAGER_KPI_DETAIL_SQL = """
+    SELECT
+        om.id as manager_id, om.jmeno, om.department_id, l.id as location_id, l.nazev as location,
+        e.kpi_id, k.nazev as kpi_nazev, k.jednotka,
+        e.hodnota, e.splneno, e.bonus_procento
+    FROM operational_managers om
+    JOIN departments d ON om.department_id = d.id
+    JOIN locations l ON l.department_id = om.department_id AND l.aktivni = TRUE
+    JOIN monthly_kpi_evaluation e ON e.mesic = %s AND e.location_id = l.id
+    LEFT JOIN kpi_definitions k ON e.kpi_id = k.id
+    WHERE om.aktivni = TRUE
+    ORDER BY d.nazev, om.jmeno, l.nazev, k.poradi
+"""
+
+MANAGER_KPI_SUMMARY_COLUMNS = ['manager_id', 'jmeno', 'department_id', 'department', 'total_bonus', 'total_kpis',
+                               'met_kpis', 'locations_with_data', 'location_count', 'avg_bonus']
+MANAGER_KPI_DETAIL_COLUMNS = ['manager_id', 'jmeno', 'department_id', 'location_id', 'location', 'kpi_id',
+                              'kpi_nazev', 'jednotka', 'hodnota', 'splneno', 'bonus_procento']
+
+def fetch_manager_kpi_summary(cursor, dialect, mesic):
+    dialect.execute(cursor, MANAGER_KPI_SUMMARY_SQL, (mesic,))
+    return fetch_frame(cursor, MANAGER_KPI_SUMMARY_COLUMNS)
+
+def fetch_manager_kpi_details(cursor, dialect, mesic):
+    dialect.execute(cursor, MANAGER_KPI_DETAIL_SQL, (mesic,))
+    return fetch_frame(cursor, MANAGER_KPI_DETAIL_COLUMNS)
+
+# ============ DEPARTMENT SUMMARY ============
+
+DEPARTMENT_SUMMARY_COLUMNS = ['mesic', 'department_id', 'celkovy_bonus', 'aktivnich_kpi', 'splnenych_kpi']
+
+def summarize_departments(cursor, dialect, months, rules=None, department_ids=None):
+    """Compute and upsert department_monthly_summary rows for the given months
+
+    Location-average departments come from one GROUP BY query over
+    departments/locations/monthly_kpi_evaluation; own-KPI departments evaluate
+    their ACTIVE values with the compiled threshold rules (loaded here when
+    rules is None).
+    department_ids limits the recalculation to some departments. Runs on the
+    caller's cursor/transaction (no commit) and returns the upserted rows.
+    """
+    months = list(months)
+    columns = DEPARTMENT_SUMMARY_COLUMNS
+    if not months:
+        return pd.DataFrame(columns=columns)
+    department_filter, department_params = "", []
+    if department_ids is not None:
+        department_filter, department_params = dialect.in_list("d.id", [int(d) for d in department_ids])
+        department_filter = f" AND {department_filter}"
+
+    # Location-average departments: one row per (month, department, active location)
+    month_table, month_params = dialect.text_table("m", "mesic", months)
+    dialect.execute(cursor, f"""
+        SELECT
+            m.mesic, d.id as department_id, l.id as location_id,
+            SUM(e.bonus_procento) as total_bonus,
+            COUNT(e.id) as kpi_count,
+            SUM(e.splneno) as met_count
+        FROM departments d
+        CROSS JOIN {month_table}
+        LEFT JOIN locations l ON l.department_id = d.id AND l.aktivni = TRUE
+        LEFT JOIN monthly_kpi_evaluation e ON e.location_id = l.id AND e.mesic = m.mesic
+        WHERE d.aktivni = TRUE AND NOT COALESCE(d.ma_vlastni_kpi, FALSE){department_filter}
+        GROUP BY m.mesic, d.id, l.id
+    """, month_params + department_params)
+    per_location = fetch_frame(cursor, ['mesic', 'department_id', 'location_id', 'total_bonus', 'kpi_count', 'met_count'])
+
+    # Locations without any bonus do not count towards the KPI totals, but do towards the average
+    counted = per_location['total_bonus'].fillna(0).astype(float) != 0
+    per_location = per_location.assign(
+        bonus=per_location['total_bonus'].where(counted, 0).fillna(0).astype(float),
+        active=per_location['kpi_count'].where(counted, 0).fillna(0).astype(int),
+        met=per_location['met_count'].where(counted, 0).fillna(0).astype(int),
+    )
+    location_summary = per_location.groupby(['mesic', 'department_id'], sort=False).agg(
+        celkovy_bonus=('bonus', 'sum'),
+        aktivnich_kpi=('active', 'sum'),
+        splnenych_kpi=('met', 'sum'),
+        lokalit=('location_id', 'count'),
+    ).reset_index()
+    location_summary['celkovy_bonus'] = (
+        location_summary['celkovy_bonus'] / location_summary['lokalit'].where(location_summary['lokalit'] > 0)
+    ).fillna(0)
+
+    # Own-KPI departments: evaluate their ACTIVE values with the threshold rules
+    month_filter, month_params = dialect.in_list("k.mesic", months)
+    dialect.execute(cursor, f"""
+        SELECT k.mesic, k.department_id, k.kpi_id, k.hodnota
+        FROM monthly_department_kpi_data k
+        JOIN departments d ON d.id = k.department_id
+        WHERE {month_filter} AND k.status = 'ACTIVE'
+          AND d.aktivni = TRUE AND COALESCE(d.ma_vlastni_kpi, FALSE){department_filter}
+    """, month_params + department_params)
+    own_data = fetch_frame(cursor, ['mesic', 'department_id', 'kpi_id', 'hodnota'])
+    if own_data.empty:
+        own_summary = pd.DataFrame(columns=columns)
+    else:
+        if rules is None:
+            rules = bonus_engine.compile_thresholds(load_kpi_thresholds(cursor, dialect, own_data['kpi_id'].unique()))
+        for kpi_id in bonus_engine.kpis_without_thresholds(own_data['kpi_id'].unique(), rules):
+            logger.warning("Žádné thresholdy pro KPI ID %s", kpi_id)
+        own_data = own_data.join(bonus_engine.evaluate_bonuses(own_data, rules))
+        own_summary = own_data.groupby(['mesic', 'department_id'], sort=False).agg(
+            celkovy_bonus=('bonus_procento', 'sum'),
+            aktivnich_kpi=('kpi_id', 'count'),
+            splnenych_kpi=('splneno', 'sum'),
+        ).reset_index()
+
+    summary = pd.concat([location_summary[columns], own_summary[columns]], ignore_index=True)
+    if summary.empty:
+        return summary
+
+    rows = list(zip(
+        summary['mesic'].tolist(),
+        summary['department_id'].astype(int).tolist(),
+        summary['celkovy_bonus'].astype(float).tolist(),
+        summary['aktivnich_kpi'].astype(int).tolist(),
+        summary['splnenych_kpi'].astype(int).tolist(),
+    ))
+    dialect.insert_values(cursor, """
+        INSERT INTO department_monthly_summary
+        (mesic, department_id, celkovy_bonus, aktivnich_kpi, splnenych_kpi)
+        VALUES %s
+        ON CONFLICT(mesic, department_id)
+        DO UPDATE SET
+            celkovy_bonus = EXCLUDED.celkovy_bonus,
+            aktivnich_kpi = EXCLUDED.aktivnich_kpi,
+            splnenych_kpi = EXCLUDED.splnenych_kpi
+    """, rows, "(%s, %s, %s, %s, %s)")
+    return summary
+
+# ============ REFERENCE DATA ============
+
+DEPARTMENT_COLUMNS = ['id', 'nazev', 'vedouci', 'popis', 'aktivni']
+LOCATION_COLUMNS = ['id', 'nazev', 'department_id', 'department', 'popis', 'aktivni']
+MANAGER_COLUMNS = ['id', 'jmeno', 'department_id', 'department', 'email', 'aktivni']
+KPI_COLUMNS = ['id', 'nazev', 'popis', 'jednotka', 'typ_vypoctu', 'poradi']
+
+# Tables of reference_data.ReferenceData: name -> (query, index options)
+REFERENCE_QUERIES = {
+    'departments': ("""
+        SELECT id, nazev, vedouci, popis, ma_vlastni_kpi, aktivni
+        FROM departments
+        WHERE aktivni = TRUE
+        ORDER BY nazev
+    """, {'label': 'nazev'}),
+    'locations': ("""
+        SELECT
+            l.id, l.nazev, l.department_id, d.nazev as department,
+            l.popis, l.aktivni
+        FROM locations l
+        JOIN departments d ON l.department_id = d.id
+        WHERE l.aktivni = TRUE
+        ORDER BY d.nazev, l.nazev
+    """, {'label': 'nazev', 'group_by': 'department_id'}),
+    'managers': ("""
+        SELECT
+            om.id, om.jmeno, om.department_id, d.nazev as department,
+            om.email, om.aktivni
+        FROM operational_managers om
+        JOIN departments d ON om.department_id = d.id
+        WHERE om.aktivni = TRUE
+        ORDER BY d.nazev, om.jmeno
+    """, {'label': 'jmeno', 'group_by': 'department_id'}),
+    'kpis': ("""
+        SELECT id, nazev, popis, jednotka, typ_vypoctu, poradi
+        FROM kpi_definitions
+        WHERE aktivni = TRUE
+        ORDER BY poradi
+    """, {'label': 'nazev'}),
+    'thresholds': ("""
+        SELECT t.*, k.nazev as kpi_nazev, k.jednotka
+        FROM kpi_thresholds t
+        JOIN kpi_definitions k ON t.kpi_id = k.id
+        ORDER BY k.poradi, t.poradi
+    """, {'group_by': 'kpi_id'}),
+}
+
+def load_reference_data(cursor, dialect, version):
+    """Load all reference tables on one cursor (loader of a reference_data.ReferenceStore)"""
+    tables = {}
+    for name, (query, indexes) in REFERENCE_QUERIES.items():
+        dialect.execute(cursor, query)
+        columns = [column[0] for column in cursor.description]
+        tables[name] = reference_data.ReferenceTable(name, columns, cursor.fetchall(), **indexes)
+    return reference_data.ReferenceData(version, **tables)
+
+def get_departments(dialect):
+    """Get all active departments"""
+    return dialect.reference_data().departments.frame_copy(DEPARTMENT_COLUMNS)
+
+def get_departments_with_vlastni_kpi(dialect):
+    """Get list of departments that have own KPI values"""
+    return dialect.reference_data().departments.frame_copy(['id', 'nazev', 'vedouci', 'ma_vlastni_kpi'])
+
+def get_locations(dialect):
+    """Get all active locations with department info"""
+    return dialect.reference_data().locations.frame_copy(LOCATION_COLUMNS)
+
+def get_locations_by_department(dialect, department_id):
+    """Get all locations in a department"""
+    locations = dialect.reference_data().locations
+    rows = sorted(locations.group(safe_convert_id(department_id)), key=lambda row: row.nazev)
+    return locations.to_frame(rows)[['id', 'nazev', 'popis']]
+
+def get_operational_managers(dialect):
+    """Get all active operational managers"""
+    return dialect.reference_data().managers.frame_copy(MANAGER_COLUMNS)
+
+def get_operational_managers_by_department(dialect, department_id):
+    """Get operational managers for a department"""
+    managers = dialect.reference_data().managers
+    rows = sorted(managers.group(safe_convert_id(department_id)), key=lambda row: row.jmeno)
+    return managers.to_frame(rows)[['id', 'jmeno', 'email']]
+
+def get_kpi_definitions(dialect):
+    """Get all active KPI definitions"""
+    return dialect.reference_data().kpis.frame_copy(KPI_COLUMNS)
+
+def get_kpi_thresholds(dialect, kpi_id=None):
+    """Get KPI thresholds"""
+    kpi_id = safe_convert_id(kpi_id)
+    thresholds = dialect.reference_data().thresholds
+    if kpi_id:
+        return thresholds.to_frame(thresholds.group(kpi_id))
+    return thresholds.frame_copy()
+
+# ============ WRITES ============
+
+class Rejected(Exception):
+    """Validation failure inside a write - its message is returned as is"""
+
+def write(dialect, table, statements, message, error_prefix=""):
+    """Run statements(cursor) in one transaction, with the backend's hooks
+
+    statements returns (keys for the changed/committed hooks, result).
+    Returns (success, message, result); errors roll the transaction back.
+    """
+    with dialect.connection() as conn:
+        try:
+            cursor = conn.cursor()
+            keys, result = statements(cursor)
+            dialect.changed(cursor, table, keys)
+            conn.commit()
+        except Rejected as e:
+            return False, str(e), None
+        except Exception as e:
+            return False, f"{error_prefix}{str(e)}", None
+    dialect.committed(table, keys)
+    return True, message, result
+
+def read(dialect, query, params=(), columns=None):
+    """Run one query on a connection of its own and return a DataFrame"""
+    with dialect.connection() as conn:
+        cursor = conn.cursor()
+        dialect.execute(cursor, query, params)
+        return fetch_frame(cursor, columns)
+
+# ============ DEPARTMENTS, LOCATIONS AND MANAGERS ============
+
+def add_department(dialect, nazev, vedouci=None, popis=None):
+    """Add new department"""
+    def insert(cursor):
+        dialect.execute(cursor, """
+            INSERT INTO departments (nazev, vedouci, popis)
+            VALUES (%s, %s, %s)
+        """, (nazev, vedouci, popis))
+        return (), None
+    return write(dialect, 'departments', insert, f"Oddělení '{nazev}' přidáno")[:2]
+
+def update_department_vlastni_kpi(dialect, department_id, ma_vlastni_kpi):
+    """Update whether department has own KPI values"""
+    department_id = safe_convert_id(department_id)
+
+    def update(cursor):
+        dialect.execute(cursor, """
+            UPDATE departments
+            SET ma_vlastni_kpi = %s
+            WHERE id = %s
+        """, (bool(ma_vlastni_kpi), department_id))
+        return (), None
+    return write(dialect, 'departments', update, "Nastavení vlastních KPI upraveno")[:2]
+
+def delete_department(dialect, department_id):
+    """Soft delete department (set aktivni=FALSE)"""
+    department_id = safe_convert_id(department_id)
+
+    def delete(cursor):
+        # Check if department has locations or managers
+        dialect.execute(cursor, "SELECT COUNT(*) FROM locations WHERE department_id = %s AND aktivni = TRUE",
+                        (department_id,))
+        loc_count = fetch_value(cursor)
+        dialect.execute(cursor, "SELECT COUNT(*) FROM operational_managers WHERE department_id = %s AND aktivni = TRUE",
+                        (department_id,))
+        mgr_count = fetch_value(cursor)
+        if loc_count > 0 or mgr_count > 0:
+            raise Rejected(f"Nelze smazat oddělení s aktivními lokalitami ({loc_count}) nebo provozními ({mgr_count})")
+        dialect.execute(cursor, "UPDATE departments SET aktivni = FALSE WHERE id = %s", (department_id,))
+        return (), None
+    return write(dialect, 'departments', delete, "Oddělení smazáno")[:2]
+
+def add_location(dialect, nazev, department_id, popis=None):
+    """Add new location"""
+    department_id = safe_convert_id(department_id)
+
+    def insert(cursor):
+        dialect.execute(cursor, """
+            INSERT INTO locations (nazev, department_id, popis)
+            VALUES (%s, %s, %s)
+        """, (nazev, department_id, popis))
+        return [department_id], None
+    return write(dialect, 'locations', insert, f"Lokalita '{nazev}' přidána")[:2]
+
+def update_location_department(dialect, location_id, department_id):
+    """Update location's department"""
+    location_id = safe_convert_id(location_id)
+    department_id = safe_convert_id(department_id)
+
+    def move(cursor):
+        # The location leaves its old department - both are changed
+        dialect.execute(cursor, "SELECT department_id FROM locations WHERE id = %s", (location_id,))
+        old_department_id = fetch_value(cursor)
+        dialect.execute(cursor, """
+            UPDATE locations
+            SET department_id = %s
+            WHERE id = %s
+        """, (department_id, location_id))
+        return [d for d in (department_id, old_department_id) if d is not None], None
+    return write(dialect, 'locations', move, "Lokalita přeřazena")[:2]
+
+def _deactivate(dialect, table, row_id, message):
+    """Soft delete a location or manager (set aktivni=FALSE); the hooks get its department"""
+    row_id = safe_convert_id(row_id)
+
+    def deactivate(cursor):
+        dialect.execute(cursor, f"SELECT department_id FROM {table} WHERE id = %s", (row_id,))
+        department_id = fetch_value(cursor)
+        dialect.execute(cursor, f"UPDATE {table} SET aktivni = FALSE WHERE id = %s", (row_id,))
+        return [department_id] if department_id is not None else [], None
+    return write(dialect, table, deactivate, message)[:2]
+
+def delete_location(dialect, location_id):
+    """Soft delete location (set aktivni=FALSE)"""
+    return _deactivate(dialect, 'locations', location_id, "Lokalita smazána")
+
+def add_operational_manager(dialect, jmeno, department_id, email=None):
+    """Add new operational manager; returns (success, message, new id)"""
+    department_id = safe_convert_id(department_id)
+
+    def insert(cursor):
+        return [department_id], dialect.insert_id(cursor, """
+            INSERT INTO operational_managers (jmeno, department_id, email)
+            VALUES (%s, %s, %s)
+        """, (jmeno, department_id, email))
+    return write(dialect, 'operational_managers', insert, f"Provozní '{jmeno}' přidán")
+
+def delete_operational_manager(dialect, manager_id):
+    """Soft delete operational manager (set aktivni=FALSE)"""
+    return _deactivate(dialect, 'operational_managers', manager_id, "Provozní smazán")
+
+def get_manager_kpis(dialect, manager_id):
+    """Get all KPIs assigned to a manager"""
+    return read(dialect, """
+        SELECT k.id, k.nazev, k.jednotka, k.popis
+        FROM manager_kpi_assignments a
+        JOIN kpi_definitions k ON a.kpi_id = k.id
+        WHERE a.manager_id = %s AND k.aktivni = TRUE
+        ORDER BY k.poradi
+    """, (safe_convert_id(manager_id),), ['id', 'nazev', 'jednotka', 'popis'])
+
+def set_manager_kpis(dialect, manager_id, kpi_ids):
+    """Set all KPIs for a manager (replaces existing)"""
+    manager_id = safe_convert_id(manager_id)
+    kpi_ids = [safe_convert_id(k) for k in kpi_ids] if kpi_ids else []
+
+    def replace(cursor):
+        dialect.execute(cursor, "DELETE FROM manager_kpi_assignments WHERE manager_id = %s", (manager_id,))
+        dialect.insert_values(cursor, "INSERT INTO manager_kpi_assignments (manager_id, kpi_id) VALUES %s",
+                              [(manager_id, kpi_id) for kpi_id in kpi_ids], "(%s, %s)")
+        return (), None
+    return write(dialect, 'manager_kpi_assignments', replace, f"KPI nastavena ({len(kpi_ids)} vybraných)",
+                 error_prefix="Chyba: ")[:2]
+
+# ============ KPI DEFINITIONS & THRESHOLDS ============
+
+def get_all_kpi_definitions(dialect, include_inactive=False):
+    """Get all KPI definitions (including inactive if specified)"""
+    where = "" if include_inactive else " WHERE aktivni = TRUE"
+    return read(dialect, f"SELECT * FROM kpi_definitions{where} ORDER BY poradi, nazev")
+
+def add_kpi_definition(dialect, nazev, popis=None, jednotka=None, typ_vypoctu=None, poradi=None):
+    """Add new KPI definition; returns (success, message, new id)"""
+    def insert(cursor):
+        order = poradi
+        if order is None:
+            dialect.execute(cursor, "SELECT MAX(poradi) FROM kpi_definitions")
+            order = (fetch_value(cursor) or 0) + 1
+        return (), dialect.insert_id(cursor, """
+            INSERT INTO kpi_definitions (nazev, popis, jednotka, typ_vypoctu, poradi)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (nazev, popis, jednotka, typ_vypoctu, order))
+    return write(dialect, 'kpi_definitions', insert, f"KPI '{nazev}' přidáno")
+
+def update_kpi_definition(dialect, kpi_id, nazev=None, popis=None, jednotka=None, typ_vypoctu=None, poradi=None):
+    """Update KPI definition (only the fields that are not None)"""
+    fields = {'nazev': nazev, 'popis': popis, 'jednotka': jednotka, 'typ_vypoctu': typ_vypoctu, 'poradi': poradi}
+    updates = {field: value for field, value in fields.items() if value is not None}
+    if not updates:
+        return False, "Žádné změny"
+
+    def update(cursor):
+        dialect.execute(cursor, f"UPDATE kpi_definitions SET {', '.join(f'{field} = %s' for field in updates)} WHERE id = %s",
+                        list(updates.values()) + [safe_convert_id(kpi_id)])
+        return (), None
+    return write(dialect, 'kpi_definitions', update, "KPI upraveno")[:2]
+
+def delete_kpi_definition(dialect, kpi_id):
+    """Soft delete KPI definition (set aktivni=FALSE)"""
+    def delete(cursor):
+        dialect.execute(cursor, "UPDATE kpi_definitions SET aktivni = FALSE WHERE id = %s", (safe_convert_id(kpi_id),))
+        return (), None
+    return write(dialect, 'kpi_definitions', delete, "KPI smazáno")[:2]
+
+def add_kpi_threshold(dialect, kpi_id, operator, bonus_procento, min_hodnota=None, max_hodnota=None, popis=None, poradi=None):
+    """Add new KPI threshold; returns (success, message, new id)"""
+    kpi_id = safe_convert_id(kpi_id)
+
+    def insert(cursor):
+        # Verify KPI exists
+        dialect.execute(cursor, "SELECT id FROM kpi_definitions WHERE id = %s AND aktivni = TRUE", (kpi_id,))
+        if fetch_value(cursor) is None:
+            raise Rejected(f"KPI ID {kpi_id} neexistuje nebo není aktivní")
+        order = poradi
+        if order is None:
+            dialect.execute(cursor, "SELECT MAX(poradi) FROM kpi_thresholds WHERE kpi_id = %s", (kpi_id,))
+            order = (fetch_value(cursor) or 0) + 1
+        return [kpi_id], dialect.insert_id(cursor, """
+            INSERT INTO kpi_thresholds (kpi_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, (kpi_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, order))
+    return write(dialect, 'kpi_thresholds', insert, "Hranice přidána", error_prefix="Chyba: ")
+
+def _threshold_kpi(dialect, cursor, threshold_id):
+    """KPI of a threshold (Rejected when the threshold does not exist)"""
+    dialect.execute(cursor, "SELECT kpi_id FROM kpi_thresholds WHERE id = %s", (threshold_id,))
+    kpi_id = fetch_value(cursor)
+    if kpi_id is None:
+        raise Rejected("Hranice nenalezena")
+    return kpi_id
+
+def update_kpi_threshold(dialect, threshold_id, min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi):
+    """Update KPI threshold - updates all fields"""
+    threshold_id = safe_convert_id(threshold_id)
+
+    def update(cursor):
+        kpi_id = _threshold_kpi(dialect, cursor, threshold_id)
+        dialect.execute(cursor, """
+            UPDATE kpi_thresholds
+            SET min_hodnota = %s,
+                max_hodnota = %s,
+                operator = %s,
+                bonus_procento = %s,
+                popis = %s,
+                poradi = %s
+            WHERE id = %s
+        """, (min_hodnota, max_hodnota, operator, bonus_procento, popis, poradi, threshold_id))
+        return [kpi_id], None
+    return write(dialect, 'kpi_thresholds', update, "Hranice upravena", error_prefix="Chyba: ")[:2]
+
+def delete_kpi_threshold(dialect, threshold_id):
+    """Delete KPI threshold"""
+    threshold_id = safe_convert_id(threshold_id)
+
+    def delete(cursor):
+        kpi_id = _threshold_kpi(dialect, cursor, threshold_id)
+        dialect.execute(cursor, "DELETE FROM kpi_thresholds WHERE id = %s", (threshold_id,))
+        return [kpi_id], None
+    return write(dialect, 'kpi_thresholds', delete, "Hranice smazána", error_prefix="Chyba: ")[:2]
+
+# ============ DEPARTMENT KPI DATA ============
+
+DEPARTMENT_KPI_DATA_UPSERT_SQL = """
+    INSERT INTO monthly_department_kpi_data (mesic, department_id, kpi_id, hodnota, poznamka, zdroj, updated_at)
+    VALUES %s
+    ON CONFLICT(mesic, department_id, kpi_id) DO UPDATE SET
+        hodnota = EXCLUDED.hodnota,
+        poznamka = EXCLUDED.poznamka,
+        zdroj = EXCLUDED.zdroj,
+        updated_at = CURRENT_TIMESTAMP
+"""
+DEPARTMENT_KPI_DATA_TEMPLATE = "(%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)"
+
+def add_monthly_department_kpi_data(dialect, mesic, department_id, kpi_id, hodnota, poznamka=None, zdroj="MANUAL"):
+    """Add or update monthly KPI data for department with own KPI"""
+    row = (mesic, safe_convert_id(department_id), safe_convert_id(kpi_id), hodnota, poznamka, zdroj)
+
+    def upsert(cursor):
+        dialect.insert_values(cursor, DEPARTMENT_KPI_DATA_UPSERT_SQL, [row], DEPARTMENT_KPI_DATA_TEMPLATE)
+        return (), None
+    return write(dialect, 'monthly_department_kpi_data', upsert, "Data uložena")[:2]
+
+def add_monthly_department_kpi_data_bulk(dialect, mesic, department_id, values, poznamka=None, zdroj="MANUAL"):
+    """Add or update several KPI values of one own-KPI department/month in one transaction
+
+    Upserts every value with a single statement and recalculates the
+    department's monthly summary before committing.
+
+    Args:
+        mesic: Month (YYYY-MM)
+        department_id: Department ID
+        values: {kpi_id: hodnota}
+
+    Returns:
+        (success, message, number of saved values)
+    """
+    department_id = safe_convert_id(department_id)
+    values = {int(safe_convert_id(kpi_id)): float(hodnota) for kpi_id, hodnota in values.items()}
+    if not values:
+        return True, "Data uložena", 0
+
+    def upsert(cursor):
+        dialect.execute(cursor, "SELECT id FROM departments WHERE id = %s AND aktivni = TRUE", (department_id,))
+        if fetch_value(cursor) is None:
+            raise Rejected(f"Oddělení ID {department_id} neexistuje nebo není aktivní")
+        inactive = inactive_ids(cursor, dialect, 'kpi_definitions', values.keys())
+        if inactive:
+            raise Rejected(", ".join(f"KPI ID {kpi_id} neexistuje nebo není aktivní" for kpi_id in inactive))
+
+        rows = [(mesic, department_id, kpi_id, hodnota, poznamka, zdroj) for kpi_id, hodnota in values.items()]
+        dialect.insert_values(cursor, DEPARTMENT_KPI_DATA_UPSERT_SQL, rows, DEPARTMENT_KPI_DATA_TEMPLATE)
+        summarize_departments(cursor, dialect, [mesic], dialect.rules(cursor), [department_id])
+        return (), len(rows)
+
+    success, message, saved = write(dialect, 'monthly_department_kpi_data', upsert, "Data uložena")
+    return success, message, saved or 0
+
+def get_monthly_department_kpi_data(dialect, mesic, department_id=None):
+    """Get monthly KPI data for department(s) with own KPI"""
+    department_id = safe_convert_id(department_id)
+    query = """
+        SELECT d.mesic, d.department_id, dept.nazev as department_nazev,
+               d.kpi_id, k.nazev as kpi_nazev, d.hodnota, d.poznamka, d.zdroj
+        FROM monthly_department_kpi_data d
+        JOIN departments dept ON d.department_id = dept.id
+        JOIN kpi_definitions k ON d.kpi_id = k.id
+        WHERE d.mesic = %s AND d.status = 'ACTIVE'
+    """
+    if department_id:
+        return read(dialect, query + " AND d.department_id = %s ORDER BY k.poradi", (mesic, department_id))
+    return read(dialect, query + " ORDER BY dept.nazev, k.poradi", (mesic,))
+
+DEPARTMENT_OWN_KPI_VALUE_SQL = """
+    SELECT hodnota
+    FROM monthly_department_kpi_data
+    WHERE mesic = %s AND department_id = %s AND kpi_id = %s AND status = 'ACTIVE'
+"""
+
+DEPARTMENT_AVG_KPI_VALUE_SQL = """
+    SELECT AVG(mkd.hodnota) as prumer
+    FROM monthly_kpi_data mkd
+    JOIN locations l ON mkd.location_id = l.id
+    WHERE mkd.mesic = %s AND l.department_id = %s AND mkd.kpi_id = %s
+          AND mkd.status = 'ACTIVE' AND l.aktivni = TRUE
+"""
+
+def get_department_kpi_value(dialect, mesic, department_id, kpi_id):
+    """
+    Get KPI value for department - either own value or average from locations
+    Returns: (hodnota, zdroj) where zdroj is 'VLASTNI' or 'PRUMER_Z_LOKALIT'
+    """
+    department_id = safe_convert_id(department_id)
+    kpi_id = safe_convert_id(kpi_id)
+    with dialect.connection() as conn:
+        cursor = conn.cursor()
+        # Check if department has own KPI
+        dialect.execute(cursor, "SELECT ma_vlastni_kpi FROM departments WHERE id = %s", (department_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None, None
+        ma_vlastni_kpi = row['ma_vlastni_kpi']
+
+        if ma_vlastni_kpi:
+            dialect.execute(cursor, DEPARTMENT_OWN_KPI_VALUE_SQL, (mesic, department_id, kpi_id))
+            source = 'VLASTNI'
+        else:
+            dialect.execute(cursor, DEPARTMENT_AVG_KPI_VALUE_SQL, (mesic, department_id, kpi_id))
+            source = 'PRUMER_Z_LOKALIT'
+        value = fetch_value(cursor)
+    return (value, source) if value is not None else (None, None)
+
+def get_department_monthly_summary(dialect, mesic=None, department_id=None):
+    """Get department monthly KPI summary"""
+    department_id = safe_convert_id(department_id)
+    query = """
+        SELECT
+            s.mesic, s.department_id, d.nazev as department,
+            s.celkovy_bonus, s.aktivnich_kpi, s.splnenych_kpi
+        FROM department_monthly_summary s
+        JOIN departments d ON s.department_id = d.id
+        WHERE 1=1
+    """
+
+    params = []
+    if mesic:
+        query += " AND s.mesic = %s"
+        params.append(mesic)
+    if department_id:
+        query += " AND s.department_id = %s"
+        params.append(department_id)
+
+    query += " ORDER BY s.mesic DESC, d.nazev"
+    return read(dialect, query, params)
@@ -0,0 +1,110 @@
+"""
+📊 Přehled must cost a fixed number of database round-trips per render
+
+app_cz.py is rendered with streamlit's AppTest on chains with 5 and 500
+locations; the statements counted by the backend's query recorder for a cold
+render of the page have to be the same. SQLite runs in a temporary file,
+PostgreSQL only against RESTO_BENCH_DSN (its data is replaced).
+"""
+
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import storage
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app_cz.py")
+PAGE = "📊 Přehled"
+MESIC = "2025-12"
+DEPARTMENTS = 5
+SIZES = [1, 100]  # locations per department -> 5 and 500 locations
+KPIS = [(1, "Audit", "%", 90.0), (2, "Hodnocení", "★", 4.6), (3, "Obratohodina", "Kč/h", 1250.0)]
+
+# Children first (delete order); derived PostgreSQL tables are rebuilt below
+TABLES = ['department_monthly_summary', 'monthly_department_kpi_data', 'monthly_kpi_evaluation', 'monthly_kpi_data',
+          'manager_kpi_assignments', 'kpi_thresholds', 'kpi_definitions', 'operational_managers', 'locations',
+          'departments']
+POSTGRES_TABLES = ['monthly_kpi_cube', 'recalc_jobs', 'recalc_dirty', 'month_catalog']
+
+def seed(backend, locations_per_department):
+    """Replace the backend's data with DEPARTMENTS departments, one manager each, and one evaluated month"""
+    location_count = DEPARTMENTS * locations_per_department
+    rows = {
+        'departments': (['id', 'nazev', 'vedouci', 'ma_vlastni_kpi', 'aktivni'],
+                        [(d, f"Oddělení {d}", f"Vedoucí {d}", False, True) for d in range(1, DEPARTMENTS + 1)]),
+        'locations': (['id', 'nazev', 'department_id', 'aktivni'],
+                      [(l, f"Restaurace {l:04d}", (l - 1) // locations_per_department + 1, True)
+                       for l in range(1, location_count + 1)]),
+        'operational_managers': (['id', 'jmeno', 'department_id', 'aktivni'],
+                                 [(d, f"Provozní {d}", d, True) for d in range(1, DEPARTMENTS + 1)]),
+        'kpi_definitions': (['id', 'nazev', 'jednotka', 'aktivni', 'poradi'],
+                            [(k, nazev, jednotka, True, k) for k, nazev, jednotka, _ in KPIS]),
+        'kpi_thresholds': (['id', 'kpi_id', 'min_hodnota', 'operator', 'bonus_procento', 'poradi'],
+                           [(k, k, limit, "≥", 10, 1) for k, _, _, limit in KPIS]),
+        'monthly_kpi_data': (['mesic', 'location_id', 'kpi_id', 'hodnota', 'status', 'zdroj'],
+                             [(MESIC, l, k, limit + (l % 3) - 1, 'ACTIVE', 'IMPORT')
+                              for l in range(1, location_count + 1) for k, _, _, limit in KPIS]),
+    }
+
+    dialect = backend.DIALECT
+    with backend.connection() as conn:
+        cursor = conn.cursor()
+        if dialect.name == 'postgres':
+            cursor.execute(f"TRUNCATE {', '.join(TABLES + POSTGRES_TABLES)} RESTART IDENTITY CASCADE")
+        else:
+            for table in TABLES:
+                cursor.execute(f"DELETE FROM {table}")
+        for table, (columns, values) in rows.items():
+            dialect.insert_values(cursor, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s",
+                                  values, "(" + ", ".join(["%s"] * len(columns)) + ")")
+        backend.refresh_month_catalog(cursor)
+        conn.commit()
+    backend.clear_cache()
+    assert backend.calculate_monthly_kpi_evaluation(MESIC) == location_count * len(KPIS)
+
+def render_statements(backend, locations_per_department):
+    """(statements, rendered locations) of a cold render of the page"""
+    seed(backend, locations_per_department)
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.session_state.authenticated = True
+    at.session_state.data_loaded = True
+    at.run()  # first render initializes the database and lands on the default page
+
+    [navigation] = [radio for radio in at.radio if radio.label == "Navigace"]
+    navigation.set_value(PAGE)
+    backend.clear_cache()
+    backend.reset_query_stats()
+    at.run()
+
+    assert not at.exception, [e.value for e in at.exception]
+    assert at.title[0].value.startswith(PAGE)
+    locations = sum(1 for markdown in at.markdown if markdown.value.startswith("**📍"))
+    return backend.get_query_stats()['statements'], locations
+
+def assert_constant_roundtrips(backend):
+    small, large = (render_statements(backend, size) for size in SIZES)
+    assert small[1] == DEPARTMENTS * SIZES[0]
+    assert large[1] == DEPARTMENTS * SIZES[1]
+    assert small[0] > 0
+    assert small[0] == large[0]
+
+def test_sqlite_overview_roundtrips_do_not_grow(tmp_path, monkeypatch):
+    monkeypatch.setenv("RESTO_BACKEND", "sqlite")
+    backend = storage.get_backend()
+    monkeypatch.setattr(backend, 'DATABASE_FILE', str(tmp_path / "resto_test.db"))
+    monkeypatch.setattr(backend._query_stats, 'slow_log', None)
+    try:
+        backend.init_database()
+        assert_constant_roundtrips(backend)
+    finally:
+        backend.close_connection()
+
+@pytest.mark.skipif(not os.environ.get("RESTO_BENCH_DSN"), reason="needs RESTO_BENCH_DSN (its data is replaced)")
+def test_postgres_overview_roundtrips_do_not_grow(monkeypatch):
+    monkeypatch.setenv("RESTO_BACKEND", "postgres")
+    monkeypatch.setenv("RESTO_DATABASE_URL", os.environ["RESTO_BENCH_DSN"])
+    backend = storage.get_backend()
+    monkeypatch.setattr(backend._query_stats, 'slow_log', None)
+    backend.init_database()
+    assert_constant_roundtrips(backend)